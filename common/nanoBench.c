@@ -55,10 +55,11 @@ void* runtime_rdi;
 void* runtime_rsi;
 void* runtime_rsp;
 int64_t pfc_mem[MAX_PROGRAMMABLE_COUNTERS];
+int64_t region_mem[MAX_REGIONS][MAX_PROGRAMMABLE_COUNTERS];
 void* RSP_mem;
 
-int64_t* measurement_results[MAX_PROGRAMMABLE_COUNTERS];
-int64_t* measurement_results_base[MAX_PROGRAMMABLE_COUNTERS];
+int64_t* measurement_results[N_RESULT_ARRAYS];
+int64_t* measurement_results_base[N_RESULT_ARRAYS];
 
 int cpu = -1;
 
@@ -413,11 +414,47 @@ size_t get_required_runtime_code_length() {
     for (size_t i=0; i+7<code_length; i++) {
         if (starts_with_magic_bytes(&code[i], MAGIC_BYTES_CODE_PFC_START) || starts_with_magic_bytes(&code[i], MAGIC_BYTES_CODE_PFC_STOP)) {
             req_code_length += 100;
+        } else if (starts_with_magic_bytes(&code[i], MAGIC_BYTES_CODE_PFC_REGION)) {
+            req_code_length += 300;
         }
     }
     return code_init_length + 2*unroll_count*req_code_length + 10000;
 }
 
+size_t count_region_markers() {
+    size_t n_markers = 0;
+    for (size_t i=0; i+7<code_length; i++) {
+        if (starts_with_magic_bytes(&code[i], MAGIC_BYTES_CODE_PFC_REGION)) {
+            n_markers++;
+        }
+    }
+    return n_markers;
+}
+
+size_t get_n_regions() {
+    if (!no_mem) return 0;
+    size_t n_regions = count_region_markers();
+    return (n_regions > MAX_REGIONS) ? MAX_REGIONS : n_regions;
+}
+
+// Writes code that adds the counter values (which are in R8, R9, ... in the no_mem templates) to region_mem[region], and then sets them to 0. Returns the
+// length of the code.
+size_t write_region_code(char* rc, size_t region, int n_counters) {
+    size_t rcI = 0;
+    rc[rcI++] = '\x50'; // push RAX
+    rc[rcI++] = '\x48'; rc[rcI++] = '\xB8';
+    *(void**)(&rc[rcI]) = region_mem[region]; rcI += 8; // mov RAX, region_mem[region]
+    for (int c=0; c<n_counters; c++) {
+        rc[rcI++] = '\x4C'; rc[rcI++] = '\x01'; rc[rcI++] = (char)(0x40 | (c << 3)); rc[rcI++] = (char)(8*c); // add [RAX+8*c], R(8+c)
+    }
+    for (int c=0; c<n_counters; c++) {
+        rc[rcI++] = '\x49'; rc[rcI++] = '\xC7'; rc[rcI++] = (char)(0xC0 | c);
+        *(int32_t*)(&rc[rcI]) = 0; rcI += 4; // mov R(8+c), 0
+    }
+    rc[rcI++] = '\x58'; // pop RAX
+    return rcI;
+}
+
 size_t get_distance_to_code(char* measurement_template, size_t templateI) {
     size_t dist = 0;
     while (!starts_with_magic_bytes(&measurement_template[templateI], MAGIC_BYTES_CODE)) {
@@ -431,7 +468,7 @@ size_t get_distance_to_code(char* measurement_template, size_t templateI) {
     return dist;
 }
 
-void create_runtime_code(char* measurement_template, long local_unroll_count, long local_loop_count) {
+void create_runtime_code(char* measurement_template, int n_counters, long local_unroll_count, long local_loop_count) {
     size_t templateI = 0;
     size_t codeI = 0;
     long unrollI = 0;
@@ -439,10 +476,14 @@ void create_runtime_code(char* measurement_template, long local_unroll_count, lo
     size_t rcI_code_start = 0;
     size_t magic_bytes_pfc_start_I = 0;
     size_t magic_bytes_code_I = 0;
+    size_t regionI = 0;
+    int pfc_stopped = 0;
+    int region_pending = 0;
 
     int code_contains_magic_bytes = 0;
     for (size_t i=0; i+7<code_length; i++) {
-        if (starts_with_magic_bytes(&code[i], MAGIC_BYTES_CODE_PFC_START) || starts_with_magic_bytes(&code[i], MAGIC_BYTES_CODE_PFC_STOP)) {
+        if (starts_with_magic_bytes(&code[i], MAGIC_BYTES_CODE_PFC_START) || starts_with_magic_bytes(&code[i], MAGIC_BYTES_CODE_PFC_STOP) ||
+                starts_with_magic_bytes(&code[i], MAGIC_BYTES_CODE_PFC_REGION)) {
             if (!no_mem) {
                 print_error("starting/stopping the counters is only supported in no_mem mode");
                 return;
@@ -451,6 +492,10 @@ void create_runtime_code(char* measurement_template, long local_unroll_count, lo
             break;
         }
     }
+    if (count_region_markers() > MAX_REGIONS) {
+        print_error("the code contains more than %d region markers", MAX_REGIONS);
+        return;
+    }
 
     while (!starts_with_magic_bytes(&measurement_template[templateI], MAGIC_BYTES_TEMPLATE_END)) {
         if (starts_with_magic_bytes(&measurement_template[templateI], MAGIC_BYTES_INIT)) {
@@ -491,11 +536,24 @@ void create_runtime_code(char* measurement_template, long local_unroll_count, lo
                     while (codeI < code_length) {
                         if (codeI+7 < code_length && starts_with_magic_bytes(&code[codeI], MAGIC_BYTES_CODE_PFC_START)) {
                             codeI += 8;
+                            pfc_stopped = 0;
                             templateI = magic_bytes_pfc_start_I;
                             goto continue_outer_loop;
                         }
                         if (codeI+7 < code_length && starts_with_magic_bytes(&code[codeI], MAGIC_BYTES_CODE_PFC_STOP)) {
                             codeI += 8;
+                            pfc_stopped = 1;
+                            goto continue_outer_loop;
+                        }
+                        if (codeI+7 < code_length && starts_with_magic_bytes(&code[codeI], MAGIC_BYTES_CODE_PFC_REGION)) {
+                            codeI += 8;
+                            if (pfc_stopped) {
+                                rcI += write_region_code(&runtime_code[rcI], regionI++, n_counters);
+                                continue;
+                            }
+                            // the counters are read (as for a stop marker), then the region code is written (see MAGIC_BYTES_PFC_END), and then the
+                            // counters are started again
+                            region_pending = 1;
                             goto continue_outer_loop;
                         }
                         runtime_code[rcI++] = code[codeI];
@@ -503,6 +561,7 @@ void create_runtime_code(char* measurement_template, long local_unroll_count, lo
                     }
                     unrollI++;
                     codeI = 0;
+                    regionI = 0;
                 }
             }
 
@@ -518,7 +577,11 @@ void create_runtime_code(char* measurement_template, long local_unroll_count, lo
                 }
             }
         } else if (starts_with_magic_bytes(&measurement_template[templateI], MAGIC_BYTES_PFC_END)) {
-            if (unrollI < local_unroll_count) {
+            if (region_pending) {
+                rcI += write_region_code(&runtime_code[rcI], regionI++, n_counters);
+                region_pending = 0;
+                templateI = magic_bytes_pfc_start_I;
+            } else if (unrollI < local_unroll_count) {
                 templateI = magic_bytes_code_I;
             } else {
                 templateI += 8;
@@ -600,10 +663,10 @@ void create_and_run_one_time_init_code() {
     ((void(*)(void))runtime_one_time_init_code)();
 }
 
-void run_warmup_experiment(char* measurement_template) {
+void run_warmup_experiment(char* measurement_template, int n_counters) {
     if (!initial_warm_up_count) return;
 
-    create_runtime_code(measurement_template, unroll_count, loop_count);
+    create_runtime_code(measurement_template, n_counters, unroll_count, loop_count);
 
     for (int i=0; i<initial_warm_up_count; i++) {
         ((void(*)(void))runtime_code)();
@@ -611,7 +674,8 @@ void run_warmup_experiment(char* measurement_template) {
 }
 
 void run_experiment(char* measurement_template, int64_t* results[], int n_counters, long local_unroll_count, long local_loop_count) {
-    create_runtime_code(measurement_template, local_unroll_count, local_loop_count);
+    create_runtime_code(measurement_template, n_counters, local_unroll_count, local_loop_count);
+    size_t n_regions = get_n_regions();
 
     #ifdef __KERNEL__
         get_cpu();
@@ -620,6 +684,8 @@ void run_experiment(char* measurement_template, int64_t* results[], int n_counte
     #endif
 
     for (long ri=-warm_up_count; ri<n_measurements; ri++) {
+        if (n_regions) memset(region_mem, 0, sizeof(region_mem));
+
         ((void(*)(void))runtime_code)();
 
         // ignore "warm-up" runs (ri<0), but don't execute different branches
@@ -627,6 +693,12 @@ void run_experiment(char* measurement_template, int64_t* results[], int n_counte
         for (int c=0; c<n_counters; c++) {
                 results[c][ri_] = pfc_mem[c];
         }
+        for (size_t r=0; r<n_regions; r++) {
+            for (int c=0; c<n_counters; c++) {
+                results[c][ri_] += region_mem[r][c];
+                results[REGION_RESULT_INDEX(c, r)][ri_] = region_mem[r][c];
+            }
+        }
     }
 
     #ifdef __KERNEL__
@@ -635,14 +707,18 @@ void run_experiment(char* measurement_template, int64_t* results[], int n_counte
     #endif
 }
 
+int64_t get_n_rep() {
+    if (loop_count == 0) {
+        return unroll_count;
+    }
+    return loop_count * unroll_count;
+}
+
 char* compute_result_str(char* buf, size_t buf_len, char* desc, int counter) {
     int64_t agg = get_aggregate_value_100(measurement_results[counter], n_measurements);
     int64_t agg_base = get_aggregate_value_100(measurement_results_base[counter], n_measurements);
 
-    int64_t n_rep = loop_count * unroll_count;
-    if (loop_count == 0) {
-        n_rep = unroll_count;
-    }
+    int64_t n_rep = get_n_rep();
 
     int64_t result = ((agg-agg_base) + n_rep/2)/n_rep;
 
@@ -1217,11 +1293,11 @@ void measurement_FF_template_Intel_noMem() {
         "mov rcx, 0x40000002                     \n"
         "lfence; rdpmc; lfence                   \n"
         "shl rdx, 32; or rdx, rax                \n"
-        "sub r10, rdx                            \n"
+        "sub r11, rdx                            \n"
         "mov rcx, 0x40000001                     \n"
         "lfence; rdpmc; lfence                   \n"
         "shl rdx, 32; or rdx, rax                \n"
-        "sub r11, rdx                            \n"
+        "sub r10, rdx                            \n"
         "lfence                                  \n"
         ".att_syntax noprefix                    ");
     asm(".quad "STRINGIFY(MAGIC_BYTES_CODE));
@@ -1231,7 +1307,7 @@ void measurement_FF_template_Intel_noMem() {
         "mov rcx, 0x40000001                     \n"
         "lfence; rdpmc; lfence                   \n"
         "shl rdx, 32; or rdx, rax                \n"
-        "add r11, rdx                            \n"
+        "add r10, rdx                            \n"
         "mov rcx, 0x40000000                     \n"
         "lfence; rdpmc; lfence                   \n"
         "shl rdx, 32; or rdx, rax                \n"
@@ -1239,7 +1315,7 @@ void measurement_FF_template_Intel_noMem() {
         "mov rcx, 0x40000002                     \n"
         "lfence; rdpmc; lfence                   \n"
         "shl rdx, 32; or rdx, rax                \n"
-        "add r10, rdx                            \n"
+        "add r11, rdx                            \n"
         "lfence; rdtsc; lfence                   \n"
         "shl rdx, 32; or rdx, rax                \n"
         "add r8, rdx                             \n"
@@ -1250,8 +1326,8 @@ void measurement_FF_template_Intel_noMem() {
         "mov r15, "STRINGIFY(MAGIC_BYTES_PFC)"   \n"
         "mov [r15], r8                           \n"
         "mov [r15+8], r9                         \n"
-        "mov [r15+16], r11                       \n"
-        "mov [r15+24], r10                       \n"
+        "mov [r15+16], r10                       \n"
+        "mov [r15+24], r11                       \n"
         ".att_syntax noprefix                    ");
     RESTORE_REGS_FLAGS();
     asm(".quad "STRINGIFY(MAGIC_BYTES_TEMPLATE_END));
@@ -179,11 +179,21 @@ extern void* runtime_rsp;
 // Stores performance counter values during measurements.
 extern int64_t pfc_mem[MAX_PROGRAMMABLE_COUNTERS];
 
+// Maximum number of regions in the benchmark code (see MAGIC_BYTES_CODE_PFC_REGION).
+#define MAX_REGIONS 16
+
+// Stores the performance counter values of the regions during measurements.
+extern int64_t region_mem[MAX_REGIONS][MAX_PROGRAMMABLE_COUNTERS];
+
 // Stores the RSP during measurements.
 extern void* RSP_mem;
 
-extern int64_t* measurement_results[MAX_PROGRAMMABLE_COUNTERS];
-extern int64_t* measurement_results_base[MAX_PROGRAMMABLE_COUNTERS];
+// The results for counter c are stored at index c; the results for counter c in region r are stored at index REGION_RESULT_INDEX(c, r).
+#define N_RESULT_ARRAYS (MAX_PROGRAMMABLE_COUNTERS * (MAX_REGIONS+1))
+#define REGION_RESULT_INDEX(c, r) ((c) + ((r)+1)*MAX_PROGRAMMABLE_COUNTERS)
+
+extern int64_t* measurement_results[N_RESULT_ARRAYS];
+extern int64_t* measurement_results_base[N_RESULT_ARRAYS];
 
 // Process should be pinned to this CPU.
 extern int cpu;
@@ -211,11 +221,21 @@ void configure_MSRs(struct msr_config config);
 
 size_t get_required_runtime_code_length(void);
 
-void create_runtime_code(char* measurement_template, long local_unroll_count, long local_loop_count);
-void run_warmup_experiment(char* measurement_template);
+// Returns the number of region markers in the benchmark code.
+size_t count_region_markers(void);
+
+// Returns the number of regions for which results are reported (0 if not in no_mem mode, and at most MAX_REGIONS).
+size_t get_n_regions(void);
+
+// n_counters is the number of counters that the measurement template reads.
+void create_runtime_code(char* measurement_template, int n_counters, long local_unroll_count, long local_loop_count);
+void run_warmup_experiment(char* measurement_template, int n_counters);
 void run_experiment(char* measurement_template, int64_t* results[], int n_counters, long local_unroll_count, long local_loop_count);
 void create_and_run_one_time_init_code(void);
 
+// Returns the number of repetitions of the benchmark code by which the difference between the main and the base run is divided.
+int64_t get_n_rep(void);
+
 char* compute_result_str(char* buf, size_t buf_len, char* desc, int counter);
 int64_t get_aggregate_value_100(int64_t* values, size_t length);
 int cmpInt64(const void *a, const void *b);
@@ -241,6 +261,11 @@ void print_all_measurement_results(int64_t* results[], int n_counters);
 #define MAGIC_BYTES_CODE_PFC_START 0xE0b513b1C2813F04
 #define MAGIC_BYTES_CODE_PFC_STOP 0xF0b513b1C2813F04
 
+// Ends a region in the benchmark code (only supported in no_mem mode). The counter values since the previous region marker (or since the beginning of the
+// code) are reported separately for each region (in addition to the total values, which include all regions). The i-th marker in the code corresponds to
+// region i; if the code is unrolled or executed in a loop, the values of the corresponding regions are summed up. Region markers access memory (region_mem).
+#define MAGIC_BYTES_CODE_PFC_REGION 0xE1b513b1C2813F04
+
 
 #define STRINGIFY2(X) #X
 #define STRINGIFY(X) STRINGIFY2(X)
@@ -15,6 +15,7 @@ fi
 cat /sys/nb/reset
 
 taskset=""
+proc_file="/proc/nanoBench"
 
 while [ "$1" ]; do
     if [[ "$1" == -asm_i* ]]; then
@@ -98,6 +99,9 @@ while [ "$1" ]; do
     elif [[ "$1" == -avg* ]]; then
         echo "avg" > /sys/nb/agg
         shift
+    elif [[ "$1" == -raw ]]; then
+        proc_file="/proc/nanoBench_raw"
+        shift
     elif [[ "$1" == -h* ]]; then
         echo "kernel-nanoBench.sh usage:"
         echo
@@ -120,6 +124,7 @@ while [ "$1" ]; do
         echo "  -no_mem:                    The code for reading the perf. ctrs. does not make memory accesses."
         echo "  -cpu <n>:                   Pins the measurement thread to CPU n."
         echo "  -verbose:                   Outputs the results of all performance counter readings."        
+        echo "  -raw:                       Outputs the results of all measurements instead of the aggregated results."
         exit 0
     else
         echo "Invalid option: $1"
@@ -127,4 +132,4 @@ while [ "$1" ]; do
     fi
 done
 
-$taskset cat /proc/nanoBench
+$taskset cat $proc_file
@@ -52,6 +52,14 @@ size_t runtime_one_time_init_code_memory_size = 0;
 void** r14_segments = NULL;
 size_t n_r14_segments = 0;
 
+char* batch = NULL;
+size_t batch_length = 0;
+size_t batch_memory_size = 0;
+
+char* r14_image = NULL;
+size_t r14_image_length = 0;
+size_t r14_image_memory_size = 0;
+
 static int read_file_into_buffer(const char *file_name, char **buf, size_t *buf_len, size_t *buf_memory_size) {
     struct file *filp = NULL;
     filp = filp_open(file_name, O_RDONLY, 0);
@@ -97,6 +105,30 @@ static int read_file_into_buffer(const char *file_name, char **buf, size_t *buf_
     return 0;
 }
 
+// Writes count bytes from data at offset off into the buffer (writes to binary sysfs files can be split into multiple chunks). A write at offset 0
+// replaces the previous content.
+static ssize_t write_into_buffer(const char *data, loff_t off, size_t count, char **buf, size_t *buf_len, size_t *buf_memory_size) {
+    if (off == 0) {
+        *buf_len = 0;
+    }
+
+    if (off + count + 1 > *buf_memory_size) {
+        size_t new_memory_size = max(2*(size_t)(off + count + 1), PAGE_SIZE);
+        char* new_buf = krealloc(*buf, new_memory_size, GFP_KERNEL);
+        if (!new_buf) {
+            printk(KERN_ERR "Could not allocate memory for code\n");
+            return -ENOMEM;
+        }
+        *buf = new_buf;
+        *buf_memory_size = new_memory_size;
+    }
+
+    memcpy(*buf + off, data, count);
+    *buf_len = off + count;
+    (*buf)[*buf_len] = '\0';
+    return count;
+}
+
 static ssize_t code_show(struct kobject *kobj, struct kobj_attribute *attr, char *buf) {
     return 0;
 }
@@ -106,6 +138,11 @@ static ssize_t code_store(struct kobject *kobj, struct kobj_attribute *attr, con
 }
 static struct kobj_attribute code_attribute =__ATTR(code, 0660, code_show, code_store);
 
+static ssize_t code_bytes_write(struct file *filp, struct kobject *kobj, struct bin_attribute *attr, char *buf, loff_t off, size_t count) {
+    return write_into_buffer(buf, off, count, &code, &code_length, &code_memory_size);
+}
+static struct bin_attribute code_bytes_attribute =__BIN_ATTR(code_bytes, 0660, NULL, code_bytes_write, 0);
+
 static ssize_t init_show(struct kobject *kobj, struct kobj_attribute *attr, char *buf) {
     return 0;
 }
@@ -115,12 +152,16 @@ static ssize_t init_store(struct kobject *kobj, struct kobj_attribute *attr, con
 }
 static struct kobj_attribute code_init_attribute =__ATTR(init, 0660, init_show, init_store);
 
+static ssize_t init_bytes_write(struct file *filp, struct kobject *kobj, struct bin_attribute *attr, char *buf, loff_t off, size_t count) {
+    return write_into_buffer(buf, off, count, &code_init, &code_init_length, &code_init_memory_size);
+}
+static struct bin_attribute code_init_bytes_attribute =__BIN_ATTR(init_bytes, 0660, NULL, init_bytes_write, 0);
+
 static ssize_t one_time_init_show(struct kobject *kobj, struct kobj_attribute *attr, char *buf) {
     return 0;
 }
-static ssize_t one_time_init_store(struct kobject *kobj, struct kobj_attribute *attr, const char *buf, size_t count) {
-    read_file_into_buffer(buf, &code_one_time_init, &code_one_time_init_length, &code_one_time_init_memory_size);
-    size_t new_runtime_one_time_init_code_memory_size = 10000 + code_one_time_init_memory_size;
+static void ensure_runtime_one_time_init_code_memory(size_t one_time_init_length) {
+    size_t new_runtime_one_time_init_code_memory_size = 10000 + one_time_init_length;
     if (new_runtime_one_time_init_code_memory_size > runtime_one_time_init_code_memory_size) {
         runtime_one_time_init_code_memory_size = new_runtime_one_time_init_code_memory_size;
         vfree(runtime_one_time_init_code);
@@ -130,10 +171,21 @@ static ssize_t one_time_init_store(struct kobject *kobj, struct kobj_attribute *
             pr_debug("failed to allocate executable memory\n");
         }
     }
+}
+static ssize_t one_time_init_store(struct kobject *kobj, struct kobj_attribute *attr, const char *buf, size_t count) {
+    read_file_into_buffer(buf, &code_one_time_init, &code_one_time_init_length, &code_one_time_init_memory_size);
+    ensure_runtime_one_time_init_code_memory(code_one_time_init_memory_size);
     return count;
 }
 static struct kobj_attribute code_one_time_init_attribute =__ATTR(one_time_init, 0660, one_time_init_show, one_time_init_store);
 
+static ssize_t one_time_init_bytes_write(struct file *filp, struct kobject *kobj, struct bin_attribute *attr, char *buf, loff_t off, size_t count) {
+    ssize_t ret = write_into_buffer(buf, off, count, &code_one_time_init, &code_one_time_init_length, &code_one_time_init_memory_size);
+    ensure_runtime_one_time_init_code_memory(code_one_time_init_memory_size);
+    return ret;
+}
+static struct bin_attribute code_one_time_init_bytes_attribute =__BIN_ATTR(one_time_init_bytes, 0660, NULL, one_time_init_bytes_write, 0);
+
 static ssize_t config_show(struct kobject *kobj, struct kobj_attribute *attr, char *buf) {
     ssize_t count = 0;
     for (int i=0; i<n_pfc_configs; i++) {
@@ -197,23 +249,34 @@ static struct kobj_attribute loop_count_attribute =__ATTR(loop_count, 0660, loop
 static ssize_t n_measurements_show(struct kobject *kobj, struct kobj_attribute *attr, char *buf) {
     return sprintf(buf, "%ld\n", n_measurements);
 }
-static ssize_t n_measurements_store(struct kobject *kobj, struct kobj_attribute *attr, const char *buf, size_t count) {
-    long old_n_measurements = n_measurements;
-    sscanf(buf, "%ld", &n_measurements);
+// Number of values that the measurement_results arrays can hold.
+long measurement_results_size = 0;
 
-    if (old_n_measurements < n_measurements) {
-        for (int i=0; i<MAX_PROGRAMMABLE_COUNTERS; i++) {
+// Makes sure that the measurement_results arrays can hold n_measurements values.
+static int ensure_measurement_results_size(void) {
+    if (measurement_results_size < n_measurements) {
+        for (int i=0; i<N_RESULT_ARRAYS; i++) {
             kfree(measurement_results[i]);
             kfree(measurement_results_base[i]);
             measurement_results[i] = kmalloc(n_measurements*sizeof(int64_t), GFP_KERNEL);
             measurement_results_base[i] = kmalloc(n_measurements*sizeof(int64_t), GFP_KERNEL);
             if (!measurement_results[i] || !measurement_results_base[i]) {
                 printk(KERN_ERR "Could not allocate memory for measurement_results\n");
-                return 0;
+                measurement_results_size = 0;
+                return -1;
             }
             memset(measurement_results[i], 0, n_measurements*sizeof(int64_t));
             memset(measurement_results_base[i], 0, n_measurements*sizeof(int64_t));
         }
+        measurement_results_size = n_measurements;
+    }
+    return 0;
+}
+
+static ssize_t n_measurements_store(struct kobject *kobj, struct kobj_attribute *attr, const char *buf, size_t count) {
+    sscanf(buf, "%ld", &n_measurements);
+    if (ensure_measurement_results_size()) {
+        return 0;
     }
     return count;
 }
@@ -289,8 +352,9 @@ int cmpPtr(const void *a, const void *b) {
     else return 1;
 }
 
-static ssize_t r14_size_show(struct kobject *kobj, struct kobj_attribute *attr, char *buf) {
-    if (n_r14_segments == 0 || !r14_segments[0]) return sprintf(buf, "0\n");
+// Returns the number of segments at the beginning of r14_segments that form a (virtually and physically) contiguous memory area.
+static size_t get_n_contiguous_r14_segments(void) {
+    if (n_r14_segments == 0 || !r14_segments[0]) return 0;
 
     void* prev_virt_addr = r14_segments[0];
     phys_addr_t prev_phys_addr = virt_to_phys(prev_virt_addr);
@@ -301,17 +365,32 @@ static ssize_t r14_size_show(struct kobject *kobj, struct kobj_attribute *attr,
         phys_addr_t cur_phys_addr = virt_to_phys(cur_virt_addr);
 
         if ((cur_virt_addr - prev_virt_addr != KMALLOC_MAX) || (cur_phys_addr - prev_phys_addr != KMALLOC_MAX)) {
-            pr_debug("No physically contiguous memory area of the requested size found.\n");
-            pr_debug("Try rebooting your computer.\n");
             break;
         }
 
         prev_virt_addr = cur_virt_addr;
         prev_phys_addr = cur_phys_addr;
     }
+    return i;
+}
+
+// Returns the size of the memory area that can be accessed with nonnegative offsets from runtime_r14.
+static size_t get_r14_size(void) {
+    if (n_r14_segments == 0) return RUNTIME_R_SIZE/2;
+    return get_n_contiguous_r14_segments()*KMALLOC_MAX;
+}
+
+static ssize_t r14_size_show(struct kobject *kobj, struct kobj_attribute *attr, char *buf) {
+    if (n_r14_segments == 0 || !r14_segments[0]) return sprintf(buf, "0\n");
+
+    size_t n_contiguous = get_n_contiguous_r14_segments();
+    if (n_contiguous < n_r14_segments) {
+        pr_debug("No physically contiguous memory area of the requested size found.\n");
+        pr_debug("Try rebooting your computer.\n");
+    }
 
     phys_addr_t phys_addr = virt_to_phys(r14_segments[0]);
-    return sprintf(buf, "R14 size: %zu MB\nVirtual address: 0x%px\nPhysical address: %pa\n", i*KMALLOC_MAX/(1024*1024), r14_segments[0], &phys_addr);
+    return sprintf(buf, "R14 size: %zu MB\nVirtual address: 0x%px\nPhysical address: %pa\n", n_contiguous*KMALLOC_MAX/(1024*1024), r14_segments[0], &phys_addr);
 }
 static ssize_t r14_size_store(struct kobject *kobj, struct kobj_attribute *attr, const char *buf, size_t count) {
     if (n_r14_segments > 0) {
@@ -354,6 +433,50 @@ static ssize_t print_r14_store(struct kobject *kobj, struct kobj_attribute *attr
 }
 static struct kobj_attribute print_r14_attribute =__ATTR(print_r14, 0660, print_r14_show, print_r14_store);
 
+// Format of /sys/nb/r14_image: a sequence of r14_image_entry structs. Before the one-time initialization code is executed, the address
+// runtime_r14+target is written to runtime_r14+offset for every entry (0 is written if target is R14_IMAGE_NULL). This is much faster than
+// one-time initialization code that creates long pointer-chasing chains. The image is removed by reading /sys/nb/clear or /sys/nb/reset.
+#define R14_IMAGE_NULL ((uint64_t)-1)
+
+struct r14_image_entry {
+    uint64_t offset;
+    uint64_t target;
+};
+
+static ssize_t r14_image_write(struct file *filp, struct kobject *kobj, struct bin_attribute *attr, char *buf, loff_t off, size_t count) {
+    return write_into_buffer(buf, off, count, &r14_image, &r14_image_length, &r14_image_memory_size);
+}
+static struct bin_attribute r14_image_attribute =__BIN_ATTR(r14_image, 0660, NULL, r14_image_write, 0);
+
+static int apply_r14_image(void) {
+    if (r14_image_length % sizeof(struct r14_image_entry)) {
+        printk(KERN_ERR "Invalid length of r14_image: %zu\n", r14_image_length);
+        return -1;
+    }
+
+    size_t r14_size = get_r14_size();
+    struct r14_image_entry* entries = (struct r14_image_entry*)r14_image;
+    size_t n_entries = r14_image_length / sizeof(struct r14_image_entry);
+    for (size_t i=0; i<n_entries; i++) {
+        uint64_t offset = entries[i].offset;
+        uint64_t target = entries[i].target;
+        if (r14_size < sizeof(void*) || offset > r14_size - sizeof(void*) || (target != R14_IMAGE_NULL && target >= r14_size)) {
+            printk(KERN_ERR "r14_image entry %zu out of bounds (R14 size: %zu)\n", i, r14_size);
+            return -1;
+        }
+        *(void**)(runtime_r14 + offset) = (target == R14_IMAGE_NULL) ? NULL : (runtime_r14 + target);
+    }
+    return 0;
+}
+
+static ssize_t max_regions_show(struct kobject *kobj, struct kobj_attribute *attr, char *buf) {
+    return sprintf(buf, "%d\n", MAX_REGIONS);
+}
+static ssize_t max_regions_store(struct kobject *kobj, struct kobj_attribute *attr, const char *buf, size_t count) {
+    return count;
+}
+static struct kobj_attribute max_regions_attribute =__ATTR(max_regions, 0660, max_regions_show, max_regions_store);
+
 static ssize_t code_offset_show(struct kobject *kobj, struct kobj_attribute *attr, char *buf) {
     return sprintf(buf, "%zu\n", code_offset);
 }
@@ -375,6 +498,7 @@ static struct kobj_attribute verbose_attribute =__ATTR(verbose, 0660, verbose_sh
 static ssize_t clear_show(struct kobject *kobj, struct kobj_attribute *attr, char *buf) {
     code_init_length = 0;
     code_length = 0;
+    r14_image_length = 0;
     return 0;
 }
 static ssize_t clear_store(struct kobject *kobj, struct kobj_attribute *attr, const char *buf, size_t count) {
@@ -397,6 +521,7 @@ static ssize_t reset_show(struct kobject *kobj, struct kobj_attribute *attr, cha
     code_init_length = 0;
     code_length = 0;
     code_offset = 0;
+    r14_image_length = 0;
     n_pfc_configs = 0;
     n_msr_configs = 0;
 
@@ -407,14 +532,94 @@ static ssize_t reset_store(struct kobject *kobj, struct kobj_attribute *attr, co
 }
 static struct kobj_attribute reset_attribute =__ATTR(reset, 0660, reset_show, reset_store);
 
+// Output formats of the files in /proc/ (stored in the private field of the seq_file)
+enum output_format {OUTPUT_TEXT, OUTPUT_RAW, OUTPUT_BIN};
+
+// Format of /proc/nanoBench_bin: one nb_bin_header, followed by one record for each counter. A record consists of the name of the counter
+// (NB_BIN_NAME_LENGTH bytes, null-terminated), the results of the main run (n_measurements int64 values), the results of the base run (n_measurements
+// int64 values), and the aggregate values (times 100) of the main and the base run (as computed by get_aggregate_value_100; two int64 values).
+#define NB_BIN_MAGIC 0x4E42494E
+#define NB_BIN_VERSION 2
+#define NB_BIN_NAME_LENGTH 64
+
+struct nb_bin_header {
+    uint32_t magic;
+    uint32_t version;
+    uint32_t n_measurements;
+    uint32_t name_length;
+    int64_t n_rep;
+    uint32_t n_counters;
+    uint32_t reserved;
+};
+
+// Returns the number of counters for which show() outputs results (each region is counted separately).
+static size_t get_n_result_counters(void) {
+    size_t n = (is_AMD_CPU?3:4) + n_msr_configs;
+    for (size_t i=0; i<n_pfc_configs; i++) {
+        if (!pfc_configs[i].invalid) n++;
+    }
+    return n * (1 + get_n_regions());
+}
+
+static size_t get_bin_output_size(void) {
+    return sizeof(struct nb_bin_header) + get_n_result_counters() * (NB_BIN_NAME_LENGTH + (2 * n_measurements + 2) * sizeof(int64_t));
+}
+
+// Prints the result with the given index in the measurement_results arrays. For /proc/nanoBench_raw, the results of all measurements are printed in the
+// format "desc: n_rep; results of the main run; results of the base run". For /proc/nanoBench_bin, a binary record (see above) is written.
+static void print_single_result(struct seq_file *m, char* desc, int counter) {
+    if ((long)m->private == OUTPUT_BIN) {
+        char name[NB_BIN_NAME_LENGTH] = {0};
+        strncpy(name, desc, NB_BIN_NAME_LENGTH-1);
+        seq_write(m, name, NB_BIN_NAME_LENGTH);
+        // the raw results need to be written first, as get_aggregate_value_100 may sort them
+        seq_write(m, measurement_results[counter], n_measurements*sizeof(int64_t));
+        seq_write(m, measurement_results_base[counter], n_measurements*sizeof(int64_t));
+        int64_t agg[2];
+        agg[0] = get_aggregate_value_100(measurement_results[counter], n_measurements);
+        agg[1] = get_aggregate_value_100(measurement_results_base[counter], n_measurements);
+        seq_write(m, agg, sizeof(agg));
+    } else if ((long)m->private == OUTPUT_RAW) {
+        seq_printf(m, "%s: %lld;", desc, (long long)get_n_rep());
+        for (int i=0; i<n_measurements; i++) {
+            seq_printf(m, " %lld", (long long)measurement_results[counter][i]);
+        }
+        seq_printf(m, ";");
+        for (int i=0; i<n_measurements; i++) {
+            seq_printf(m, " %lld", (long long)measurement_results_base[counter][i]);
+        }
+        seq_printf(m, "\n");
+    } else {
+        char buf[100];
+        seq_printf(m, "%s", compute_result_str(buf, sizeof(buf), desc, counter));
+    }
+}
+
+// Prints the result for the counter, followed by the results for the regions of the code (with the description "desc (region i)").
+static void print_result(struct seq_file *m, char* desc, int counter) {
+    print_single_result(m, desc, counter);
+
+    size_t n_regions = get_n_regions();
+    for (size_t r=0; r<n_regions; r++) {
+        char region_desc[NB_BIN_NAME_LENGTH];
+        snprintf(region_desc, sizeof(region_desc), "%s (region %zu)", desc, r);
+        print_single_result(m, region_desc, REGION_RESULT_INDEX(counter, r));
+    }
+}
+
 static int show(struct seq_file *m, void *v) {
-    for (int i=0; i<MAX_PROGRAMMABLE_COUNTERS; i++) {
+    for (int i=0; i<N_RESULT_ARRAYS; i++) {
         if (!measurement_results[i] || !measurement_results_base[i]) {
             printk(KERN_ERR "Could not allocate memory for measurement_results\n");
             return -1;
         }
     }
 
+    if (count_region_markers() > MAX_REGIONS) {
+        printk(KERN_ERR "The code contains more than %d region markers\n", MAX_REGIONS);
+        return -1;
+    }
+
     size_t req_code_length = code_offset + get_required_runtime_code_length();
     if (req_code_length > runtime_code_base_memory_size) {
         printk(KERN_ERR "Maximum supported code size %zu kB; requested %zu kB\n", runtime_code_base_memory_size/1024, req_code_length/1024);
@@ -422,6 +627,15 @@ static int show(struct seq_file *m, void *v) {
     }
     runtime_code = runtime_code_base + code_offset;
 
+    if (apply_r14_image()) {
+        return -1;
+    }
+
+    if ((long)m->private == OUTPUT_BIN) {
+        struct nb_bin_header header = {NB_BIN_MAGIC, NB_BIN_VERSION, n_measurements, NB_BIN_NAME_LENGTH, get_n_rep(), get_n_result_counters(), 0};
+        seq_write(m, &header, sizeof(header));
+    }
+
     kernel_fpu_begin();
 
     long base_unroll_count = (basic_mode?0:unroll_count);
@@ -429,7 +643,6 @@ static int show(struct seq_file *m, void *v) {
     long base_loop_count = (basic_mode?0:loop_count);
     long main_loop_count = loop_count;
 
-    char buf[100];
     char* measurement_template;
 
     /*********************************
@@ -451,7 +664,7 @@ static int show(struct seq_file *m, void *v) {
 
     configure_perf_ctrs_FF(0, 1);
     create_and_run_one_time_init_code();
-    run_warmup_experiment(measurement_template);
+    run_warmup_experiment(measurement_template, is_AMD_CPU?3:4);
 
     if (is_AMD_CPU) {
         run_experiment(measurement_template, measurement_results_base, 3, base_unroll_count, base_loop_count);
@@ -464,9 +677,9 @@ static int show(struct seq_file *m, void *v) {
             print_all_measurement_results(measurement_results, 3);
         }
 
-        seq_printf(m, "%s", compute_result_str(buf, sizeof(buf), "RDTSC", 0));
-        seq_printf(m, "%s", compute_result_str(buf, sizeof(buf), "MPERF", 1));
-        seq_printf(m, "%s", compute_result_str(buf, sizeof(buf), "APERF", 2));
+        print_result(m, "RDTSC", 0);
+        print_result(m, "MPERF", 1);
+        print_result(m, "APERF", 2);
     } else {
         run_experiment(measurement_template, measurement_results_base, 4, base_unroll_count, base_loop_count);
         run_experiment(measurement_template, measurement_results, 4, main_unroll_count, main_loop_count);
@@ -478,10 +691,10 @@ static int show(struct seq_file *m, void *v) {
             print_all_measurement_results(measurement_results, 4);
         }
 
-        seq_printf(m, "%s", compute_result_str(buf, sizeof(buf), "RDTSC", 0));
-        seq_printf(m, "%s", compute_result_str(buf, sizeof(buf), "Instructions retired", 1));
-        seq_printf(m, "%s", compute_result_str(buf, sizeof(buf), "Core cycles", 2));
-        seq_printf(m, "%s", compute_result_str(buf, sizeof(buf), "Reference cycles", 3));
+        print_result(m, "RDTSC", 0);
+        print_result(m, "Instructions retired", 1);
+        print_result(m, "Core cycles", 2);
+        print_result(m, "Reference cycles", 3);
     }
 
     /*********************************
@@ -524,7 +737,7 @@ static int show(struct seq_file *m, void *v) {
         }
 
         for (int c=0; c < n_programmable_counters && i + c < n_pfc_configs; c++) {
-            if (!pfc_configs[i+c].invalid) seq_printf(m, "%s", compute_result_str(buf, sizeof(buf), pfc_configs[i+c].description, c));
+            if (!pfc_configs[i+c].invalid) print_result(m, pfc_configs[i+c].description, c);
         }
     }
 
@@ -551,7 +764,7 @@ static int show(struct seq_file *m, void *v) {
             print_all_measurement_results(measurement_results, 1);
         }
 
-        seq_printf(m, "%s", compute_result_str(buf, sizeof(buf), msr_configs[i].description, 0));
+        print_result(m, msr_configs[i].description, 0);
     }
 
     kernel_fpu_end();
@@ -559,7 +772,7 @@ static int show(struct seq_file *m, void *v) {
 }
 
 static int open(struct inode *inode, struct  file *file) {
-    return single_open(file, show, NULL);
+    return single_open(file, show, (void*)OUTPUT_TEXT);
 }
 
 static const struct file_operations proc_file_fops = {
@@ -570,6 +783,184 @@ static const struct file_operations proc_file_fops = {
     .release = single_release,
 };
 
+static int open_raw(struct inode *inode, struct  file *file) {
+    // the buffer needs to be large enough for the entire output; otherwise, show() would be called again
+    size_t size = get_n_result_counters() * (200 + 2 * n_measurements * 21);
+    return single_open_size(file, show, (void*)OUTPUT_RAW, size);
+}
+
+static const struct file_operations proc_file_raw_fops = {
+    .llseek = seq_lseek,
+    .open = open_raw,
+    .owner = THIS_MODULE,
+    .read = seq_read,
+    .release = single_release,
+};
+
+static int open_bin(struct inode *inode, struct  file *file) {
+    return single_open_size(file, show, (void*)OUTPUT_BIN, get_bin_output_size());
+}
+
+static const struct file_operations proc_file_bin_fops = {
+    .llseek = seq_lseek,
+    .open = open_bin,
+    .owner = THIS_MODULE,
+    .read = seq_read,
+    .release = single_release,
+};
+
+// Format of /sys/nb/batch: a sequence of experiments. Each experiment consists of an nb_batch_header, followed by the code, the init code, and the
+// one-time init code (each padded to a multiple of 8 bytes). The performance counter configs are the same for all experiments.
+// Reading /proc/nanoBench_batch runs all experiments, and returns the results in the format of /proc/nanoBench_bin (one after the other).
+// Afterwards, the parameters and the code have the same values as before. The image in /sys/nb/r14_image is not used for experiments in a batch.
+#define NB_BATCH_MAGIC 0x4E424254
+#define NB_BATCH_BASIC_MODE 1
+#define NB_BATCH_NO_MEM 2
+
+struct nb_batch_header {
+    uint32_t magic;
+    uint32_t flags;
+    int64_t n_measurements;
+    int64_t unroll_count;
+    int64_t loop_count;
+    int64_t warm_up_count;
+    int64_t initial_warm_up_count;
+    int64_t alignment_offset;
+    int64_t code_offset;
+    int64_t aggregate_function;
+    uint64_t code_length;
+    uint64_t init_length;
+    uint64_t one_time_init_length;
+};
+
+#define BATCH_PADDED(len) (((len) + 7) & ~(size_t)7)
+
+// Returns the header of the experiment at offset off of the batch, or NULL if there is no valid experiment at this offset.
+static struct nb_batch_header* get_batch_header(size_t off) {
+    if (off + sizeof(struct nb_batch_header) > batch_length) return NULL;
+    struct nb_batch_header* header = (struct nb_batch_header*)(batch + off);
+    if (header->magic != NB_BATCH_MAGIC || header->n_measurements <= 0 || header->unroll_count <= 0) return NULL;
+    size_t total_length = sizeof(struct nb_batch_header) + BATCH_PADDED(header->code_length) + BATCH_PADDED(header->init_length) +
+                          BATCH_PADDED(header->one_time_init_length);
+    if (off + total_length > batch_length) return NULL;
+    return header;
+}
+
+static size_t get_batch_experiment_length(struct nb_batch_header* header) {
+    return sizeof(struct nb_batch_header) + BATCH_PADDED(header->code_length) + BATCH_PADDED(header->init_length) +
+           BATCH_PADDED(header->one_time_init_length);
+}
+
+static ssize_t batch_write(struct file *filp, struct kobject *kobj, struct bin_attribute *attr, char *buf, loff_t off, size_t count) {
+    return write_into_buffer(buf, off, count, &batch, &batch_length, &batch_memory_size);
+}
+static struct bin_attribute batch_attribute =__BIN_ATTR(batch, 0660, NULL, batch_write, 0);
+
+static int show_batch(struct seq_file *m, void *v) {
+    char* saved_code = code;
+    size_t saved_code_length = code_length;
+    char* saved_code_init = code_init;
+    size_t saved_code_init_length = code_init_length;
+    char* saved_code_one_time_init = code_one_time_init;
+    size_t saved_code_one_time_init_length = code_one_time_init_length;
+    long saved_n_measurements = n_measurements;
+    long saved_unroll_count = unroll_count;
+    long saved_loop_count = loop_count;
+    long saved_warm_up_count = warm_up_count;
+    long saved_initial_warm_up_count = initial_warm_up_count;
+    size_t saved_alignment_offset = alignment_offset;
+    size_t saved_code_offset = code_offset;
+    int saved_aggregate_function = aggregate_function;
+    int saved_basic_mode = basic_mode;
+    int saved_no_mem = no_mem;
+    size_t saved_r14_image_length = r14_image_length;
+    r14_image_length = 0;
+
+    int ret = 0;
+    size_t off = 0;
+    while (off < batch_length) {
+        struct nb_batch_header* header = get_batch_header(off);
+        if (!header) {
+            printk(KERN_ERR "Invalid batch at offset %zu\n", off);
+            ret = -1;
+            break;
+        }
+
+        n_measurements = header->n_measurements;
+        unroll_count = header->unroll_count;
+        loop_count = header->loop_count;
+        warm_up_count = header->warm_up_count;
+        initial_warm_up_count = header->initial_warm_up_count;
+        alignment_offset = header->alignment_offset;
+        code_offset = header->code_offset;
+        aggregate_function = header->aggregate_function;
+        basic_mode = !!(header->flags & NB_BATCH_BASIC_MODE);
+        no_mem = !!(header->flags & NB_BATCH_NO_MEM);
+
+        char* cur = (char*)header + sizeof(struct nb_batch_header);
+        code = cur;
+        code_length = header->code_length;
+        cur += BATCH_PADDED(header->code_length);
+        code_init = cur;
+        code_init_length = header->init_length;
+        cur += BATCH_PADDED(header->init_length);
+        code_one_time_init = cur;
+        code_one_time_init_length = header->one_time_init_length;
+
+        ensure_runtime_one_time_init_code_memory(code_one_time_init_length);
+        if (ensure_measurement_results_size() || (code_one_time_init_length > 0 && !runtime_one_time_init_code)) {
+            ret = -1;
+            break;
+        }
+
+        ret = show(m, v);
+        if (ret) break;
+
+        off += get_batch_experiment_length(header);
+    }
+
+    code = saved_code;
+    code_length = saved_code_length;
+    code_init = saved_code_init;
+    code_init_length = saved_code_init_length;
+    code_one_time_init = saved_code_one_time_init;
+    code_one_time_init_length = saved_code_one_time_init_length;
+    n_measurements = saved_n_measurements;
+    unroll_count = saved_unroll_count;
+    loop_count = saved_loop_count;
+    warm_up_count = saved_warm_up_count;
+    initial_warm_up_count = saved_initial_warm_up_count;
+    alignment_offset = saved_alignment_offset;
+    code_offset = saved_code_offset;
+    aggregate_function = saved_aggregate_function;
+    basic_mode = saved_basic_mode;
+    no_mem = saved_no_mem;
+    r14_image_length = saved_r14_image_length;
+
+    return ret;
+}
+
+static int open_batch(struct inode *inode, struct  file *file) {
+    // computes the size of the output, so that show_batch() is not called multiple times
+    size_t size = 0;
+    long saved_n_measurements = n_measurements;
+    struct nb_batch_header* header;
+    for (size_t off = 0; (header = get_batch_header(off)); off += get_batch_experiment_length(header)) {
+        n_measurements = header->n_measurements;
+        size += get_bin_output_size();
+    }
+    n_measurements = saved_n_measurements;
+    return single_open_size(file, show_batch, (void*)OUTPUT_BIN, max(size, PAGE_SIZE));
+}
+
+static const struct file_operations proc_file_batch_fops = {
+    .llseek = seq_lseek,
+    .open = open_batch,
+    .owner = THIS_MODULE,
+    .read = seq_read,
+    .release = single_release,
+};
+
 static struct kobject* nb_kobject;
 
 static int __init nb_init(void) {
@@ -582,15 +973,8 @@ static int __init nb_init(void) {
         return -1;
     }
 
-    for (int i=0; i<MAX_PROGRAMMABLE_COUNTERS; i++) {
-        measurement_results[i] = kmalloc(n_measurements*sizeof(int64_t), GFP_KERNEL);
-        measurement_results_base[i] = kmalloc(n_measurements*sizeof(int64_t), GFP_KERNEL);
-        if (!measurement_results[i] || !measurement_results_base[i]) {
-            printk(KERN_ERR "Could not allocate memory for measurement_results\n");
-            return -1;
-        }
-        memset(measurement_results[i], 0, n_measurements*sizeof(int64_t));
-        memset(measurement_results_base[i], 0, n_measurements*sizeof(int64_t));
+    if (ensure_measurement_results_size()) {
+        return -1;
     }
 
     // vmalloc addresses are page aligned
@@ -629,6 +1013,11 @@ static int __init nb_init(void) {
     error |= sysfs_create_file(nb_kobject, &code_attribute.attr);
     error |= sysfs_create_file(nb_kobject, &code_init_attribute.attr);
     error |= sysfs_create_file(nb_kobject, &code_one_time_init_attribute.attr);
+    error |= sysfs_create_bin_file(nb_kobject, &code_bytes_attribute);
+    error |= sysfs_create_bin_file(nb_kobject, &code_init_bytes_attribute);
+    error |= sysfs_create_bin_file(nb_kobject, &code_one_time_init_bytes_attribute);
+    error |= sysfs_create_bin_file(nb_kobject, &batch_attribute);
+    error |= sysfs_create_bin_file(nb_kobject, &r14_image_attribute);
     error |= sysfs_create_file(nb_kobject, &config_attribute.attr);
     error |= sysfs_create_file(nb_kobject, &msr_config_attribute.attr);
     error |= sysfs_create_file(nb_kobject, &loop_count_attribute.attr);
@@ -643,6 +1032,7 @@ static int __init nb_init(void) {
     error |= sysfs_create_file(nb_kobject, &r14_size_attribute.attr);
     error |= sysfs_create_file(nb_kobject, &print_r14_attribute.attr);
     error |= sysfs_create_file(nb_kobject, &code_offset_attribute.attr);
+    error |= sysfs_create_file(nb_kobject, &max_regions_attribute.attr);
     error |= sysfs_create_file(nb_kobject, &verbose_attribute.attr);
 
     if (error) {
@@ -656,6 +1046,24 @@ static int __init nb_init(void) {
         return -1;
     }
 
+    struct proc_dir_entry* proc_file_raw_entry = proc_create("nanoBench_raw", 0, NULL, &proc_file_raw_fops);
+    if(proc_file_raw_entry == NULL) {
+        pr_debug("failed to create file in /proc/\n");
+        return -1;
+    }
+
+    struct proc_dir_entry* proc_file_bin_entry = proc_create("nanoBench_bin", 0, NULL, &proc_file_bin_fops);
+    if(proc_file_bin_entry == NULL) {
+        pr_debug("failed to create file in /proc/\n");
+        return -1;
+    }
+
+    struct proc_dir_entry* proc_file_batch_entry = proc_create("nanoBench_batch", 0, NULL, &proc_file_batch_fops);
+    if(proc_file_batch_entry == NULL) {
+        pr_debug("failed to create file in /proc/\n");
+        return -1;
+    }
+
     return 0;
 }
 
@@ -665,6 +1073,8 @@ static void __exit nb_exit(void) {
     kfree(code_one_time_init);
     kfree(pfc_config_file_content);
     kfree(msr_config_file_content);
+    kfree(batch);
+    kfree(r14_image);
     vfree(runtime_one_time_init_code);
     vfree(runtime_rbp - RUNTIME_R_SIZE/2);
     vfree(runtime_rdi - RUNTIME_R_SIZE/2);
@@ -684,13 +1094,16 @@ static void __exit nb_exit(void) {
         vfree(runtime_r14 - RUNTIME_R_SIZE/2);
     }
 
-    for (int i=0; i<MAX_PROGRAMMABLE_COUNTERS; i++) {
+    for (int i=0; i<N_RESULT_ARRAYS; i++) {
         kfree(measurement_results[i]);
         kfree(measurement_results_base[i]);
     }
 
     kobject_put(nb_kobject);
     remove_proc_entry("nanoBench", NULL);
+    remove_proc_entry("nanoBench_raw", NULL);
+    remove_proc_entry("nanoBench_bin", NULL);
+    remove_proc_entry("nanoBench_batch", NULL);
 }
 
 module_init(nb_init);
@@ -1,34 +1,258 @@
 import atexit
+import base64
 import collections
+import hashlib
+import json
+import os
+import re
+import struct
 import subprocess
 import sys
+import time
 
 PFC_START_ASM = '.quad 0xE0b513b1C2813F04'
 PFC_STOP_ASM = '.quad 0xF0b513b1C2813F04'
 
+# Ends a region of the code (only in noMem mode); the results for region i are reported with the suffix REGION_SUFFIX.format(i) (see
+# MAGIC_BYTES_CODE_PFC_REGION in common/nanoBench.h, and getRegionResults()).
+PFC_REGION_MAGIC = 0xE1b513b1C2813F04
+PFC_REGION_ASM = '.quad 0xE1b513b1C2813F04'
+REGION_SUFFIX = ' (region {})'
+
+# separates the snippets in files created by assembleMany()
+SNIPPET_SEPARATOR = 0x00b513b1C2813F04
+
+
+# Measures the time spent in the different phases of the experiments (e.g., assembling the code, or running it). Timing is enabled by enableTiming(), or
+# by setting the NB_TIMING environment variable (to a file name for a trace in the Chrome trace format (chrome://tracing), or to an empty string or '1'
+# for only a summary). At exit, a summary with a histogram for each phase is printed to stderr.
+# If timing is disabled, timed() returns a context manager that does nothing.
+# Phases can be nested (e.g., 'upload' and 'kernel' in 'run'); the summary contains only the time that is not spent in nested phases, so that each time
+# is counted once. In the trace, the phases are nested, and the trace viewer shows the self time of each phase.
+class NoTimer(object):
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      return False
+
+noTimer = NoTimer()
+
+class PhaseTimer(object):
+   def __init__(self, phase):
+      self.phase = phase
+
+   def __enter__(self):
+      self.nestedTime = 0.0
+      activeTimers.append(self)
+      self.start = time.time()
+      return self
+
+   def __exit__(self, *args):
+      end = time.time()
+      activeTimers.pop()
+      if activeTimers:
+         activeTimers[-1].nestedTime += end - self.start
+      addTiming(self.phase, self.start, end, end - self.start - self.nestedTime)
+      return False
+
+activeTimers = []
+
+# phase -> [count, total time, min. time, max. time, histogram (bucket i contains the number of durations between 2^(i-1) and 2^i microseconds)]
+timingStats = collections.OrderedDict()
+timingTrace = None
+timingTraceFile = None
+timingEnabled = False
+
+def enableTiming(traceFile=None):
+   global timingEnabled, timingTrace, timingTraceFile
+   if not timingEnabled:
+      atexit.register(printTimingSummary)
+   timingEnabled = True
+   if traceFile:
+      timingTrace = []
+      timingTraceFile = traceFile
+
+def timed(phase):
+   if not timingEnabled: return noTimer
+   return PhaseTimer(phase)
+
+# duration is the time that is counted for the phase in the summary (by default, end - start)
+def addTiming(phase, start, end, duration=None):
+   if duration is None:
+      duration = end - start
+   stats = timingStats.get(phase)
+   if stats is None:
+      stats = timingStats[phase] = [0, 0.0, duration, duration, []]
+   stats[0] += 1
+   stats[1] += duration
+   stats[2] = min(stats[2], duration)
+   stats[3] = max(stats[3], duration)
+   bucket = int(duration * 1e6).bit_length()
+   histogram = stats[4]
+   if bucket >= len(histogram):
+      histogram.extend([0] * (bucket + 1 - len(histogram)))
+   histogram[bucket] += 1
+   if timingTrace is not None:
+      timingTrace.append({'name': phase, 'ph': 'X', 'ts': int(start * 1e6), 'dur': int((end - start) * 1e6), 'pid': os.getpid(), 'tid': 0})
+
+def printTimingSummary():
+   sys.stderr.write('{:<20} {:>8} {:>10} {:>10} {:>10} {:>10}  {}\n'.format('Phase', 'Count', 'Total (s)', 'Avg (ms)', 'Min (ms)', 'Max (ms)',
+                                                                         'Histogram (us, powers of 2)'))
+   for phase, (count, total, minTime, maxTime, histogram) in timingStats.items():
+      histogramStr = ' '.join('<' + str(2**i) + ':' + str(n) for i, n in enumerate(histogram) if n > 0)
+      sys.stderr.write('{:<20} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}  {}\n'.format(phase, count, total, 1000*total/count, 1000*minTime,
+                                                                                         1000*maxTime, histogramStr))
+   if timingTrace is not None:
+      with open(timingTraceFile, 'w') as f:
+         json.dump({'traceEvents': timingTrace}, f)
+      sys.stderr.write('Trace written to ' + timingTraceFile + '\n')
+
+if 'NB_TIMING' in os.environ:
+   enableTiming(os.environ['NB_TIMING'] if os.environ['NB_TIMING'] not in ['', '1'] else None)
+
 def writeFile(fileName, content):
    with open(fileName, 'w') as f:
       f.write(content);
 
-def assemble(code, objFile, asmFile='/tmp/ramdisk/asm.s'):
+# If exitOnError is False, errors are not reported, and the function returns False if the code could not be assembled.
+def assemble(code, objFile, asmFile='/tmp/ramdisk/asm.s', exitOnError=True):
    try:
       code = '.intel_syntax noprefix;' + code + ';1:;.att_syntax prefix\n'
       with open(asmFile, 'w') as f: f.write(code);
-      subprocess.check_call(['as', asmFile, '-o', objFile])
+      with timed('as'):
+         if exitOnError:
+            subprocess.check_call(['as', asmFile, '-o', objFile])
+         else:
+            with open(os.devnull, 'w') as devnull:
+               subprocess.check_call(['as', asmFile, '-o', objFile], stderr=devnull)
    except subprocess.CalledProcessError as e:
+      if not exitOnError: return False
       sys.stderr.write("Error (assemble): " + str(e))
       sys.stderr.write(code)
       exit(1)
+   return True
 
 
 def objcopy(sourceFile, targetFile):
    try:
-      subprocess.check_call(['objcopy', sourceFile, '-O', 'binary', targetFile])
+      with timed('objcopy'):
+         subprocess.check_call(['objcopy', sourceFile, '-O', 'binary', targetFile])
    except subprocess.CalledProcessError as e:
       sys.stderr.write("Error (objcopy): " + str(e))
       exit(1)
 
 
+# Returns the directory in which files that should be kept between runs are stored (in the subdirectory subDir).
+# The base directory can be changed with the NB_CACHE_DIR environment variable.
+def getCacheDir(subDir=''):
+   cacheDir = os.path.abspath(os.path.join(os.environ.get('NB_CACHE_DIR', os.path.expanduser('~/.cache/nanoBench')), subDir))
+   if not os.path.isdir(cacheDir):
+      try:
+         os.makedirs(cacheDir)
+      except OSError:
+         if not os.path.isdir(cacheDir): raise
+   return cacheDir
+
+
+# Identifies the assembler by the path, size, and modification time of the 'as' executable; this does not require starting a new process.
+def getAssemblerID():
+   if not hasattr(getAssemblerID, 'asID'):
+      getAssemblerID.asID = ''
+      for path in os.environ.get('PATH', '').split(os.pathsep):
+         asFile = os.path.realpath(os.path.join(path, 'as'))
+         if os.path.isfile(asFile) and os.access(asFile, os.X_OK):
+            st = os.stat(asFile)
+            getAssemblerID.asID = asFile + ' ' + str(st.st_size) + ' ' + str(int(st.st_mtime))
+            break
+   return getAssemblerID.asID
+
+
+def getCodeHash(code):
+   if not isinstance(code, bytes): code = code.encode('utf-8')
+   return hashlib.sha1(getAssemblerID().encode('utf-8') + b'\n' + code).hexdigest()
+
+
+# Returns the name of a file that contains the raw machine code for the given assembler code (in Intel syntax).
+# The files are stored in a persistent cache that is keyed by a hash of the code and the assembler; thus, snippets that have already been assembled before
+# (also in a previous run) do not need to be assembled again.
+def getBinFileForCode(code):
+   if not hasattr(getBinFileForCode, 'binFiles'):
+      getBinFileForCode.binFiles = dict()
+   binFiles = getBinFileForCode.binFiles
+
+   if code not in binFiles:
+      binFile = os.path.join(getCacheDir('bin'), getCodeHash(code) + '.bin')
+      if not os.path.exists(binFile):
+         tmpFile = binFile + '.' + str(os.getpid())
+         assemble(code, tmpFile + '.o', asmFile=tmpFile + '.s')
+         objcopy(tmpFile + '.o', tmpFile)
+         os.rename(tmpFile, binFile) # atomic, so other processes never see incomplete files
+         os.remove(tmpFile + '.o')
+         os.remove(tmpFile + '.s')
+      binFiles[code] = binFile
+   return binFiles[code]
+
+
+# Assembles all snippets in codeList that are not yet in the cache of getBinFileForCode() with a single call to as and objcopy. The snippets are separated
+# by magic bytes, which are then used to split the output into the binaries for the individual snippets.
+# Snippets that cannot be assembled together (e.g., because they define the same labels), snippets with alignment directives (which depend on the
+# position of the snippet in the file), and snippets with references to numeric local labels that are not defined in the snippet (which would be resolved
+# to labels of neighboring snippets) are assembled separately.
+# Returns the list of the corresponding bin files (None for empty snippets).
+def assembleMany(codeList):
+   if not hasattr(getBinFileForCode, 'binFiles'):
+      getBinFileForCode.binFiles = dict()
+   binFiles = getBinFileForCode.binFiles
+
+   newCode = []
+   for code in collections.OrderedDict.fromkeys(codeList):
+      if not code or code in binFiles: continue
+      binFile = os.path.join(getCacheDir('bin'), getCodeHash(code) + '.bin')
+      if os.path.exists(binFile):
+         binFiles[code] = binFile
+      elif 'align' not in code and '.org' not in code and not hasUnresolvedLocalLabels(code):
+         newCode.append(code)
+
+   if len(newCode) > 1:
+      tmpFile = os.path.join(getCacheDir('bin'), 'many.' + str(os.getpid()))
+      separator = ';.quad ' + hex(SNIPPET_SEPARATOR) + ';'
+      if assemble(separator.join(newCode), tmpFile + '.o', asmFile=tmpFile + '.s', exitOnError=False):
+         objcopy(tmpFile + '.o', tmpFile + '.bin')
+         with open(tmpFile + '.bin', 'rb') as f:
+            binaries = f.read().split(struct.pack('<Q', SNIPPET_SEPARATOR))
+         if len(binaries) == len(newCode):
+            for code, binary in zip(newCode, binaries):
+               binFile = os.path.join(getCacheDir('bin'), getCodeHash(code) + '.bin')
+               with open(tmpFile, 'wb') as f:
+                  f.write(binary)
+               os.rename(tmpFile, binFile)
+               binFiles[code] = binFile
+         os.remove(tmpFile + '.o')
+         os.remove(tmpFile + '.bin')
+      os.remove(tmpFile + '.s')
+
+   return [(getBinFileForCode(code) if code else None) for code in codeList]
+
+
+# matches definitions of (group 2 is ':') and references to (group 2 is 'b' or 'f') numeric local labels
+LOCAL_LABEL_RE = re.compile(r'(?<![\w.$])(\d+)(:|[bf]\b)')
+
+# Returns True if the code contains a reference to a numeric local label (e.g., 1b or 1f) without a corresponding definition in the code.
+def hasUnresolvedLocalLabels(code):
+   defined = set()
+   forwardRefs = set()
+   for label, kind in LOCAL_LABEL_RE.findall(code):
+      if kind == ':':
+         defined.add(label)
+         forwardRefs.discard(label)
+      elif kind == 'b':
+         if label not in defined: return True
+      else:
+         forwardRefs.add(label)
+   return bool(forwardRefs)
+
+
 def filecopy(sourceFile, targetFile):
    try:
       subprocess.check_call(['cp', sourceFile, targetFile])
@@ -37,148 +261,1098 @@ def filecopy(sourceFile, targetFile):
       exit(1)
 
 
-# Returns the size in bytes.
-def getR14Size():
-   if not hasattr(getR14Size, 'r14Size'):
+# Interface to the component that runs the benchmarks. The default backend uses the kernel module; the backend can be changed with setBackend() or with
+# the NB_BACKEND environment variable ('kernel', 'user', or 'fake').
+class NanoBenchBackend(object):
+   # name is one of the keys of paramDict; config and msrConfig are passed as strings (not as file names)
+   def setParameter(self, name, value):
+      raise NotImplementedError()
+
+   def reset(self):
+      raise NotImplementedError()
+
+   # Runs the benchmark with the code from the given files (None means no code), and returns the output in the format of /proc/nanoBench (or of
+   # /proc/nanoBench_raw if raw is True).
+   def run(self, codeBinFile, initBinFile, oneTimeInitBinFile, raw=False):
+      raise NotImplementedError()
+
+   # Same as run(), but returns the output in the binary format of /proc/nanoBench_bin (see kernel/nb_km.c), or None if this is not supported.
+   def runBinary(self, codeBinFile, initBinFile, oneTimeInitBinFile):
+      return None
+
+   # Runs multiple experiments at once; batch is in the format of /sys/nb/batch (see kernel/nb_km.c). Returns the output in the format of
+   # /proc/nanoBench_batch, or None if this is not supported.
+   def runBatch(self, batch):
+      return None
+
+   # Returns True if setR14Image() is supported.
+   def supportsR14Image(self):
+      return False
+
+   # Sets the image that is written to the R14 area before the one-time init code is executed in subsequent runs (except for runs in a batch); image
+   # is in the format of /sys/nb/r14_image (see kernel/nb_km.c), None removes the image. reset() also removes the image.
+   def setR14Image(self, image):
+      if image is not None:
+         raise NotImplementedError()
+
+   # Returns the maximum number of regions (see PFC_REGION_ASM) in the code, or 0 if regions are not supported.
+   def getMaxRegions(self):
+      return 0
+
+   # Returns the size in bytes of the memory area that R14 points to.
+   def getR14Size(self):
+      raise NotImplementedError()
+
+   # Returns the physical address of the memory area that R14 points to (None if unknown).
+   def getR14PhysicalAddress(self):
+      return None
+
+   # Returns a directory for temporary files.
+   def getTmpDir(self):
+      return getCacheDir('tmp')
+
+   # Returns the value of the MSR on the current core; raises subprocess.CalledProcessError or OSError if the MSR cannot be read.
+   def readMSR(self, msr):
+      subprocess.check_output(['modprobe', 'msr'])
+      return int(subprocess.check_output(['rdmsr', hex(msr)]), 16)
+
+
+class KernelBackend(NanoBenchBackend):
+   sysfsFiles = {'config': 'config', 'msrConfig': 'msr_config', 'nMeasurements': 'n_measurements', 'unrollCount': 'unroll_count',
+                 'loopCount': 'loop_count', 'warmUpCount': 'warm_up', 'initialWarmUpCount': 'initial_warm_up', 'alignmentOffset': 'alignment_offset',
+                 'codeOffset': 'code_offset', 'aggregateFunction': 'agg', 'basicMode': 'basic_mode', 'noMem': 'no_mem', 'verbose': 'verbose'}
+
+   def setParameter(self, name, value):
+      if name in ['config', 'msrConfig']:
+         fileName = os.path.join(self.getTmpDir(), self.sysfsFiles[name])
+         writeFile(fileName, value)
+         value = fileName
+      elif isinstance(value, bool):
+         value = int(value)
+      writeFile('/sys/nb/' + self.sysfsFiles[name], str(value))
+
+   def reset(self):
+      with open('/sys/nb/reset') as resetFile: resetFile.read()
+      self.r14Image = None
+
+   # Newer versions of the kernel module can read the code directly from the /sys/nb/*_bytes files; older versions get the name of a file with the code.
+   def hasBytesFiles(self):
+      if not hasattr(self, 'bytesFiles'):
+         self.bytesFiles = os.path.exists('/sys/nb/code_bytes')
+      return self.bytesFiles
+
+   def uploadCode(self, codeBinFile, initBinFile, oneTimeInitBinFile):
+      with timed('upload'):
+         with open('/sys/nb/clear') as clearFile: clearFile.read()
+         for binFile, sysfsFile in [(codeBinFile, 'code'), (initBinFile, 'init'), (oneTimeInitBinFile, 'one_time_init')]:
+            if binFile is None: continue
+            if self.hasBytesFiles():
+               with open(binFile, 'rb') as f:
+                  content = f.read()
+               if content: # an empty write would not change the content
+                  with open('/sys/nb/' + sysfsFile + '_bytes', 'wb') as f:
+                     f.write(content)
+                  continue
+            writeFile('/sys/nb/' + sysfsFile, binFile)
+         if getattr(self, 'r14Image', None): # reading /sys/nb/clear removes the image
+            with open('/sys/nb/r14_image', 'wb') as f:
+               f.write(self.r14Image)
+
+   def run(self, codeBinFile, initBinFile, oneTimeInitBinFile, raw=False):
+      self.uploadCode(codeBinFile, initBinFile, oneTimeInitBinFile)
+      with timed('kernel'):
+         with open('/proc/nanoBench_raw' if raw else '/proc/nanoBench') as resultFile:
+            return resultFile.read()
+
+   def runBinary(self, codeBinFile, initBinFile, oneTimeInitBinFile):
+      if not hasattr(self, 'binarySupported'):
+         self.binarySupported = os.path.exists('/proc/nanoBench_bin') # older versions of the kernel module do not have this file
+      if not self.binarySupported: return None
+      self.uploadCode(codeBinFile, initBinFile, oneTimeInitBinFile)
+      with timed('kernel'):
+         with open('/proc/nanoBench_bin', 'rb') as resultFile:
+            return resultFile.read()
+
+   def runBatch(self, batch):
+      if not hasattr(self, 'batchSupported'):
+         self.batchSupported = os.path.exists('/proc/nanoBench_batch')
+      if not self.batchSupported: return None
+      with timed('upload'):
+         with open('/sys/nb/batch', 'wb') as f:
+            f.write(batch)
+      with timed('kernel'):
+         with open('/proc/nanoBench_batch', 'rb') as resultFile:
+            return resultFile.read()
+
+   def supportsR14Image(self):
+      if not hasattr(self, 'r14ImageSupported'):
+         self.r14ImageSupported = os.path.exists('/sys/nb/r14_image') # older versions of the kernel module do not have this file
+      return self.r14ImageSupported
+
+   def setR14Image(self, image):
+      self.r14Image = image
+
+   def getMaxRegions(self):
+      if not os.path.exists('/sys/nb/max_regions'): # older versions of the kernel module do not support regions
+         return 0
+      with open('/sys/nb/max_regions') as f:
+         return int(f.read())
+
+   def getR14Size(self):
       with open('/sys/nb/r14_size') as f:
          line = f.readline()
          mb = int(line.split()[2])
-         getR14Size.r14Size = mb * 1024 * 1024
+         return mb * 1024 * 1024
+
+   def getR14PhysicalAddress(self):
+      with open('/sys/nb/r14_size') as f:
+         for line in f:
+            if line.startswith('Physical address:'):
+               return int(line.split()[2], 16)
+      return None
+
+   # The ramdisk is only needed for older versions of the kernel module, which read the code from files.
+   def getTmpDir(self):
+      if self.hasBytesFiles():
+         return NanoBenchBackend.getTmpDir(self)
+      if not ramdiskCreated: createRamdisk()
+      return '/tmp/ramdisk'
+
+
+# Uses the user-space version of nanoBench (via nanoBench.sh); the files for the code and the config are passed as command-line arguments.
+# The user-space version does not support MSR counters and code offsets.
+class UserBackend(NanoBenchBackend):
+   aggregateFunctionOptions = {'avg': '-avg', 'med': '-median', 'min': '-min', 'max': '-max'}
+
+   def __init__(self):
+      self.params = dict()
+      self.nbDir = os.path.dirname(os.path.abspath(__file__))
+
+   def setParameter(self, name, value):
+      if (name == 'msrConfig' and value) or (name == 'codeOffset' and value):
+         sys.stderr.write('Warning: ' + name + ' is not supported by the user-space version of nanoBench\n')
+      self.params[name] = value
+
+   def reset(self):
+      self.params.clear()
+
+   def run(self, codeBinFile, initBinFile, oneTimeInitBinFile, raw=False):
+      cmd = ['sudo', os.path.join(self.nbDir, 'nanoBench.sh')]
+      for fileName, option in [(codeBinFile, '-code'), (initBinFile, '-code_init'), (oneTimeInitBinFile, '-code_one_time_init')]:
+         if fileName is not None: cmd += [option, fileName]
+      if self.params.get('config'):
+         configFile = os.path.join(self.getTmpDir(), 'config.' + str(os.getpid()))
+         writeFile(configFile, self.params['config'])
+         cmd += ['-config', configFile]
+      for name, option in [('nMeasurements', '-n_measurements'), ('unrollCount', '-unroll_count'), ('loopCount', '-loop_count'),
+                           ('warmUpCount', '-warm_up_count'), ('initialWarmUpCount', '-initial_warm_up_count'), ('alignmentOffset', '-alignment_offset')]:
+         if name in self.params: cmd += [option, str(self.params[name])]
+      if 'aggregateFunction' in self.params: cmd.append(self.aggregateFunctionOptions[self.params['aggregateFunction']])
+      for name, option in [('basicMode', '-basic_mode'), ('noMem', '-no_mem'), ('verbose', '-verbose')]:
+         if self.params.get(name): cmd.append(option)
+      if raw: cmd.append('-raw')
+      try:
+         return subprocess.check_output(cmd, cwd=self.nbDir)
+      except subprocess.CalledProcessError as e:
+         sys.stderr.write("Error (nanoBench.sh): " + str(e) + '\n')
+         exit(1)
+
+   def getMaxRegions(self):
+      return 16 # MAX_REGIONS in common/nanoBench.h
+
+   def getR14Size(self):
+      return 512 * 1024 # RUNTIME_R_SIZE/2 in common/nanoBench.h
+
+
+# Does not run any code; returns deterministic synthetic values for the counters that would be measured. The values depend on the code, the init code, the
+# parameters, and the name of the counter. A different function for computing the values can be specified with the valueFunction parameter; it gets the name
+# of the counter, the content of the code files (as a tuple; the R14 image, if set, is appended), and the parameter dict as arguments.
+# The size of the R14 area can be changed with the r14Size parameter or with the NB_FAKE_R14_SIZE environment variable (in MB).
+# msrValues is a dict with the values that readMSR() returns; by default, MSR 0x396 (used for determining the number of CBoxes) is 5.
+class FakeBackend(NanoBenchBackend):
+   def __init__(self, r14Size=None, valueFunction=None, msrValues=None):
+      self.params = dict()
+      self.r14Image = None
+      self.msrValues = msrValues if msrValues is not None else {0x396: 5}
+      if r14Size is None:
+         r14Size = int(os.environ.get('NB_FAKE_R14_SIZE', '128')) * 1024 * 1024
+      self.r14Size = r14Size
+      self.valueFunction = valueFunction or FakeBackend.getHashValue
+      with open('/proc/cpuinfo') as f:
+         isAMD = 'AuthenticAMD' in f.read()
+      self.fixedCounters = ['RDTSC', 'MPERF', 'APERF'] if isAMD else ['RDTSC', 'Instructions retired', 'Core cycles', 'Reference cycles']
+
+   @staticmethod
+   def getHashValue(counter, code, params):
+      h = hashlib.sha1(repr((counter, code, sorted(params.items()))).encode('utf-8')).hexdigest()
+      return (int(h[:8], 16) % 1000) / 100.0
+
+   def setParameter(self, name, value):
+      self.params[name] = value
+
+   def reset(self):
+      self.params.clear()
+      self.r14Image = None
+
+   def supportsR14Image(self):
+      return True
+
+   def setR14Image(self, image):
+      self.r14Image = image
+
+   def run(self, codeBinFile, initBinFile, oneTimeInitBinFile, raw=False):
+      code = []
+      for fileName in [codeBinFile, initBinFile, oneTimeInitBinFile]:
+         if fileName is None:
+            code.append(b'')
+         else:
+            with open(fileName, 'rb') as f: code.append(f.read())
+      if self.r14Image:
+         code.append(self.r14Image)
+      code = tuple(code)
+
+      counters = list(self.fixedCounters)
+      for configName in ['config', 'msrConfig']:
+         for line in (self.params.get(configName) or '').split('\n'):
+            lineSplit = line.split()
+            if not lineSplit or lineSplit[0].startswith('#'): continue
+            counters.append(lineSplit[-1])
+
+      nRegions = code[0].count(struct.pack('<Q', PFC_REGION_MAGIC))
+      counters = [c + suffix for c in counters for suffix in [''] + [REGION_SUFFIX.format(r) for r in range(0, nRegions)]]
+
+      if not raw:
+         return ''.join('{}: {:.2f}\n'.format(counter, self.valueFunction(counter, code, self.params)) for counter in counters)
+
+      # the base samples vary slightly; the differences to the main samples correspond to the value of the counter
+      nMeasurements = self.params.get('nMeasurements', 10)
+      nRep = self.params.get('unrollCount', 1000) * max(1, self.params.get('loopCount', 0))
+      output = ''
+      for counter in counters:
+         value = self.valueFunction(counter, code, self.params)
+         base = [100 + (i % 3) for i in range(0, nMeasurements)]
+         output += '{}: {}; {}; {}\n'.format(counter, nRep, ' '.join(str(b + int(round(value * nRep))) for b in base), ' '.join(str(b) for b in base))
+      return output
+
+   def getMaxRegions(self):
+      return 16
+
+   def getR14Size(self):
+      return self.r14Size
+
+   def readMSR(self, msr):
+      return self.msrValues.get(msr, 0)
+
+
+def getFileHash(fileName):
+   if fileName is None: return None
+   with open(fileName, 'rb') as f:
+      return hashlib.sha1(f.read()).hexdigest()
+
+def getParamsHash(params, codeHashes):
+   return hashlib.sha1(json.dumps([sorted(params.items()), codeHashes]).encode('utf-8')).hexdigest()
+
+
+# Forwards all calls to another backend, and appends the parameter changes, the hashes of the code, and the results to a log file (one JSON object per
+# line), which can be used by ReplayBackend.
+# To keep the log small, parameters are only logged if their value changes; thus, runs are identified by the last value that was set for each parameter
+# (independently of resets).
+class RecordingBackend(NanoBenchBackend):
+   def __init__(self, backend, logFile):
+      self.backend = backend
+      self.params = dict()
+      self.logFile = open(logFile, 'a')
+
+   def log(self, entry):
+      self.logFile.write(json.dumps(entry, separators=(',', ':')) + '\n')
+      self.logFile.flush()
+
+   def setParameter(self, name, value):
+      self.backend.setParameter(name, value)
+      if self.params.get(name) != value:
+         self.params[name] = value
+         self.log({'t': 'param', 'name': name, 'value': value})
+
+   def reset(self):
+      self.backend.reset()
+      self.setR14ImageParam(None)
+
+   # The R14 image is treated like a parameter (identified by its hash).
+   def setR14ImageParam(self, image):
+      imageHash = (hashlib.sha1(image).hexdigest() if image is not None else None)
+      if self.params.get('r14Image') != imageHash:
+         self.params['r14Image'] = imageHash
+         self.log({'t': 'param', 'name': 'r14Image', 'value': imageHash})
+
+   def supportsR14Image(self):
+      supported = self.backend.supportsR14Image()
+      self.log({'t': 'r14ImageSupported', 'value': supported})
+      return supported
+
+   def setR14Image(self, image):
+      self.backend.setR14Image(image)
+      self.setR14ImageParam(image)
+
+   def run(self, codeBinFile, initBinFile, oneTimeInitBinFile, raw=False):
+      output = self.backend.run(codeBinFile, initBinFile, oneTimeInitBinFile, raw)
+      entry = {'t': 'run', 'code': [getFileHash(f) for f in [codeBinFile, initBinFile, oneTimeInitBinFile]], 'output': output}
+      if raw: entry['raw'] = True
+      self.log(entry)
+      return output
+
+   # binary outputs are logged in Base64 encoding; None (i.e., not supported) is logged as well
+   def runBinary(self, codeBinFile, initBinFile, oneTimeInitBinFile):
+      data = self.backend.runBinary(codeBinFile, initBinFile, oneTimeInitBinFile)
+      self.log({'t': 'run', 'code': [getFileHash(f) for f in [codeBinFile, initBinFile, oneTimeInitBinFile]], 'bin': True,
+                'output': (bytesToStr(base64.b64encode(data)) if data is not None else None)})
+      return data
+
+   def runBatch(self, batch):
+      data = self.backend.runBatch(batch)
+      self.log({'t': 'batch', 'batch': [hashlib.sha1(batch).hexdigest()], 'output': (bytesToStr(base64.b64encode(data)) if data is not None else None)})
+      return data
+
+   def getR14Size(self):
+      r14Size = self.backend.getR14Size()
+      self.log({'t': 'r14Size', 'value': r14Size})
+      return r14Size
+
+   def getMaxRegions(self):
+      maxRegions = self.backend.getMaxRegions()
+      self.log({'t': 'maxRegions', 'value': maxRegions})
+      return maxRegions
+
+   def readMSR(self, msr):
+      value = self.backend.readMSR(msr)
+      self.log({'t': 'msr', 'msr': msr, 'value': value})
+      return value
+
+   def getR14PhysicalAddress(self):
+      return self.backend.getR14PhysicalAddress()
+
+   def getTmpDir(self):
+      return self.backend.getTmpDir()
+
+
+# Answers the calls with the results from a log file created by RecordingBackend. A run is identified by the values of all parameters and by the code; if
+# the same run was recorded multiple times, the recorded results are returned in the original order (the last one is repeated if there are more calls).
+class ReplayBackend(NanoBenchBackend):
+   def __init__(self, logFile):
+      self.params = dict()
+      self.runs = dict()
+      self.msrs = dict()
+      self.r14Size = None
+      self.maxRegions = 0
+      self.r14ImageSupported = False
+
+      params = dict()
+      with open(logFile) as f:
+         for line in f:
+            if not line.strip(): continue
+            entry = json.loads(line)
+            if entry['t'] == 'param':
+               params[entry['name']] = entry['value']
+            elif entry['t'] == 'run':
+               if entry.get('bin'):
+                  key = getParamsHash(params, entry['code'] + ['bin'])
+                  output = (base64.b64decode(entry['output']) if entry['output'] is not None else None)
+               else:
+                  key = getParamsHash(params, entry['code'] + (['raw'] if entry.get('raw') else []))
+                  output = entry['output']
+               self.runs.setdefault(key, []).append(output)
+            elif entry['t'] == 'batch':
+               self.runs.setdefault(getParamsHash(params, entry['batch'] + ['batch']), []).append(base64.b64decode(entry['output']) if entry['output'] is not None else None)
+            elif entry['t'] == 'r14Size':
+               self.r14Size = entry['value']
+            elif entry['t'] == 'maxRegions':
+               self.maxRegions = entry['value']
+            elif entry['t'] == 'r14ImageSupported':
+               self.r14ImageSupported = entry['value']
+            elif entry['t'] == 'msr':
+               self.msrs[entry['msr']] = entry['value']
+
+   def setParameter(self, name, value):
+      self.params[name] = value
+
+   def reset(self):
+      self.setR14Image(None) # the other parameters are not reset, see RecordingBackend
+
+   def supportsR14Image(self):
+      return self.r14ImageSupported
+
+   def setR14Image(self, image):
+      imageHash = (hashlib.sha1(image).hexdigest() if image is not None else None)
+      if self.params.get('r14Image') != imageHash:
+         self.params['r14Image'] = imageHash
+
+   # Returns the next recorded output for the key, or notFound if there is no such output.
+   def getOutput(self, key, notFound=None):
+      outputs = self.runs.get(key)
+      if not outputs:
+         return notFound
+      if len(outputs) > 1:
+         return outputs.pop(0)
+      return outputs[0]
+
+   def run(self, codeBinFile, initBinFile, oneTimeInitBinFile, raw=False):
+      key = getParamsHash(self.params, [getFileHash(f) for f in [codeBinFile, initBinFile, oneTimeInitBinFile]] + (['raw'] if raw else []))
+      output = self.getOutput(key)
+      if output is None:
+         sys.stderr.write('Error (replay): experiment not found in log\n')
+         exit(1)
+      return output
+
+   # If no binary output was recorded (e.g., for logs from older versions), the text output is used (see runNanoBench())
+   def runBinary(self, codeBinFile, initBinFile, oneTimeInitBinFile):
+      return self.getOutput(getParamsHash(self.params, [getFileHash(f) for f in [codeBinFile, initBinFile, oneTimeInitBinFile]] + ['bin']))
+
+   def runBatch(self, batch):
+      return self.getOutput(getParamsHash(self.params, [hashlib.sha1(batch).hexdigest(), 'batch']))
+
+   def getR14Size(self):
+      if self.r14Size is None:
+         sys.stderr.write('Error (replay): R14 size not found in log\n')
+         exit(1)
+      return self.r14Size
+
+   def getMaxRegions(self):
+      return self.maxRegions
+
+   def readMSR(self, msr):
+      if msr not in self.msrs:
+         sys.stderr.write('Error (replay): MSR ' + hex(msr) + ' not found in log\n')
+         exit(1)
+      return self.msrs[msr]
+
+
+# Returns a string that identifies the CPU (model and microcode version) and the kernel version.
+def getMachineID():
+   if not hasattr(getMachineID, 'machineID'):
+      cpuInfo = dict()
+      with open('/proc/cpuinfo') as f:
+         for line in f:
+            if not line.strip(): break # only the first core
+            key, _, value = line.partition(':')
+            cpuInfo[key.strip()] = value.strip()
+      getMachineID.machineID = ' '.join([cpuInfo.get('vendor_id', ''), cpuInfo.get('cpu family', ''), cpuInfo.get('model', ''),
+                                         cpuInfo.get('stepping', ''), cpuInfo.get('model name', ''), cpuInfo.get('microcode', ''), os.uname()[2]])
+   return getMachineID.machineID
+
+
+# Forwards all calls to another backend, and stores the results of runs in an SQLite database. If the same run (i.e., the same code, parameters, and
+# counter configuration, on the same machine with the same R14 area) is performed again (also in a later session), the stored result is returned instead.
+# If there are more than maxEntries results in the database, the least recently used ones are removed (this is checked when the database is opened, and
+# after every 100 new results).
+# Note that this is only useful for experiments whose results are reproducible; experiments that are repeated to get a different result will always get
+# the same result. The wrapped backend is reset when the CachingBackend is created.
+class CachingBackend(NanoBenchBackend):
+   def __init__(self, backend, dbFile=None, maxEntries=100000):
+      import sqlite3
+      self.backend = backend
+      # the key of a run contains only the parameters that were set with this object; thus, the parameters that were set before (e.g., with
+      # kernel-nanoBench.sh, or in an earlier process) must be reset
+      self.backend.reset()
+      self.params = dict()
+      self.maxEntries = maxEntries
+      self.db = sqlite3.connect(dbFile or os.path.join(getCacheDir(), 'results.sqlite'))
+      self.db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, machine TEXT, output TEXT, lastUsed INTEGER)')
+      self.db.execute('CREATE INDEX IF NOT EXISTS resultsLastUsed ON results (lastUsed)')
+      self.evict()
+      self.db.commit()
+      self.machineKey = None
+      self.nInserted = 0
+
+   def getMachineKey(self):
+      if self.machineKey is None:
+         self.machineKey = ' '.join([getMachineID(), str(self.backend.getR14Size()), str(self.backend.getR14PhysicalAddress())])
+      return self.machineKey
+
+   def setParameter(self, name, value):
+      self.backend.setParameter(name, value)
+      self.params[name] = value
+
+   def reset(self):
+      self.backend.reset()
+      self.params.clear()
+
+   def supportsR14Image(self):
+      return self.backend.supportsR14Image()
+
+   def setR14Image(self, image):
+      self.backend.setR14Image(image)
+      if image is not None:
+         self.params['r14Image'] = hashlib.sha1(image).hexdigest()
+      else:
+         self.params.pop('r14Image', None)
+
+   def getStoredOutput(self, key):
+      row = self.db.execute('SELECT output FROM results WHERE key=?', (key,)).fetchone()
+      if row is None:
+         return None
+      self.db.execute('UPDATE results SET lastUsed=(SELECT IFNULL(MAX(lastUsed), 0)+1 FROM results) WHERE key=?', (key,))
+      self.db.commit()
+      return str(row[0])
+
+   def storeOutput(self, key, output):
+      self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, (SELECT IFNULL(MAX(lastUsed), 0)+1 FROM results))',
+                      (key, self.getMachineKey(), output))
+      self.nInserted += 1
+      if self.nInserted % 100 == 0:
+         self.evict()
+      self.db.commit()
+
+   def getRunKey(self, binFiles, suffix):
+      return getParamsHash(self.params, [self.getMachineKey()] + [getFileHash(f) for f in binFiles] + suffix)
+
+   def run(self, codeBinFile, initBinFile, oneTimeInitBinFile, raw=False):
+      key = self.getRunKey([codeBinFile, initBinFile, oneTimeInitBinFile], (['raw'] if raw else []))
+      output = self.getStoredOutput(key)
+      if output is None:
+         output = self.backend.run(codeBinFile, initBinFile, oneTimeInitBinFile, raw)
+         self.storeOutput(key, output)
+      return output
+
+   # binary outputs are stored in Base64 encoding; if the backend does not support them, nothing is stored
+   def runBinary(self, codeBinFile, initBinFile, oneTimeInitBinFile):
+      key = self.getRunKey([codeBinFile, initBinFile, oneTimeInitBinFile], ['bin'])
+      output = self.getStoredOutput(key)
+      if output is not None:
+         return base64.b64decode(output)
+      data = self.backend.runBinary(codeBinFile, initBinFile, oneTimeInitBinFile)
+      if data is not None:
+         self.storeOutput(key, bytesToStr(base64.b64encode(data)))
+      return data
+
+   def runBatch(self, batch):
+      key = getParamsHash(self.params, [self.getMachineKey(), hashlib.sha1(batch).hexdigest(), 'batch'])
+      output = self.getStoredOutput(key)
+      if output is not None:
+         return base64.b64decode(output)
+      data = self.backend.runBatch(batch)
+      if data is not None:
+         self.storeOutput(key, bytesToStr(base64.b64encode(data)))
+      return data
+
+   def evict(self):
+      self.db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY lastUsed DESC LIMIT -1 OFFSET ?)', (self.maxEntries,))
+
+   # Removes the stored results for the current machine (or for all machines if allMachines is True).
+   def invalidate(self, allMachines=False):
+      if allMachines:
+         self.db.execute('DELETE FROM results')
+      else:
+         self.db.execute('DELETE FROM results WHERE machine=?', (self.getMachineKey(),))
+      self.db.commit()
+
+   def getR14Size(self):
+      return self.backend.getR14Size()
+
+   def getMaxRegions(self):
+      return self.backend.getMaxRegions()
+
+   def getR14PhysicalAddress(self):
+      return self.backend.getR14PhysicalAddress()
+
+   def readMSR(self, msr):
+      return self.backend.readMSR(msr)
+
+   def getTmpDir(self):
+      return self.backend.getTmpDir()
+
+
+# Removes the results stored by the CachingBackend that is currently used (if any).
+def invalidateResultCache(allMachines=False):
+   curBackend = getBackend()
+   while curBackend is not None:
+      if isinstance(curBackend, CachingBackend):
+         curBackend.invalidate(allMachines)
+      curBackend = getattr(curBackend, 'backend', None)
+
+
+backends = {'kernel': KernelBackend, 'user': UserBackend, 'fake': FakeBackend}
+backend = None
+
+# If the NB_REPLAY environment variable is set, the results are taken from the log file it specifies; if NB_RECORD is set, the results are recorded
+# to the log file it specifies. If NB_RESULT_CACHE is set, results are stored in a CachingBackend (in the database file it specifies, or in the default
+# location if it is empty); NB_RESULT_CACHE_SIZE specifies the maximum number of stored results.
+def getBackend():
+   if backend is None:
+      if 'NB_REPLAY' in os.environ:
+         setBackend(ReplayBackend(os.environ['NB_REPLAY']))
+      else:
+         setBackend(os.environ.get('NB_BACKEND', 'kernel'))
+         if 'NB_RESULT_CACHE' in os.environ:
+            setBackend(CachingBackend(backend, os.environ['NB_RESULT_CACHE'], int(os.environ.get('NB_RESULT_CACHE_SIZE', '100000'))))
+         if 'NB_RECORD' in os.environ:
+            setBackend(RecordingBackend(backend, os.environ['NB_RECORD']))
+   return backend
+
+# backend can be a NanoBenchBackend object or one of the keys of backends
+def setBackend(newBackend):
+   global backend
+   if not isinstance(newBackend, NanoBenchBackend):
+      newBackend = backends[newBackend]()
+   backend = newBackend
+   paramDict.clear()
+   if hasattr(getR14Size, 'r14Size'): del getR14Size.r14Size
+   if hasattr(getMaxRegions, 'maxRegions'): del getMaxRegions.maxRegions
+   setR14Image.imageHash = None
+
+
+def readMSR(msr):
+   return getBackend().readMSR(msr)
+
+
+# Returns the size in bytes.
+def getR14Size():
+   if not hasattr(getR14Size, 'r14Size'):
+      getR14Size.r14Size = getBackend().getR14Size()
    return getR14Size.r14Size
 
 
+# Returns the maximum number of regions (see PFC_REGION_ASM) in the code, or 0 if the backend does not support regions.
+def getMaxRegions():
+   if not hasattr(getMaxRegions, 'maxRegions'):
+      getMaxRegions.maxRegions = getBackend().getMaxRegions()
+   return getMaxRegions.maxRegions
+
+# Splits a result of runNanoBench() (or of runNanoBenchBatch()) for code with region markers; returns a list with one OrderedDict (with the same keys as
+# for code without region markers) for each region.
+def getRegionResults(result):
+   regionResults = []
+   for counter, value in result.items():
+      counterName, sep, regionStr = counter.rpartition(' (region ')
+      if not sep: continue
+      r = int(regionStr.rstrip(')'))
+      while len(regionResults) <= r:
+         regionResults.append(collections.OrderedDict())
+      regionResults[r][counterName] = value
+   return regionResults
+
+
 ramdiskCreated = False
 paramDict = dict()
 
-# Assumes that no changes to the corresponding files in /sys/nb/ were made since the last call to setNanoBenchParameters().
+# Assumes that no changes to the parameters were made since the last call to setNanoBenchParameters() (e.g., by writing to the files in /sys/nb/).
 # Otherwise, reset() needs to be called first.
 def setNanoBenchParameters(config=None, configFile=None, msrConfig=None, msrConfigFile=None, nMeasurements=None, unrollCount=None, loopCount=None,
                            warmUpCount=None, initialWarmUpCount=None, alignmentOffset=0, codeOffset=0, aggregateFunction=None, basicMode=None, noMem=None,
                            verbose=None):
-   if not ramdiskCreated: createRamdisk()
-
-   if config is not None:
-      if paramDict.get('config', None) != config:
-         configFile = '/tmp/ramdisk/config'
-         writeFile(configFile, config)
-         paramDict['config'] = config
    if configFile is not None:
-      writeFile('/sys/nb/config', configFile)
-
-   if msrConfig is not None:
-      if paramDict.get('msrConfig', None) != msrConfig:
-         msrConfigFile = '/tmp/ramdisk/msr_config'
-         writeFile(msrConfigFile, msrConfig)
-         paramDict['msrConfig'] = msrConfig
+      with open(configFile) as f: config = f.read()
    if msrConfigFile is not None:
-      writeFile('/sys/nb/msr_config', msrConfigFile)
-
-   if nMeasurements is not None:
-      if paramDict.get('nMeasurements', None) != nMeasurements:
-         writeFile('/sys/nb/n_measurements', str(nMeasurements))
-         paramDict['nMeasurements'] = nMeasurements
-
-   if unrollCount is not None:
-      if paramDict.get('unrollCount', None) != unrollCount:
-         writeFile('/sys/nb/unroll_count', str(unrollCount))
-         paramDict['unrollCount'] = unrollCount
-
-   if loopCount is not None:
-      if paramDict.get('loopCount', None) != loopCount:
-         writeFile('/sys/nb/loop_count', str(loopCount))
-         paramDict['loopCount'] = loopCount
-
-   if warmUpCount is not None:
-      if paramDict.get('warmUpCount', None) != warmUpCount:
-         writeFile('/sys/nb/warm_up', str(warmUpCount))
-         paramDict['warmUpCount'] = warmUpCount
-
-   if initialWarmUpCount is not None:
-      if paramDict.get('initialWarmUpCount', None) != initialWarmUpCount:
-         writeFile('/sys/nb/initial_warm_up', str(initialWarmUpCount))
-         paramDict['initialWarmUpCount'] = initialWarmUpCount
-
-   if alignmentOffset is not None:
-      if paramDict.get('alignmentOffset', None) != alignmentOffset:
-         writeFile('/sys/nb/alignment_offset', str(alignmentOffset))
-         paramDict['alignmentOffset'] = alignmentOffset
-
-   if codeOffset is not None:
-      if paramDict.get('codeOffset', None) != codeOffset:
-         writeFile('/sys/nb/code_offset', str(codeOffset))
-         paramDict['codeOffset'] = codeOffset
-
-   if aggregateFunction is not None:
-      if paramDict.get('aggregateFunction', None) != aggregateFunction:
-         writeFile('/sys/nb/agg', aggregateFunction)
-         paramDict['aggregateFunction'] = aggregateFunction
-
-   if basicMode is not None:
-      if paramDict.get('basicMode', None) != basicMode:
-         writeFile('/sys/nb/basic_mode', str(int(basicMode)))
-         paramDict['basicMode'] = basicMode
-
-   if noMem is not None:
-      if paramDict.get('noMem', None) != noMem:
-         writeFile('/sys/nb/no_mem', str(int(noMem)))
-         paramDict['noMem'] = noMem
-
-   if verbose is not None:
-      if paramDict.get('verbose', None) != verbose:
-         writeFile('/sys/nb/verbose', str(int(verbose)))
-         paramDict['verbose'] = verbose
+      with open(msrConfigFile) as f: msrConfig = f.read()
+
+   for name, value in [('config', config), ('msrConfig', msrConfig), ('nMeasurements', nMeasurements), ('unrollCount', unrollCount),
+                       ('loopCount', loopCount), ('warmUpCount', warmUpCount), ('initialWarmUpCount', initialWarmUpCount),
+                       ('alignmentOffset', alignmentOffset), ('codeOffset', codeOffset), ('aggregateFunction', aggregateFunction), ('basicMode', basicMode),
+                       ('noMem', noMem), ('verbose', verbose)]:
+      if value is not None:
+         if paramDict.get(name, None) != value:
+            with timed('parameters'):
+               getBackend().setParameter(name, value)
+            paramDict[name] = value
 
 
 def resetNanoBench():
-   with open('/sys/nb/reset') as resetFile: resetFile.read()
+   getBackend().reset()
    paramDict.clear()
+   setR14Image.imageHash = None
 
 
-# code, codeObjFile, codeBinFile cannot be specified at the same time (same for init, initObjFile and initBinFile)
-def runNanoBench(code='', codeObjFile=None, codeBinFile=None,
-                 init='', initObjFile=None, initBinFile=None,
-                 oneTimeInit='', oneTimeInitObjFile=None, oneTimeInitBinFile=None):
-   if not ramdiskCreated: createRamdisk()
-   with open('/sys/nb/clear') as clearFile: clearFile.read()
+# value of the target field of an entry in /sys/nb/r14_image for a null pointer
+R14_IMAGE_NULL = 2**64 - 1
 
+def supportsR14Image():
+   return getBackend().supportsR14Image()
+
+# Sets the image that is written to the R14 area before the one-time init code is executed (see NanoBenchBackend.setR14Image()). The image is a byte
+# string with (offset, target) pairs of 64-bit integers; for each pair, the address R14+target (or 0 if target is R14_IMAGE_NULL) is written to
+# R14+offset. The image is removed by resetNanoBench() or by calling this function with None.
+def setR14Image(image):
+   getBackend().setR14Image(image)
+   setR14Image.imageHash = (hashlib.sha1(image).hexdigest() if image is not None else None)
+setR14Image.imageHash = None
+
+
+# Returns the bin files for the code, the init code, and the one-time init code.
+def getBinFiles(code, codeObjFile, codeBinFile, init, initObjFile, initBinFile, oneTimeInit, oneTimeInitObjFile, oneTimeInitBinFile):
    if code:
-      codeObjFile = '/tmp/ramdisk/code.o'
-      assemble(code, codeObjFile)
+      codeBinFile = getBinFileForCode(code)
    if codeObjFile is not None:
-      objcopy(codeObjFile, '/tmp/ramdisk/code.bin')
-      writeFile('/sys/nb/code', '/tmp/ramdisk/code.bin')
-   elif codeBinFile is not None:
-      writeFile('/sys/nb/code', codeBinFile)
+      codeBinFile = os.path.join(getBackend().getTmpDir(), 'code.bin')
+      objcopy(codeObjFile, codeBinFile)
 
    if init:
-      initObjFile = '/tmp/ramdisk/init.o'
-      assemble(init, initObjFile)
+      initBinFile = getBinFileForCode(init)
    if initObjFile is not None:
-      objcopy(initObjFile, '/tmp/ramdisk/init.bin')
-      writeFile('/sys/nb/init', '/tmp/ramdisk/init.bin')
-   elif initBinFile is not None:
-      writeFile('/sys/nb/init', initBinFile)
+      initBinFile = os.path.join(getBackend().getTmpDir(), 'init.bin')
+      objcopy(initObjFile, initBinFile)
 
    if oneTimeInit:
-      oneTimeInitObjFile = '/tmp/ramdisk/one_time_init.o'
-      assemble(oneTimeInit, oneTimeInitObjFile)
+      oneTimeInitBinFile = getBinFileForCode(oneTimeInit)
    if oneTimeInitObjFile is not None:
-      objcopy(oneTimeInitObjFile, '/tmp/ramdisk/one_time_init.bin')
-      writeFile('/sys/nb/one_time_init', '/tmp/ramdisk/one_time_init.bin')
-   elif oneTimeInitBinFile is not None:
-      writeFile('/sys/nb/one_time_init', oneTimeInitBinFile)
+      oneTimeInitBinFile = os.path.join(getBackend().getTmpDir(), 'one_time_init.bin')
+      objcopy(oneTimeInitObjFile, oneTimeInitBinFile)
+
+   return (codeBinFile, initBinFile, oneTimeInitBinFile)
+
+
+# header of /proc/nanoBench_bin: magic, version, n_measurements, name_length, n_rep, n_counters, reserved
+BIN_HEADER = struct.Struct('<IIIIqII')
+BIN_MAGIC = 0x4E42494E
+BIN_VERSION = 2
+
+def bytesToStr(b):
+   return b if isinstance(b, str) else b.decode('ascii')
 
-   with open('/proc/nanoBench') as resultFile:
-      output = resultFile.read().split('\n')
+# Returns (nRep, nMeasurements, nameLength, recordSize, nRecords) for the result at the given offset of data in the format of /proc/nanoBench_bin.
+def parseBinaryHeader(data, offset=0):
+   magic, version, nMeasurements, nameLength, nRep, nCounters, _ = BIN_HEADER.unpack_from(data, offset)
+   if magic != BIN_MAGIC or version != BIN_VERSION:
+      sys.stderr.write('Error: unsupported format of /proc/nanoBench_bin\n')
+      exit(1)
+   recordSize = nameLength + (2*nMeasurements + 2) * 8
+   return (nRep, nMeasurements, nameLength, recordSize, nCounters)
+
+# Returns the aggregated results (as an OrderedDict) for the result at the given offset of data in the format of /proc/nanoBench_bin, and the offset
+# of the next result.
+def parseBinaryResult(data, offset=0):
+   ret = collections.OrderedDict()
+   nRep, nMeasurements, nameLength, recordSize, nRecords = parseBinaryHeader(data, offset)
+   offset += BIN_HEADER.size
+   for _ in range(0, nRecords):
+      name = bytesToStr(data[offset:offset+nameLength].split(b'\0', 1)[0])
+      agg, aggBase = struct.unpack_from('<qq', data, offset + recordSize - 16)
+      ret[name] = (agg - aggBase) / (100.0 * nRep)
+      offset += recordSize
+   return (ret, offset)
+
+
+# code, codeObjFile, codeBinFile cannot be specified at the same time (same for init, initObjFile and initBinFile)
+# If the backend supports the binary format of /proc/nanoBench_bin, the results are not rounded to two decimal places.
+def runNanoBench(code='', codeObjFile=None, codeBinFile=None,
+                 init='', initObjFile=None, initBinFile=None,
+                 oneTimeInit='', oneTimeInitObjFile=None, oneTimeInitBinFile=None):
+   binFiles = getBinFiles(code, codeObjFile, codeBinFile, init, initObjFile, initBinFile, oneTimeInit, oneTimeInitObjFile, oneTimeInitBinFile)
+
+   with timed('run'):
+      data = getBackend().runBinary(*binFiles)
+      if data is None:
+         output = getBackend().run(*binFiles)
+
+   if data is not None:
+      with timed('parse'):
+         return parseBinaryResult(data)[0]
+
+   with timed('parse'):
+      ret = collections.OrderedDict()
+      for line in output.split('\n'):
+         if not ':' in line: continue
+         line_split = line.split(':')
+         counter = line_split[0].strip()
+         value = float(line_split[1].strip())
+         ret[counter] = value
+
+   return ret
+
+
+# counters: list of the counter names
+# nRep: number of repetitions of the benchmark code by which the difference between the main and the base run is divided
+# samples: NumPy array of shape (len(counters), 2, nMeasurements); samples[c][0] contains the results of the main run for counter c, samples[c][1] the
+#          results of the base run
+RawResult = collections.namedtuple('RawResult', 'counters nRep samples')
+
+# Same as runNanoBench(), but returns the results of all measurements (as a RawResult) instead of the aggregated results.
+def runNanoBenchRaw(code='', codeObjFile=None, codeBinFile=None,
+                    init='', initObjFile=None, initBinFile=None,
+                    oneTimeInit='', oneTimeInitObjFile=None, oneTimeInitBinFile=None):
+   import numpy
+
+   binFiles = getBinFiles(code, codeObjFile, codeBinFile, init, initObjFile, initBinFile, oneTimeInit, oneTimeInitObjFile, oneTimeInitBinFile)
+
+   with timed('run'):
+      data = getBackend().runBinary(*binFiles)
+      if data is None:
+         output = getBackend().run(*binFiles, raw=True)
+
+   if data is not None:
+      with timed('parse'):
+         nRep, nMeasurements, nameLength, recordSize, nRecords = parseBinaryHeader(data)
+         dtype = numpy.dtype([('name', 'S' + str(nameLength)), ('samples', '<i8', (2, nMeasurements)), ('agg', '<i8', (2,))])
+         records = numpy.frombuffer(data, dtype=dtype, count=nRecords, offset=BIN_HEADER.size)
+         return RawResult([bytesToStr(n) for n in records['name']], nRep, records['samples'])
+
+   with timed('parse'):
+      counters = []
+      samples = []
+      nRep = 1
+      for line in output.split('\n'):
+         if not ':' in line: continue
+         counter, _, values = line.partition(':')
+         nRepStr, mainStr, baseStr = values.split(';')
+         counters.append(counter.strip())
+         nRep = int(nRepStr)
+         samples.append([[int(v) for v in mainStr.split()], [int(v) for v in baseStr.split()]])
+
+      return RawResult(counters, nRep, numpy.array(samples, dtype=numpy.int64))
+
+
+# header of an experiment in /sys/nb/batch: magic, flags, n_measurements, unroll_count, loop_count, warm_up_count, initial_warm_up_count,
+# alignment_offset, code_offset, aggregate_function, code_length, init_length, one_time_init_length
+BATCH_HEADER = struct.Struct('<IIqqqqqqqqQQQ')
+BATCH_MAGIC = 0x4E424254
+BATCH_MAX_SIZE = 1024 * 1024
+
+# values of the parameters after a reset of the kernel module
+defaultParams = {'nMeasurements': 10, 'unrollCount': 1000, 'loopCount': 0, 'warmUpCount': 5, 'initialWarmUpCount': 0, 'alignmentOffset': 0,
+                 'codeOffset': 0, 'aggregateFunction': 'avg', 'basicMode': False, 'noMem': False}
+batchAggregateFunctions = {'avg': 0, 'min': 1, 'max': 2, 'med': 3}
+
+def getBatchEntry(params, binFiles):
+   codes = []
+   for binFile in binFiles:
+      if binFile is None:
+         codes.append(b'')
+      else:
+         with open(binFile, 'rb') as f:
+            codes.append(f.read())
+   flags = (1 if params['basicMode'] else 0) | (2 if params['noMem'] else 0)
+   header = BATCH_HEADER.pack(BATCH_MAGIC, flags, params['nMeasurements'], params['unrollCount'], params['loopCount'], params['warmUpCount'],
+                              params['initialWarmUpCount'], params['alignmentOffset'], params['codeOffset'],
+                              batchAggregateFunctions[params['aggregateFunction']], len(codes[0]), len(codes[1]), len(codes[2]))
+   return header + b''.join(c + b'\0' * (-len(c) % 8) for c in codes)
+
+# Runs multiple experiments, and returns a list with the results (in the same format as for runNanoBench()).
+# Each experiment is a dict that can contain the keys 'code', 'init', 'oneTimeInit' (assembler code), 'codeBinFile', 'initBinFile',
+# 'oneTimeInitBinFile', and the names of the parameters of setNanoBenchParameters() except for the configs and verbose. Parameters that are not
+# specified have the values that were set with setNanoBenchParameters().
+# If the backend supports it, the experiments are submitted to the kernel module in batches of up to BATCH_MAX_SIZE bytes; otherwise, they are run one
+# after the other. In the first case, the parameters of the kernel module are unchanged afterwards.
+def runNanoBenchBatch(experiments):
+   codeKeys = ['code', 'init', 'oneTimeInit']
+   codeBinFiles = assembleMany([e.get(k) for e in experiments for k in codeKeys])
+
+   entries = []
+   for i, experiment in enumerate(experiments):
+      binFiles = [experiment.get(k + 'BinFile') or codeBinFiles[3*i+j] for j, k in enumerate(codeKeys)]
+      params = {k: experiment.get(k, paramDict.get(k, v)) for k, v in defaultParams.items()}
+      entries.append((params, binFiles))
+
+   results = []
+   batch = b''
+   nInBatch = 0
+   for i, (params, binFiles) in enumerate(entries):
+      batch += getBatchEntry(params, binFiles)
+      nInBatch += 1
+      if len(batch) < BATCH_MAX_SIZE and i < len(entries) - 1: continue
+
+      with timed('run'):
+         data = getBackend().runBatch(batch)
+      if data is None:
+         break
+      with timed('parse'):
+         offset = 0
+         for _ in range(0, nInBatch):
+            result, offset = parseBinaryResult(data, offset)
+            results.append(result)
+      batch = b''
+      nInBatch = 0
+
+   for params, binFiles in entries[len(results):]:
+      setNanoBenchParameters(**params)
+      results.append(runNanoBench(codeBinFile=binFiles[0], initBinFile=binFiles[1], oneTimeInitBinFile=binFiles[2]))
+
+   return results
+
+
+# Divides like in C (i.e., rounds towards 0).
+def cDiv(a, b):
+   q = abs(a) // abs(b)
+   return q if (a >= 0) == (b >= 0) else -q
+
+def getAggregateValue100(values, aggregateFunction):
+   if aggregateFunction == 'min':
+      return int(min(values)) * 100
+   if aggregateFunction == 'max':
+      return int(max(values)) * 100
+   values = sorted(int(v) for v in values)
+   if aggregateFunction == 'med':
+      return values[len(values)//2] * 100
+   # average of the values between the 20 and 80 percentile
+   values = values[len(values)//5:len(values)-len(values)//5]
+   return cDiv(sum(values) * 100, len(values))
+
+# Computes the aggregated results from a RawResult in the same way as the kernel module; returns an OrderedDict like runNanoBench().
+# aggregateFunction can be 'avg', 'med', 'min', or 'max'; if it is None, the function that was set with setNanoBenchParameters() is used.
+def aggregateRawResult(rawResult, aggregateFunction=None):
+   if aggregateFunction is None:
+      aggregateFunction = paramDict.get('aggregateFunction', 'avg')
 
    ret = collections.OrderedDict()
-   for line in output:
-      if not ':' in line: continue
-      line_split = line.split(':')
-      counter = line_split[0].strip()
-      value = float(line_split[1].strip())
-      ret[counter] = value
+   for counter, (main, base) in zip(rawResult.counters, rawResult.samples):
+      agg = getAggregateValue100(main, aggregateFunction)
+      aggBase = getAggregateValue100(base, aggregateFunction)
+      ret[counter] = cDiv((agg - aggBase) + rawResult.nRep//2, rawResult.nRep) / 100.0
+   return ret
+
+
+# values: aggregated results (as for runNanoBench())
+# nMeasurements: number of measurements that were used to compute the values
+# rawResult: the results of all these measurements (as a RawResult)
+AdaptiveResult = collections.namedtuple('AdaptiveResult', 'values nMeasurements rawResult')
+
+# factor for the 95% confidence intervals in runNanoBenchAdaptive() (normal approximation)
+CI_FACTOR = 1.96
+
+# Returns the mean of the values (main run - base run) / nRep of the individual measurements of a RawResult, and the half-width of its confidence
+# interval; the results are NumPy arrays with one entry per counter. If trimmed is True, the mean of the values between the 20 and 80 percentile (as for
+# the 'avg' aggregate function) is used instead, which is not affected by a few outliers (e.g., due to interrupts); the confidence interval is then
+# computed from the winsorized variance.
+def getMeanAndCI(rawResult, trimmed=False):
+   import numpy
+   values = (rawResult.samples[:, 0, :] - rawResult.samples[:, 1, :]) / float(rawResult.nRep)
+   n = values.shape[1]
+   k = (n // 5 if trimmed else 0)
+   if k > 0:
+      values = numpy.sort(values, axis=1)
+      mean = values[:, k:n-k].mean(axis=1)
+      values[:, :k] = values[:, k:k+1]
+      values[:, n-k:] = values[:, n-k-1:n-k]
+   else:
+      mean = values.mean(axis=1)
+   if n < 2:
+      return (mean, numpy.full(values.shape[0], numpy.inf))
+   return (mean, CI_FACTOR * values.std(axis=1, ddof=1) / ((1 - 2.0*k/n) * numpy.sqrt(n)))
+
+# Same as runNanoBench(), but instead of using a fixed number of measurements, the benchmark is run repeatedly with chunkSize measurements until
+# - at least minMeasurements measurements were performed, and
+# - for all counters in counters (all counters if None), the half-width of the confidence interval of the mean is at most maxCI (if maxCI is not None),
+#   and the confidence interval does not contain the threshold for the counter (if threshold is not None; threshold can be a number or a dict from
+#   counter names to numbers),
+# or until maxMeasurements measurements were performed. If trimmed is True, the trimmed mean is used instead of the mean (see getMeanAndCI()). The
+# values are computed from all measurements with the aggregate function that was set with setNanoBenchParameters(). Returns an AdaptiveResult. The
+# nMeasurements parameter is restored afterwards.
+def runNanoBenchAdaptive(code='', codeObjFile=None, codeBinFile=None,
+                         init='', initObjFile=None, initBinFile=None,
+                         oneTimeInit='', oneTimeInitObjFile=None, oneTimeInitBinFile=None,
+                         counters=None, maxCI=None, threshold=None, minMeasurements=5, maxMeasurements=100, chunkSize=5,
+                         trimmed=False):
+   import numpy
+
+   binFiles = getBinFiles(code, codeObjFile, codeBinFile, init, initObjFile, initBinFile, oneTimeInit, oneTimeInitObjFile, oneTimeInitBinFile)
+
+   prevNMeasurements = paramDict.get('nMeasurements')
+   chunks = []
+   nMeasurements = 0
+   while True:
+      curChunkSize = min(chunkSize, maxMeasurements - nMeasurements)
+      setNanoBenchParameters(nMeasurements=curChunkSize)
+      chunk = runNanoBenchRaw(codeBinFile=binFiles[0], initBinFile=binFiles[1], oneTimeInitBinFile=binFiles[2])
+      chunks.append(chunk)
+      nMeasurements += curChunkSize
+
+      with timed('statistics'):
+         rawResult = RawResult(chunk.counters, chunk.nRep, numpy.concatenate([c.samples for c in chunks], axis=2))
+         if nMeasurements >= maxMeasurements:
+            break
+         if nMeasurements < minMeasurements:
+            continue
+
+         means, cis = getMeanAndCI(rawResult, trimmed)
+         done = True
+         for counter, mean, ci in zip(rawResult.counters, means, cis):
+            if counters is not None and counter not in counters: continue
+            if maxCI is not None and ci > maxCI:
+               done = False
+            if threshold is not None:
+               t = threshold.get(counter) if isinstance(threshold, dict) else threshold
+               if t is not None and mean - ci <= t <= mean + ci:
+                  done = False
+         if done:
+            break
+
+   if prevNMeasurements is not None:
+      setNanoBenchParameters(nMeasurements=prevNMeasurements)
+
+   with timed('statistics'):
+      return AdaptiveResult(aggregateRawResult(rawResult), nMeasurements, rawResult)
+
+
+# maximum size (in bytes) of the unrolled code in calibrateRepetitions(); this should be smaller than the L1 instruction cache
+ICACHE_BUDGET = 16 * 1024
+
+def getCalibrationCacheFile():
+   return os.path.join(getCacheDir(), 'calibration.json')
+
+def getCalibrationCache():
+   if not hasattr(getCalibrationCache, 'cache'):
+      getCalibrationCache.cache = dict()
+      if os.path.exists(getCalibrationCacheFile()):
+         with open(getCalibrationCacheFile()) as f:
+            getCalibrationCache.cache = json.load(f)
+   return getCalibrationCache.cache
+
+def storeCalibration(key, value):
+   getCalibrationCache()[key] = value
+   tmpFile = getCalibrationCacheFile() + '.' + str(os.getpid())
+   with open(tmpFile, 'w') as f:
+      json.dump(getCalibrationCache(), f)
+   os.rename(tmpFile, getCalibrationCacheFile())
+
+# Determines the smallest number of repetitions for which the result (for the given counter) has converged, i.e., the smallest count c (among minCount,
+# 2*minCount, 4*minCount, ...) for which the results with c and 2*c repetitions differ by at most tolerance (relative) or absTolerance (absolute).
+# If useLoop is False, the unroll count is calibrated (with loopCount=0); the unrolled code must not be larger than maxCodeSize (ICACHE_BUDGET if None).
+# If useLoop is True, the loop count is calibrated for the given unroll count. The count is at most maxCount.
+# If counter is None, 'Core cycles' (or 'APERF' on AMD CPUs) is used. The other parameters need to be set with setNanoBenchParameters() before.
+# The results are cached (also on disk) per machine, parameters, R14 image, and shapeKey; by default, the shape of a snippet is given by its code
+# (including the init code). Returns (unrollCount, loopCount); the unroll count and the loop count parameters are set to these values.
+def calibrateRepetitions(code='', codeBinFile=None, init='', initBinFile=None, oneTimeInit='', oneTimeInitBinFile=None, counter=None, useLoop=False,
+                         unrollCount=1, maxCodeSize=None, minCount=1, maxCount=10000, tolerance=0.02, absTolerance=0.02, shapeKey=None):
+   binFiles = getBinFiles(code, None, codeBinFile, init, None, initBinFile, oneTimeInit, None, oneTimeInitBinFile)
+   if maxCodeSize is None:
+      maxCodeSize = ICACHE_BUDGET
+
+   if shapeKey is None:
+      shapeKey = [getFileHash(f) for f in binFiles]
+   params = {k: v for k, v in paramDict.items() if k not in ['unrollCount', 'loopCount']}
+   key = getParamsHash(params, [getMachineID(), type(getBackend()).__name__, shapeKey, setR14Image.imageHash, counter, useLoop, unrollCount, maxCodeSize,
+                                minCount, maxCount, tolerance, absTolerance])
+   if key in getCalibrationCache():
+      ret = tuple(getCalibrationCache()[key])
+      setNanoBenchParameters(unrollCount=ret[0], loopCount=ret[1])
+      return ret
+
+   codeSize = os.path.getsize(binFiles[0]) if binFiles[0] is not None else 0
+   if codeSize > 0:
+      maxUnrollCount = max(1, maxCodeSize // codeSize)
+      if useLoop:
+         unrollCount = min(unrollCount, maxUnrollCount)
+      else:
+         maxCount = min(maxCount, maxUnrollCount)
+
+   def getValue(count):
+      if useLoop:
+         setNanoBenchParameters(unrollCount=unrollCount, loopCount=count)
+      else:
+         setNanoBenchParameters(unrollCount=count, loopCount=0)
+      result = runNanoBench(codeBinFile=binFiles[0], initBinFile=binFiles[1], oneTimeInitBinFile=binFiles[2])
+      return result[counter if counter is not None else ('APERF' if 'APERF' in result else 'Core cycles')]
+
+   count = min(minCount, maxCount)
+   value = getValue(count)
+   while 2*count <= maxCount:
+      nextValue = getValue(2*count)
+      if abs(nextValue - value) <= max(absTolerance, tolerance * abs(nextValue)):
+         break
+      count *= 2
+      value = nextValue
+   else:
+      count = maxCount
 
+   ret = (unrollCount, count) if useLoop else (count, 0)
+   storeCalibration(key, ret)
+   setNanoBenchParameters(unrollCount=ret[0], loopCount=ret[1])
    return ret
 
 
@@ -198,4 +1372,4 @@ def deleteRamdisk():
       except subprocess.CalledProcessError as e:
          sys.stderr.write('Could not delete ramdisk ' + e.output + '\n')
 
-atexit.register(deleteRamdisk)
\ No newline at end of file
+atexit.register(deleteRamdisk)
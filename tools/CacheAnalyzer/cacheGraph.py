@@ -8,15 +8,16 @@ import sys
 from cacheLib import *
 import cacheSim
 
-from plotly.offline import plot
-import plotly.graph_objects as go
-
 import logging
 log = logging.getLogger(__name__)
 
 
 # traces is a list of (name, y value list) pairs
 def getPlotlyGraphDiv(title, x_title, y_title, traces):
+   # plotly is imported here, as importing it takes a significant amount of time
+   from plotly.offline import plot
+   import plotly.graph_objects as go
+
    fig = go.Figure()
    fig.update_layout(title_text=title)
    fig.update_xaxes(title_text=x_title)
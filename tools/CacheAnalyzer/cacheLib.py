@@ -1,8 +1,11 @@
 #!/usr/bin/python
 from itertools import count
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
+import hashlib
+import json
 import math
+import os
 import random
 import re
 import subprocess
@@ -149,8 +152,7 @@ def getCacheInfo(level):
 def getNCBoxUnits():
    if not hasattr(getNCBoxUnits, 'nCBoxUnits'):
       try:
-         subprocess.check_output(['modprobe', 'msr'])
-         cbo_config = subprocess.check_output(['rdmsr', '0x396'])
+         cbo_config = readMSR(0x396)
          if getArch() in ['CNL', 'ICL']:
             getNCBoxUnits.nCBoxUnits = int(cbo_config)
          else:
@@ -165,21 +167,105 @@ def getNCBoxUnits():
    return getNCBoxUnits.nCBoxUnits
 
 
-def getCBoxOfAddress(address):
-   if not hasattr(getCBoxOfAddress, 'cBoxMap'):
-      getCBoxOfAddress.cBoxMap = dict()
-   cBoxMap = getCBoxOfAddress.cBoxMap
-
-   if not address in cBoxMap:
+def getR14PhysicalAddress():
+   if not hasattr(getR14PhysicalAddress, 'address'):
+      getR14PhysicalAddress.address = getBackend().getR14PhysicalAddress()
+   return getR14PhysicalAddress.address
+
+# Returns a string that identifies the CPU model and the physical address and the size of the R14 area, or None if the physical address is not known
+# (e.g., with older versions of the kernel module).
+def getR14LayoutID():
+   if not hasattr(getR14LayoutID, 'layoutID'):
+      getR14LayoutID.layoutID = None
+      r14PhysicalAddress = getR14PhysicalAddress()
+      if r14PhysicalAddress is not None:
+         key = ' '.join([cpuid.cpu_name(cpuid.CPUID()), getArch(), hex(r14PhysicalAddress), str(getR14Size())])
+         getR14LayoutID.layoutID = hashlib.sha1(key.encode('utf-8')).hexdigest()
+   return getR14LayoutID.layoutID
+
+
+# Returns the map from addresses (i.e., offsets in the R14 area) to CBoxes that were determined experimentally. The map is stored on disk, in a file that
+# depends on getR14LayoutID(); if the ID is not available, the map is only kept in memory.
+def getCBoxMap():
+   if not hasattr(getCBoxMap, 'cBoxMap'):
+      getCBoxMap.cBoxMap = dict()
+      getCBoxMap.fileName = None
+
+      if getR14LayoutID() is not None:
+         getCBoxMap.fileName = os.path.join(getCacheDir('cbox'), getR14LayoutID() + '.txt')
+         if os.path.exists(getCBoxMap.fileName):
+            with open(getCBoxMap.fileName) as f:
+               for line in f:
+                  address, cBox = line.split()
+                  getCBoxMap.cBoxMap[int(address)] = int(cBox)
+   return getCBoxMap.cBoxMap
+
+
+# Determines the CBoxes of all addresses in one batch of experiments (see runNanoBenchBatch); returns the list of the CBoxes.
+def getCBoxesOfAddresses(addresses):
+   cBoxMap = getCBoxMap()
+   newAddresses = [addr for addr in OrderedDict.fromkeys(addresses) if not addr in cBoxMap]
+
+   if newAddresses:
       setNanoBenchParameters(config='', msrConfig=getDefaultCacheMSRConfig(), nMeasurements=10, unrollCount=1, loopCount=10, aggregateFunction='min',
                              basicMode=True, noMem=True)
 
-      ec = getCodeForAddressLists([AddressList([address], False, True, False)])
-      nb = runNanoBench(code=ec.code, oneTimeInit=ec.oneTimeInit)
-
-      nCacheLookups = [nb['CACHE_LOOKUP_CBO_'+str(cBox)] for cBox in range(0, getNCBoxUnits())]
-      cBoxMap[address] = nCacheLookups.index(max(nCacheLookups))
-
+      experiments = []
+      for address in newAddresses:
+         ec = getCodeForAddressLists([AddressList([address], False, True, False)])
+         experiments.append({'code': ec.code, 'oneTimeInit': ec.oneTimeInit})
+
+      for address, nb in zip(newAddresses, runNanoBenchBatch(experiments)):
+         nCacheLookups = [nb['CACHE_LOOKUP_CBO_'+str(cBox)] for cBox in range(0, getNCBoxUnits())]
+         cBoxMap[address] = nCacheLookups.index(max(nCacheLookups))
+
+      if getCBoxMap.fileName is not None:
+         with open(getCBoxMap.fileName, 'a') as f:
+            f.write(''.join(str(addr) + ' ' + str(cBoxMap[addr]) + '\n' for addr in newAddresses))
+
+   return [cBoxMap[addr] for addr in addresses]
+
+
+# number of addresses that are classified at once by getCBoxOfAddress() if a stride is specified
+CBOX_BULK_SIZE = 64
+
+# Returns the slice hash function that was learned with sliceHash.py for the current R14 area (as a list of masks, see getCBoxFromSliceHash()), or None
+# if there is no such function.
+def getSliceHash():
+   if not hasattr(getSliceHash, 'masks'):
+      getSliceHash.masks = None
+      if getR14LayoutID() is not None:
+         fileName = os.path.join(getCacheDir('slicehash'), getR14LayoutID() + '.json')
+         if os.path.exists(fileName):
+            with open(fileName) as f:
+               getSliceHash.masks = json.load(f)['masks']
+   return getSliceHash.masks
+
+def storeSliceHash(masks):
+   with open(os.path.join(getCacheDir('slicehash'), getR14LayoutID() + '.json'), 'w') as f:
+      json.dump({'masks': masks}, f)
+   getSliceHash.masks = masks
+
+# Bit i of the CBox is the parity of the bits of the physical address selected by masks[i]; bit 0 of the masks corresponds to a constant 1 (the lower
+# bits of the address, which are within a cache line, are ignored).
+def getCBoxFromSliceHash(masks, physicalAddress):
+   row = (physicalAddress & ~(getCacheInfo(1).lineSize-1)) | 1
+   return sum((bin(row & mask).count('1') & 1) << i for i, mask in enumerate(masks))
+
+
+# If a slice hash function was learned with sliceHash.py, the CBox is computed directly. Otherwise, it is determined experimentally; in this case, if
+# stride is not None, the CBoxes of the next CBOX_BULK_SIZE addresses with this stride are also determined (in one batch).
+def getCBoxOfAddress(address, stride=None):
+   masks = getSliceHash()
+   if masks is not None:
+      return getCBoxFromSliceHash(masks, getR14PhysicalAddress() + address)
+
+   cBoxMap = getCBoxMap()
+   if not address in cBoxMap:
+      if stride is None:
+         getCBoxesOfAddresses([address])
+      else:
+         getCBoxesOfAddresses([a for a in range(address, address + CBOX_BULK_SIZE*stride, stride) if a < getR14Size()] or [address])
    return cBoxMap[address]
 
 
@@ -189,10 +275,11 @@ def getNewAddressesInCBox(n, cBox, cacheSet, prevAddresses, notInCBox=False):
    else:
       maxPrevAddress = max(prevAddresses)
    addresses = []
-   for addr in count(maxPrevAddress+getCacheInfo(3).waySize, getCacheInfo(3).waySize):
-      if not notInCBox and getCBoxOfAddress(addr) == cBox:
+   L3WaySize = getCacheInfo(3).waySize
+   for addr in count(maxPrevAddress+L3WaySize, L3WaySize):
+      if not notInCBox and getCBoxOfAddress(addr, L3WaySize) == cBox:
          addresses.append(addr)
-      if notInCBox and getCBoxOfAddress(addr) != cBox:
+      if notInCBox and getCBoxOfAddress(addr, L3WaySize) != cBox:
          addresses.append(addr)
       if len(addresses) >= n:
          return addresses
@@ -239,9 +326,23 @@ def getPointerChasingInit(addresses):
    return init
 
 
-ExperimentCode = namedtuple('ExperimentCode', 'code init oneTimeInit')
+# Returns an image for setR14Image() that creates the same pointer-chasing chains as getPointerChasingInit() for each list in addressLists.
+def getPointerChasingImage(addressLists):
+   import numpy
+   offsets = numpy.concatenate([numpy.array(addresses, dtype=numpy.uint64) for addresses in addressLists])
+   targets = numpy.empty_like(offsets)
+   targets[:-1] = offsets[1:]
+   ends = numpy.cumsum([len(addresses) for addresses in addressLists]) - 1
+   targets[ends] = R14_IMAGE_NULL
+   return numpy.column_stack((offsets, targets)).astype('<u8').tobytes()
 
-def getCodeForAddressLists(codeAddressLists, initAddressLists=[], wbinvd=False, afterEveryAcc=''):
+
+# r14Image is None if the pointer-chasing chains are created by the one-time init code
+ExperimentCode = namedtuple('ExperimentCode', 'code init oneTimeInit r14Image')
+
+# If useR14Image is True and the backend supports it, the pointer-chasing chains are created with an image for setR14Image() instead of with
+# one-time init code; this is much faster for long chains. The image must then be set before the code is run.
+def getCodeForAddressLists(codeAddressLists, initAddressLists=[], wbinvd=False, afterEveryAcc='', useR14Image=False):
    distinctAddrLists = set(tuple(l.addresses) for l in initAddressLists+codeAddressLists)
    if len(distinctAddrLists) > 1 and set.intersection(*list(set(l) for l in distinctAddrLists)):
       raise ValueError('same address in different lists')
@@ -252,12 +353,18 @@ def getCodeForAddressLists(codeAddressLists, initAddressLists=[], wbinvd=False,
 
    r14Size = getR14Size()
    alreadyAddedOneTimeInits = set()
+   useR14Image = useR14Image and supportsR14Image()
+   imageAddressLists = []
 
    for addressLists, codeList, isInit in [(initAddressLists, init, True), (codeAddressLists, code, False)]:
       if addressLists is None: continue
 
       pfcEnabled = True
       for addressList in addressLists:
+         if addressList.region:
+            codeList.append(PFC_REGION_ASM + '; ')
+            continue
+
          if addressList.wbinvd:
             if addressList.exclude and pfcEnabled:
                codeList.append(PFC_STOP_ASM + '; ')
@@ -292,7 +399,10 @@ def getCodeForAddressLists(codeAddressLists, initAddressLists=[], wbinvd=False,
                codeList.append('mov RCX, [R14 + ' + str(addresses[0]) + ']; ')
             else:
                if not tuple(addresses) in alreadyAddedOneTimeInits:
-                  oneTimeInit.append(getPointerChasingInit(addresses))
+                  if useR14Image:
+                     imageAddressLists.append(addresses)
+                  else:
+                     oneTimeInit.append(getPointerChasingInit(addresses))
                   alreadyAddedOneTimeInits.add(tuple(addresses))
 
                codeList.append('lea RCX, [R14+' + str(addresses[0]) + ']; 1: mov RCX, [RCX]; ' + afterEveryAcc + 'jrcxz 2f; jmp 1b; 2: ')
@@ -300,7 +410,56 @@ def getCodeForAddressLists(codeAddressLists, initAddressLists=[], wbinvd=False,
       if not isInit and not pfcEnabled:
          codeList.append(PFC_START_ASM + '; ')
 
-   return ExperimentCode(''.join(code), ''.join(init), ''.join(oneTimeInit))
+   r14Image = (getPointerChasingImage(imageAddressLists) if imageAddressLists else None)
+   return ExperimentCode(''.join(code), ''.join(init), ''.join(oneTimeInit), r14Image)
+
+
+# The eviction sets (findMinimalL3EvictionSet.evSetForCacheSet), the addresses for clearing L2 (getClearHLAddresses.clearL2Map), and the addresses in
+# L3SetToWayIDMap are stored in a file that depends on getR14LayoutID() (if available). The file contains one JSON object per line; new entries are
+# appended when they are found. The file is loaded when one of the structures is used for the first time; as a spot check, it is then tested whether
+# one of the stored eviction sets still leads to conflicts. If not, the file is discarded.
+def loadL3Maps():
+   if hasattr(loadL3Maps, 'fileName'):
+      return
+   loadL3Maps.fileName = None
+   findMinimalL3EvictionSet.evSetForCacheSet = dict()
+   getClearHLAddresses.clearL2Map = dict()
+
+   if getR14LayoutID() is None:
+      return
+   fileName = os.path.join(getCacheDir('l3maps'), getR14LayoutID() + '.txt')
+
+   evSets = []
+   if os.path.exists(fileName):
+      with open(fileName) as f:
+         for line in f:
+            entry = json.loads(line)
+            if entry['t'] == 'evSet':
+               findMinimalL3EvictionSet.evSetForCacheSet.setdefault(entry['cBox'], dict()).setdefault(entry['cSlice'], dict())[entry['set']] = \
+                  entry['addresses']
+               evSets.append(entry)
+            elif entry['t'] == 'clearL2':
+               getClearHLAddresses.clearL2Map.setdefault(entry['cBox'], dict())[entry['set']] = entry['addresses']
+            elif entry['t'] == 'way':
+               L3SetToWayIDMap.setdefault(entry['cBox'], dict()).setdefault(entry['cSlice'], dict()).setdefault(entry['set'], dict())[entry['way']] = \
+                  entry['address']
+
+   loadL3Maps.fileName = fileName
+
+   if evSets:
+      entry = random.choice(evSets)
+      clearHLAddrList = AddressList(getClearHLAddresses(3, [entry['set']], entry['cBox'], False), True, False, False)
+      if not hasL3Conflicts(entry['addresses'], clearHLAddrList, getCacheInfo(1).lineSize * (entry['set']+10)):
+         log.warning('Stored eviction sets are not valid anymore; they are discarded')
+         findMinimalL3EvictionSet.evSetForCacheSet.clear()
+         getClearHLAddresses.clearL2Map.clear()
+         L3SetToWayIDMap.clear()
+         os.remove(fileName)
+
+def storeL3MapEntry(entry):
+   if loadL3Maps.fileName is not None:
+      with open(loadL3Maps.fileName, 'a') as f:
+         f.write(json.dumps(entry) + '\n')
 
 
 def getClearHLAddresses(level, cacheSetList, cBox, doNotUseOtherCBoxes, nClearAddresses=None):
@@ -338,8 +497,7 @@ def getClearHLAddresses(level, cacheSetList, cBox, doNotUseOtherCBoxes, nClearAd
 
       return addrForClearingHL
    elif level == 3:
-      if not hasattr(getClearHLAddresses, 'clearL2Map'):
-         getClearHLAddresses.clearL2Map = dict()
+      loadL3Maps()
       clearL2Map = getClearHLAddresses.clearL2Map
 
       if not cBox in clearL2Map:
@@ -349,6 +507,7 @@ def getClearHLAddresses(level, cacheSetList, cBox, doNotUseOtherCBoxes, nClearAd
       for L3Set in cacheSetList:
          if not L3Set in clearL2Map[cBox] or len(clearL2Map[cBox][L3Set]) < nClearAddresses:
             clearL2Map[cBox][L3Set] = getNewAddressesNotInCBox(nClearAddresses, cBox, L3Set, [])
+            storeL3MapEntry({'t': 'clearL2', 'cBox': cBox, 'set': L3Set, 'addresses': clearL2Map[cBox][L3Set]})
          clearAddresses += clearL2Map[cBox][L3Set][:nClearAddresses]
 
       return clearAddresses
@@ -362,6 +521,7 @@ def getAddresses(level, wayID, cacheSetList, cBox=1, cSlice=0):
       waySize = getCacheInfo(level).waySize
       return [(wayID*waySize) + s*lineSize for s in cacheSetList]
    elif level == 3:
+      loadL3Maps()
       if not cBox in L3SetToWayIDMap:
          L3SetToWayIDMap[cBox] = dict()
       if not cSlice in L3SetToWayIDMap[cBox]:
@@ -374,11 +534,14 @@ def getAddresses(level, wayID, cacheSetList, cBox=1, cSlice=0):
             if getCacheInfo(3).nSlices != getNCBoxUnits():
                for i, addr in enumerate(findMinimalL3EvictionSet(L3Set, cBox, cSlice)):
                   L3SetToWayIDMap[cBox][cSlice][L3Set][i] = addr
+                  storeL3MapEntry({'t': 'way', 'cBox': cBox, 'cSlice': cSlice, 'set': L3Set, 'way': i, 'address': addr})
          if not wayID in L3SetToWayIDMap[cBox][cSlice][L3Set]:
             if getCacheInfo(3).nSlices == getNCBoxUnits():
                L3SetToWayIDMap[cBox][cSlice][L3Set][wayID] = next(iter(getNewAddressesInCBox(1, cBox, L3Set, L3SetToWayIDMap[cBox][cSlice][L3Set].values())))
             else:
                L3SetToWayIDMap[cBox][cSlice][L3Set][wayID] = next(iter(findCongruentL3Addresses(1, L3Set, cBox, L3SetToWayIDMap[cBox][cSlice][L3Set].values())))
+            storeL3MapEntry({'t': 'way', 'cBox': cBox, 'cSlice': cSlice, 'set': L3Set, 'way': wayID,
+                             'address': L3SetToWayIDMap[cBox][cSlice][L3Set][wayID]})
          addresses.append(L3SetToWayIDMap[cBox][cSlice][L3Set][wayID])
 
       return addresses
@@ -398,6 +561,37 @@ def getBlockSet(blockStr):
    return int(re.match('\d+', blockStr.split('_')[-1]).group())
 
 
+# compiled element of an access sequence (see compileSeq()); name is interned, and id is a unique number for each block name; overrideSet is the
+# cache set specified after a '_' (or None); measure and flush correspond to '?' and '!'
+SeqElement = namedtuple('SeqElement', 'name id overrideSet measure flush wbinvd region')
+
+blockNameIDs = dict()
+
+def compileSeqElement(blockStr):
+   el = compileSeqElement.cache.get(blockStr)
+   if el is None:
+      name = intern(getBlockName(blockStr))
+      el = SeqElement(name, blockNameIDs.setdefault(name, len(blockNameIDs)), getBlockSet(blockStr), '?' in blockStr, '!' in blockStr,
+                      name == '<wbinvd>', name == '<region>')
+      compileSeqElement.cache[blockStr] = el
+   return el
+compileSeqElement.cache = dict()
+
+
+# Returns a tuple of SeqElements for the access sequence seq; compiled sequences are returned unchanged, so they can be passed to all functions that
+# take a sequence. The results are cached.
+def compileSeq(seq):
+   if isinstance(seq, tuple):
+      return seq
+   compiled = compileSeq.cache.get(seq)
+   if compiled is None:
+      compiled = tuple(compileSeqElement(blockStr) for blockStr in seq.split())
+      if len(compileSeq.cache) >= 10000:
+         compileSeq.cache.clear()
+      compileSeq.cache[seq] = compiled
+   return compiled
+compileSeq.cache = dict()
+
 def parseCacheSetsStr(level, clearHL, cacheSetsStr, doNotUseOtherCBoxes=False):
    cacheSetList = []
    if cacheSetsStr is not None:
@@ -434,14 +628,17 @@ def findCacheSetForCode(cacheSetList, level):
 
 
 def getAllUsedCacheSets(cacheSetList, seq, initSeq=''):
-   cacheSetOverrideList = [s for s in set(map(getBlockSet, initSeq.split()+seq.split())) if s is not None]
+   cacheSetOverrideList = [s for s in set(el.overrideSet for el in compileSeq(initSeq)+compileSeq(seq)) if s is not None]
    if any(s in cacheSetList for s in cacheSetOverrideList):
       raise ValueError('overridden cache sets must not also be in cacheSetList')
    return sorted(set(cacheSetList + cacheSetOverrideList))
 
-AddressList = namedtuple('AddressList', 'addresses exclude flush wbinvd')
+# if region is True, the AddressList ends a region (see PFC_REGION_ASM), and addresses is ignored
+AddressList = namedtuple('AddressList', 'addresses exclude flush wbinvd region')
+AddressList.__new__.__defaults__ = (False,)
 
-def getCodeForCacheExperiment(level, seq, initSeq, cacheSetList, cBox, cSlice, clearHL, doNotUseOtherCBoxes, wbinvd, nClearAddresses=None):
+def getCodeForCacheExperiment(level, seq, initSeq, cacheSetList, cBox, cSlice, clearHL, doNotUseOtherCBoxes, wbinvd, nClearAddresses=None,
+                              useR14Image=False):
    allUsedSets = getAllUsedCacheSets(cacheSetList, seq, initSeq)
 
    clearHLAddrList = None
@@ -452,37 +649,41 @@ def getCodeForCacheExperiment(level, seq, initSeq, cacheSetList, cBox, cSlice, c
    seqAddressLists = []
    nameToID = dict()
 
-   for seqString, addrLists in [(initSeq, initAddressLists), (seq, seqAddressLists)]:
-      for seqEl in seqString.split():
-         name = getBlockName(seqEl)
-         if name == '<wbinvd>':
+   for compiledSeq, addrLists in [(compileSeq(initSeq), initAddressLists), (compileSeq(seq), seqAddressLists)]:
+      for el in compiledSeq:
+         if el.wbinvd:
             addrLists.append(AddressList([], True, False, True))
             continue
+         if el.region:
+            addrLists.append(AddressList([], False, False, False, True))
+            continue
 
-         overrideSet = getBlockSet(seqEl)
-
-         wayID = nameToID.setdefault(name, len(nameToID))
-         exclude = not '?' in seqEl
-         flush = '!' in seqEl
+         wayID = nameToID.setdefault(el.id, len(nameToID))
 
-         s = [overrideSet] if overrideSet is not None else cacheSetList
+         s = [el.overrideSet] if el.overrideSet is not None else cacheSetList
          addresses = getAddresses(level, wayID, s, cBox=cBox, cSlice=cSlice)
 
-         if clearHLAddrList is not None and not flush:
+         if clearHLAddrList is not None and not el.flush:
             addrLists.append(clearHLAddrList)
-         addrLists.append(AddressList(addresses, exclude, flush, False))
+         addrLists.append(AddressList(addresses, not el.measure, el.flush, False))
 
    log.debug('\nInitAddresses: ' + str(initAddressLists))
    log.debug('\nSeqAddresses: ' + str(seqAddressLists))
 
-   return getCodeForAddressLists(seqAddressLists, initAddressLists, wbinvd)
+   return getCodeForAddressLists(seqAddressLists, initAddressLists, wbinvd, useR14Image=useR14Image)
 
 
-def runCacheExperimentCode(code, initCode, oneTimeInitCode, loop, warmUpCount, codeOffset, nMeasurements, agg):
+# r14Image is an image for setR14Image() (see getCodeForAddressLists()); it is removed after the run
+def runCacheExperimentCode(code, initCode, oneTimeInitCode, loop, warmUpCount, codeOffset, nMeasurements, agg, r14Image=None):
    resetNanoBench()
    setNanoBenchParameters(config=getDefaultCacheConfig(), msrConfig=getDefaultCacheMSRConfig(), nMeasurements=nMeasurements, unrollCount=1, loopCount=loop,
                           warmUpCount=warmUpCount, aggregateFunction=agg, basicMode=True, noMem=True, codeOffset=codeOffset, verbose=None)
-   return runNanoBench(code=code, init=initCode, oneTimeInit=oneTimeInitCode)
+   if r14Image is None:
+      return runNanoBench(code=code, init=initCode, oneTimeInit=oneTimeInitCode)
+   setR14Image(r14Image)
+   nb = runNanoBench(code=code, init=initCode, oneTimeInit=oneTimeInitCode)
+   setR14Image(None)
+   return nb
 
 
 # cacheSets=None means do access in all sets
@@ -494,7 +695,7 @@ def runCacheExperiment(level, seq, initSeq='', cacheSets=None, cBox=1, cSlice=0,
                        nMeasurements=10, warmUpCount=1, codeSet=None, agg='avg', nClearAddresses=None):
    cacheSetList = parseCacheSetsStr(level, clearHL, cacheSets, doNotUseOtherCBoxes)
    ec = getCodeForCacheExperiment(level, seq, initSeq=initSeq, cacheSetList=cacheSetList, cBox=cBox, cSlice=cSlice, clearHL=clearHL,
-                                  doNotUseOtherCBoxes=doNotUseOtherCBoxes, wbinvd=wbinvd, nClearAddresses=nClearAddresses)
+                                  doNotUseOtherCBoxes=doNotUseOtherCBoxes, wbinvd=wbinvd, nClearAddresses=nClearAddresses, useR14Image=True)
 
    log.debug('\nOneTimeInit: ' + ec.oneTimeInit)
    log.debug('\nInit: ' + ec.init)
@@ -504,7 +705,29 @@ def runCacheExperiment(level, seq, initSeq='', cacheSets=None, cBox=1, cSlice=0,
    allUsedSets = getAllUsedCacheSets(cacheSetList, seq, initSeq)
    codeOffset = lineSize * (codeSet if codeSet is not None else findCacheSetForCode(allUsedSets, level))
 
-   return runCacheExperimentCode(ec.code, ec.init, ec.oneTimeInit, loop, warmUpCount, codeOffset, nMeasurements, agg)
+   return runCacheExperimentCode(ec.code, ec.init, ec.oneTimeInit, loop, warmUpCount, codeOffset, nMeasurements, agg, ec.r14Image)
+
+
+# runs the experiments for all the given sequences at once (using runNanoBenchBatch); returns the list of results
+# the parameters correspond to the parameters of runCacheExperiment
+def runCacheExperiments(level, seqList, initSeq='', cacheSets=None, cBox=1, cSlice=0, clearHL=True, doNotUseOtherCBoxes=False, loop=1, wbinvd=False,
+                        nMeasurements=10, warmUpCount=1, codeSet=None, agg='avg', nClearAddresses=None):
+   cacheSetList = parseCacheSetsStr(level, clearHL, cacheSets, doNotUseOtherCBoxes)
+   lineSize = getCacheInfo(1).lineSize
+
+   experiments = []
+   for seq in seqList:
+      ec = getCodeForCacheExperiment(level, seq, initSeq=initSeq, cacheSetList=cacheSetList, cBox=cBox, cSlice=cSlice, clearHL=clearHL,
+                                     doNotUseOtherCBoxes=doNotUseOtherCBoxes, wbinvd=wbinvd, nClearAddresses=nClearAddresses)
+      allUsedSets = getAllUsedCacheSets(cacheSetList, seq, initSeq)
+      codeOffset = lineSize * (codeSet if codeSet is not None else findCacheSetForCode(allUsedSets, level))
+      experiments.append({'code': ec.code, 'init': ec.init, 'oneTimeInit': ec.oneTimeInit, 'nMeasurements': nMeasurements, 'unrollCount': 1,
+                          'loopCount': loop, 'warmUpCount': warmUpCount, 'aggregateFunction': agg, 'basicMode': True, 'noMem': True,
+                          'codeOffset': codeOffset})
+
+   resetNanoBench()
+   setNanoBenchParameters(config=getDefaultCacheConfig(), msrConfig=getDefaultCacheMSRConfig(), verbose=None)
+   return runNanoBenchBatch(experiments)
 
 
 def printNB(nb_result):
@@ -512,19 +735,58 @@ def printNB(nb_result):
       print r[0] + ': ' + str(r[1])
 
 
+nL3ConflictExperiments = 0
+
 def hasL3Conflicts(addresses, clearHLAddrList, codeOffset):
+   global nL3ConflictExperiments
+   nL3ConflictExperiments += 1
+
    addrList = AddressList(addresses, False, False, False)
    ec = getCodeForAddressLists([clearHLAddrList, addrList], initAddressLists=[addrList], wbinvd=True)
-   setNanoBenchParameters(config=getEventConfig('L3_HIT'), msrConfig='', nMeasurements=5, unrollCount=1, loopCount=100,
-                          aggregateFunction='med', basicMode=True, noMem=True, codeOffset=codeOffset)
-   nb = runNanoBench(code=ec.code, init=ec.init, oneTimeInit=ec.oneTimeInit)
-
-   return (nb['L3_HIT'] < len(addresses) - .9)
+   setNanoBenchParameters(config=getEventConfig('L3_HIT'), msrConfig='', unrollCount=1, loopCount=100, aggregateFunction='avg', basicMode=True,
+                          noMem=True, codeOffset=codeOffset)
+   threshold = len(addresses) - .9
+   # measures until it is clear on which side of the threshold the trimmed mean number of hits is (a single outlier, e.g., due to an interrupt, could
+   # change the decision if the mean were used); the decision is based on the same trimmed mean (and not on the aggregated value in nb.values, which
+   # is computed differently and might be on the other side of the threshold)
+   nb = runNanoBenchAdaptive(code=ec.code, init=ec.init, oneTimeInit=ec.oneTimeInit, counters=['L3_HIT'], threshold=threshold, minMeasurements=5,
+                             maxMeasurements=25, trimmed=True)
+   means, _ = getMeanAndCI(nb.rawResult, trimmed=True)
+   return (means[nb.rawResult.counters.index('L3_HIT')] < threshold)
+
+
+# Removes addresses from an L3 eviction set until it contains only L3Assoc+1 addresses, using group testing: the set is split into L3Assoc+2 groups,
+# and a group that is not needed for the conflicts is removed. As a minimal eviction set consists of L3Assoc+1 addresses, there is always at least one
+# such group; thus, O(L3Assoc^2 * log(n)) experiments are needed.
+def reduceL3EvictionSet(addresses, L3Assoc, clearHLAddrList, codeOffset):
+   while len(addresses) > L3Assoc+1:
+      nGroups = min(L3Assoc+2, len(addresses))
+      for g in range(0, nGroups):
+         start = g * len(addresses) // nGroups
+         end = (g+1) * len(addresses) // nGroups
+         tmpAddresses = addresses[:start] + addresses[end:]
+         if hasL3Conflicts(tmpAddresses, clearHLAddrList, codeOffset):
+            addresses = tmpAddresses
+            break
+      else:
+         log.warning('No group could be removed from the eviction set; the measurements might be unreliable')
+         break
+   return addresses
 
+# Removes addresses one at a time (needs O(n) experiments).
+def reduceL3EvictionSetLinear(addresses, L3Assoc, clearHLAddrList, codeOffset):
+   for i in reversed(range(0, len(addresses))):
+      if len(addresses) <= L3Assoc+1:
+            break
+      tmpAddresses = addresses[:i] + addresses[(i+1):]
+      if hasL3Conflicts(tmpAddresses, clearHLAddrList, codeOffset):
+         addresses = tmpAddresses
+   return addresses
 
-def findMinimalL3EvictionSet(cacheSet, cBox, cSlice):
-   if not hasattr(findMinimalL3EvictionSet, 'evSetForCacheSet'):
-      findMinimalL3EvictionSet.evSetForCacheSet = dict()
+# if linear is True, reduceL3EvictionSetLinear() is used instead of reduceL3EvictionSet()
+# if verify is True, it is checked (with O(L3Assoc) additional experiments) that the eviction set that was found is minimal
+def findMinimalL3EvictionSet(cacheSet, cBox, cSlice, linear=False, verify=False):
+   loadL3Maps()
    if not cBox in findMinimalL3EvictionSet.evSetForCacheSet:
       findMinimalL3EvictionSet.evSetForCacheSet[cBox] = dict()
    if not cSlice in findMinimalL3EvictionSet.evSetForCacheSet[cBox]:
@@ -533,7 +795,8 @@ def findMinimalL3EvictionSet(cacheSet, cBox, cSlice):
    if cacheSet in findMinimalL3EvictionSet.evSetForCacheSet[cBox][cSlice]:
       return findMinimalL3EvictionSet.evSetForCacheSet[cBox][cSlice][cacheSet]
 
-   evSetsForOtherSlices = [findMinimalL3EvictionSet(cacheSet, cBox, s) for s in range(0, cSlice)]
+   evSetsForOtherSlices = [findMinimalL3EvictionSet(cacheSet, cBox, s, linear, verify) for s in range(0, cSlice)]
+   nExperimentsBefore = nL3ConflictExperiments
 
    lineSize = getCacheInfo(1).lineSize
    L3Assoc = getCacheInfo(3).assoc
@@ -543,23 +806,34 @@ def findMinimalL3EvictionSet(cacheSet, cBox, cSlice):
    codeOffset = lineSize * (cacheSet+10)
 
    addresses = []
+   nextCheck = L3Assoc+1 # with the group testing reduction, it is sufficient to check for conflicts when the size of the set has doubled
    for curAddr in count(cacheSet * lineSize, L3WaySize):
       if any(curAddr in otherEvSet for otherEvSet in evSetsForOtherSlices): continue
-      if not getCBoxOfAddress(curAddr) == cBox: continue
+      if not getCBoxOfAddress(curAddr, L3WaySize) == cBox: continue
       if any(hasL3Conflicts(otherEvSet[:-1]+[curAddr], clearHLAddrList, codeOffset) for otherEvSet in evSetsForOtherSlices): continue
 
       addresses.append(curAddr)
-      if len(addresses) > L3Assoc and hasL3Conflicts(addresses, clearHLAddrList, codeOffset):
+      if len(addresses) >= nextCheck and hasL3Conflicts(addresses, clearHLAddrList, codeOffset):
          break
+      if len(addresses) >= nextCheck and not linear:
+         nextCheck *= 2
 
-   for i in reversed(range(0, len(addresses))):
-      if len(addresses) <= L3Assoc+1:
-            break
-      tmpAddresses = addresses[:i] + addresses[(i+1):]
-      if hasL3Conflicts(tmpAddresses, clearHLAddrList, codeOffset):
-         addresses = tmpAddresses
+   if linear:
+      addresses = reduceL3EvictionSetLinear(addresses, L3Assoc, clearHLAddrList, codeOffset)
+   else:
+      addresses = reduceL3EvictionSet(addresses, L3Assoc, clearHLAddrList, codeOffset)
+
+   if verify:
+      if not hasL3Conflicts(addresses, clearHLAddrList, codeOffset):
+         log.warning('Eviction set for set ' + str(cacheSet) + ' does not evict')
+      elif any(hasL3Conflicts(addresses[:i] + addresses[(i+1):], clearHLAddrList, codeOffset) for i in range(0, len(addresses))):
+         log.warning('Eviction set for set ' + str(cacheSet) + ' is not minimal')
+
+   log.debug('Eviction set for set ' + str(cacheSet) + ' (CBox ' + str(cBox) + ', slice ' + str(cSlice) + '): ' + str(len(addresses)) + ' addresses, '
+             + str(nL3ConflictExperiments - nExperimentsBefore) + ' experiments')
 
    findMinimalL3EvictionSet.evSetForCacheSet[cBox][cSlice][cacheSet] = addresses
+   storeL3MapEntry({'t': 'evSet', 'cBox': cBox, 'cSlice': cSlice, 'set': cacheSet, 'addresses': addresses})
    return addresses
 
 
@@ -570,7 +844,7 @@ def findCongruentL3Addresses(n, cacheSet, cBox, L3EvictionSet):
 
    congrAddresses = []
    for newAddr in count(max(L3EvictionSet)+L3WaySize, L3WaySize):
-      if not getCBoxOfAddress(newAddr) == cBox: continue
+      if not getCBoxOfAddress(newAddr, L3WaySize) == cBox: continue
 
       tmpAddresses = L3EvictionSet[:getCacheInfo(3).assoc] + [newAddr]
 
@@ -588,14 +862,14 @@ def findMaximalNonEvictingL3SetInCBox(start, stride, L3Assoc, cBox):
 
    curAddress = start
    while len(clearHLAddresses) < 2*(getCacheInfo(1).assoc+getCacheInfo(2).assoc):
-      if getCBoxOfAddress(curAddress) != cBox:
+      if getCBoxOfAddress(curAddress, stride) != cBox:
          clearHLAddresses.append(curAddress)
       curAddress += stride
    clearHLAddrList = AddressList(clearHLAddresses, True, False, False)
 
    curAddress = start
    while len(addresses) < L3Assoc:
-      if getCBoxOfAddress(curAddress) == cBox:
+      if getCBoxOfAddress(curAddress, stride) == cBox:
          addresses.append(curAddress)
       curAddress += stride
 
@@ -603,7 +877,7 @@ def findMaximalNonEvictingL3SetInCBox(start, stride, L3Assoc, cBox):
    while notAdded < L3Assoc:
       curAddress += stride
 
-      if not getCBoxOfAddress(curAddress) == cBox:
+      if not getCBoxOfAddress(curAddress, stride) == cBox:
          continue
 
       newAddresses = addresses + [curAddress]
@@ -627,9 +901,17 @@ def getUnusedBlockNames(n, usedBlockNames, prefix=''):
    return newBlockNames
 
 
-# Returns a dict with the age of each block, i.e., how many fresh blocks need to be accessed until the block is evicted
-# if returnNbResults is True, the function returns additionally all measurment results (as the second component of a tuple)
-def getAgesOfBlocks(blocks, level, seq, initSeq='', maxAge=None, cacheSets=None, cBox=1, cSlice=0, clearHL=True, wbinvd=False, returnNbResults=False, nMeasurements=10, agg='avg'):
+# Number of values of nNewBlocks after the age found by the binary search in getAgesOfBlocks() for which it is checked that the block is still evicted.
+AGE_CONFIRMATION_WINDOW = 2
+
+# Returns a dict with the age of each block, i.e., the smallest number of fresh blocks after which the block is no longer in the cache (or -1 if this
+# number is larger than maxAge).
+# If binarySearch is True, the age is determined using an exponential search followed by a binary search, which requires O(log(maxAge)) experiments
+# instead of maxAge+1 experiments per block. This assumes that a block that was evicted after n fresh blocks is also evicted after more than n fresh
+# blocks; for the AGE_CONFIRMATION_WINDOW values after the age that was found, this is checked, and if the check fails, the linear scan is used for the
+# block. If returnNbResults is True, the results for all values of nNewBlocks are needed, so the linear scan is always used.
+def getAgesOfBlocks(blocks, level, seq, initSeq='', maxAge=None, cacheSets=None, cBox=1, cSlice=0, clearHL=True, wbinvd=False, returnNbResults=False,
+                    nMeasurements=10, agg='avg', binarySearch=False):
    ages = dict()
    if returnNbResults: nbResults = dict()
 
@@ -637,36 +919,85 @@ def getAgesOfBlocks(blocks, level, seq, initSeq='', maxAge=None, cacheSets=None,
       maxAge = 2*getCacheInfo(level).assoc
 
    nSets = len(parseCacheSetsStr(level, clearHL, cacheSets))
+   hitEvent = 'L' + str(level) + '_HIT'
+   missEvent = 'L' + str(level) + '_MISS'
+
+   def getSeq(block, nNewBlocks):
+      curSeq = seq.replace('?', '') + ' '
+      newBlocks = getUnusedBlockNames(nNewBlocks, seq+initSeq, 'N')
+      return curSeq + ' '.join(newBlocks) + ' ' + block + '?'
+
+   def isEvicted(nb):
+      if hitEvent in nb:
+         return isClose(nb[hitEvent], 0.0, abs_tol=0.1)
+      elif missEvent in nb:
+         return nb[missEvent] > nSets - 0.1
+      else:
+         raise ValueError('no cache results available')
+
+   # probes is a list of (block, nNewBlocks) pairs; returns the list of results
+   def runProbes(probes):
+      if not probes: return []
+      maxRegions = getMaxRegions()
+      if wbinvd and maxRegions > 0:
+         # up to maxRegions experiments are combined into one experiment, in which they are separated by wbinvd; the result of each experiment is
+         # measured in a separate region
+         initSeqExcluded = initSeq.replace('?', '')
+         seqList = []
+         for start in range(0, len(probes), maxRegions):
+            seqList.append(' '.join('<wbinvd> ' + initSeqExcluded + ' ' + getSeq(block, n) + ' <region>' for block, n in probes[start:start+maxRegions]))
+         nbList = []
+         for nb in runCacheExperiments(level, seqList, cacheSets=cacheSets, cBox=cBox, cSlice=cSlice, clearHL=clearHL, loop=0,
+                                       nMeasurements=nMeasurements, agg=agg):
+            nbList.extend(getRegionResults(nb))
+         return nbList
+      return runCacheExperiments(level, [getSeq(block, n) for block, n in probes], initSeq=initSeq, cacheSets=cacheSets, cBox=cBox, cSlice=cSlice,
+                                 clearHL=clearHL, loop=0, wbinvd=wbinvd, nMeasurements=nMeasurements, agg=agg)
+
+   linearBlocks = blocks
+   if binarySearch and not returnNbResults:
+      notEvicted = {block: -1 for block in blocks} # largest value of nNewBlocks for which the block is known to be in the cache
+      evicted = {block: None for block in blocks} # smallest value of nNewBlocks for which the block is known to be evicted
+      while True:
+         probes = []
+         for block in blocks:
+            lo, hi = notEvicted[block], evicted[block]
+            if hi is None:
+               if lo < maxAge:
+                  probes.append((block, min(maxAge, 2*lo+2))) # exponential search
+            elif hi - lo > 1:
+               probes.append((block, (lo+hi)//2)) # binary search
+         if not probes: break
+         for (block, n), nb in zip(probes, runProbes(probes)):
+            if isEvicted(nb):
+               evicted[block] = n
+            else:
+               notEvicted[block] = n
+
+      confirmationProbes = [(block, n) for block in blocks if evicted[block] is not None
+                            for n in range(evicted[block]+1, min(maxAge, evicted[block]+AGE_CONFIRMATION_WINDOW)+1)]
+      unconfirmedBlocks = set(block for (block, _), nb in zip(confirmationProbes, runProbes(confirmationProbes)) if not isEvicted(nb))
+      for block in blocks:
+         if not block in unconfirmedBlocks:
+            ages[block] = (evicted[block] if evicted[block] is not None else -1)
+      linearBlocks = [block for block in blocks if block in unconfirmedBlocks]
+      if linearBlocks:
+         log.debug('binary search not confirmed for blocks: ' + str(linearBlocks))
 
-   for block in blocks:
+   nbList = runProbes([(block, n) for block in linearBlocks for n in range(0, maxAge+1)])
+
+   for i, block in enumerate(linearBlocks):
       if returnNbResults: nbResults[block] = []
 
       for nNewBlocks in range(0, maxAge+1):
-         curSeq = seq.replace('?', '') + ' '
-         newBlocks = getUnusedBlockNames(nNewBlocks, seq+initSeq, 'N')
-         curSeq += ' '.join(newBlocks) + ' ' + block + '?'
-
-         nb = runCacheExperiment(level, curSeq, initSeq=initSeq, cacheSets=cacheSets, cBox=cBox, cSlice=cSlice, clearHL=clearHL, loop=0, wbinvd=wbinvd,
-                                 nMeasurements=nMeasurements, agg=agg)
+         nb = nbList[i*(maxAge+1) + nNewBlocks]
          if returnNbResults: nbResults[block].append(nb)
 
-         hitEvent = 'L' + str(level) + '_HIT'
-         missEvent = 'L' + str(level) + '_MISS'
-
-         if hitEvent in nb:
-            if isClose(nb[hitEvent], 0.0, abs_tol=0.1):
-               if not block in ages:
-                  ages[block] = nNewBlocks
-               #if not returnNbResults:
-               #break
-         elif missEvent in nb:
-            if nb[missEvent] > nSets - 0.1:
-               if not block in ages:
-                  ages[block] = nNewBlocks
-               #if not returnNbResults:
-               #break
-         else:
-            raise ValueError('no cache results available')
+         if isEvicted(nb):
+            if not block in ages:
+               ages[block] = nNewBlocks
+            #if not returnNbResults:
+            #break
       if not block in ages:
          ages[block] = -1
 
@@ -1,8 +1,11 @@
 #!/usr/bin/python
+import hashlib
+import json
+import os
 import random
+import time
 
-from itertools import count
-from numpy import median
+from itertools import count, groupby
 
 from cacheLib import *
 
@@ -26,6 +29,13 @@ class ReplPolicySim(object):
       if block in self.blocks:
          self.blocks[self.blocks.index(block)] = None
 
+   # returns the current state of the simulator, which can be restored later with restore()
+   def snapshot(self):
+      return list(self.blocks)
+
+   def restore(self, state):
+      self.blocks = list(state)
+
 
 class FIFOSim(ReplPolicySim):
    def __init__(self, assoc):
@@ -89,6 +99,13 @@ class PLRUSim(ReplPolicySim):
          self.bits[level][curIdx] = 1 - (lastIdx % 2)
          lastIdx = curIdx
 
+   def snapshot(self):
+      return (list(self.blocks), [list(levelBits) for levelBits in self.bits])
+
+   def restore(self, state):
+      self.blocks = list(state[0])
+      self.bits = [list(levelBits) for levelBits in state[1]]
+
 
 class PLRUlSim(PLRUSim):
    def __init__(self, assoc):
@@ -136,6 +153,14 @@ class LRU_PLRU4Sim(ReplPolicySim):
          if block in plru.blocks:
             plru.flush(block)
 
+   def snapshot(self):
+      return ([plru.snapshot() for plru in self.PLRUs], [self.PLRUs.index(plru) for plru in self.PLRUOrdered])
+
+   def restore(self, state):
+      for plru, plruState in zip(self.PLRUs, state[0]):
+         plru.restore(plruState)
+      self.PLRUOrdered = [self.PLRUs[i] for i in state[1]]
+
 
 class QLRUSim(ReplPolicySim):
    def __init__(self, assoc, hitFunc, missFunc, replIdxFunc, updFunc, updOnMissOnly=False):
@@ -166,6 +191,13 @@ class QLRUSim(ReplPolicySim):
 
       return hit
 
+   def snapshot(self):
+      return (list(self.blocks), list(self.bits))
+
+   def restore(self, state):
+      self.blocks = list(state[0])
+      self.bits = list(state[1])
+
 QLRUHitFuncs = {
    'H21': lambda x: {3:2, 2:1, 1:0, 0:0}[x],
    'H20': lambda x: {3:2, 2:0, 1:0, 0:0}[x],
@@ -203,11 +235,12 @@ QLRUUpdFuncs = {
    'U3': lambda bits, replIdx: [((b+1) if i != replIdx else b) for i, b in enumerate(bits)] if not 3 in bits else bits,
 }
 
-# all deterministic QLRU variants
+# all deterministic QLRU variants; qlruParams is used by getQLRUHits()
 AllDetQLRUVariants = {
    'QLRU_' + hf[0] + '_' + mf[0] + '_' + rf[0] + '_' + uf[0] + ('_UMO' if umo else ''):
       type('QLRU_' + hf[0] + '_' + mf[0] + '_' + rf[0] + '_' + uf[0] + ('_UMO' if umo else ''), (QLRUSim,),
-        {'__init__': lambda self, assoc, hfl=hf[1], mfl=mf[1], rfl=rf[1], ufl=uf[1], umol=umo: QLRUSim.__init__(self, assoc, hfl, mfl, rfl, ufl, umol)})
+        {'__init__': lambda self, assoc, hfl=hf[1], mfl=mf[1], rfl=rf[1], ufl=uf[1], umol=umo: QLRUSim.__init__(self, assoc, hfl, mfl, rfl, ufl, umol),
+         'qlruParams': (hf[0], mf[0], rf[0], uf[0], umo)})
           for hf in QLRUHitFuncs.items()
             for mf in QLRUMissFuncs.items()
               for rf in QLRUReplIdxFuncs.items()
@@ -256,6 +289,13 @@ class MRUSim(ReplPolicySim):
 
       return hit
 
+   def snapshot(self):
+      return (list(self.blocks), list(self.bits))
+
+   def restore(self, state):
+      self.blocks = list(state[0])
+      self.bits = list(state[1])
+
 
 class MRUNSim(MRUSim):
    def __init__(self, assoc):
@@ -281,6 +321,13 @@ class NRUSim(ReplPolicySim):
          self.bits[index] = 0
       return hit
 
+   def snapshot(self):
+      return (list(self.blocks), list(self.bits))
+
+   def restore(self, state):
+      self.blocks = list(state[0])
+      self.bits = list(state[1])
+
 
 CommonPolicies = {
    'FIFO': FIFOSim,
@@ -304,6 +351,164 @@ AllRandPolicies = dict(AllRandQLRUVariants.items() + AllRandPLRUVariants.items()
 AllPolicies = dict(AllDetPolicies.items() + AllRandPolicies.items())
 
 
+
+# Transition table of a deterministic policy. The states are snapshots of the simulator (see ReplPolicySim.snapshot()) in which the blocks are
+# replaced by labels ('0', ..., str(assoc-1)) that identify the physical ways; a new block gets the label of the evicted block, or the smallest free
+# label. transitions[state][action] is a pair [newState, way], where the actions 0, ..., assoc-1 are hits in the corresponding way, the action assoc
+# is a miss (way is the way that receives the new block), and the actions assoc+1+w flush way w; state 0 is the initial state.
+# The table is only used if all reachable states can be enumerated with at most POLICY_TABLE_MAX_STATES states, and if the simulator does not fail in
+# any of them; otherwise (e.g., for LRU with a large associativity), transitions is None, and the policy is simulated directly. The tables (or the information that the state space is too large) are
+# stored on disk.
+POLICY_TABLE_VERSION = 2
+POLICY_TABLE_MAX_STATES = 2000
+
+NEW_BLOCK_LABEL = 'new'
+
+def getLabels(state):
+   if isinstance(state, basestring):
+      return set([state])
+   if isinstance(state, (list, tuple)):
+      return set().union(*map(getLabels, state))
+   return set()
+
+def freezeState(state, newLabel=None):
+   if isinstance(state, (list, tuple)):
+      return tuple(freezeState(x, newLabel) for x in state)
+   if isinstance(state, basestring):
+      return (newLabel if state == NEW_BLOCK_LABEL else str(state))
+   return state
+
+
+class PolicyTable(object):
+   def __init__(self, policySimClass, assoc):
+      self.policySimClass = policySimClass
+      self.assoc = assoc
+      fileName = os.path.join(getCacheDir('policies'), policySimClass.__name__ + '_' + str(assoc) + '.json')
+
+      if os.path.exists(fileName):
+         with open(fileName) as f:
+            stored = json.load(f)
+         if stored['version'] == POLICY_TABLE_VERSION and stored['maxStates'] == POLICY_TABLE_MAX_STATES:
+            self.transitions = stored['transitions']
+            return
+
+      try:
+         self.transitions = self.explore(POLICY_TABLE_MAX_STATES)
+      except ValueError: # a state in which the simulator fails (e.g., a QLRU variant without a block with bits 3) is reachable
+         self.transitions = None
+      if self.transitions is None:
+         log.info('no transition table for ' + policySimClass.__name__ + ' with associativity ' + str(assoc))
+
+      tmpFile = fileName + '.' + str(os.getpid())
+      with open(tmpFile, 'w') as f:
+         json.dump({'version': POLICY_TABLE_VERSION, 'maxStates': POLICY_TABLE_MAX_STATES, 'transitions': self.transitions}, f, separators=(',', ':'))
+      os.rename(tmpFile, fileName)
+
+   # Computes the transitions for all states that are reachable from the initial state in breadth-first order. Returns None if there are more than
+   # maxStates such states.
+   def explore(self, maxStates):
+      states = [freezeState(self.policySimClass(self.assoc).snapshot())]
+      stateIDs = {states[0]: 0}
+      transitions = []
+
+      def getStateID(state):
+         stateID = stateIDs.get(state)
+         if stateID is None:
+            stateID = len(states)
+            states.append(state)
+            stateIDs[state] = stateID
+         return stateID
+
+      while len(transitions) < len(states):
+         if len(states) > maxStates:
+            return None
+         state = states[len(transitions)]
+         labels = getLabels(state)
+         stateTransitions = [None] * (2*self.assoc + 1)
+         for label in labels:
+            way = int(label)
+            sim = self.policySimClass(self.assoc)
+            sim.restore(state)
+            if not sim.acc(label):
+               raise ValueError('no block in way ' + label)
+            stateTransitions[way] = [getStateID(freezeState(sim.snapshot())), way]
+
+            sim.restore(state)
+            sim.flush(label)
+            stateTransitions[self.assoc + 1 + way] = [getStateID(freezeState(sim.snapshot())), way]
+
+         sim = self.policySimClass(self.assoc)
+         sim.restore(state)
+         if sim.acc(NEW_BLOCK_LABEL):
+            raise ValueError('unexpected hit')
+         newState = sim.snapshot()
+         evicted = labels - getLabels(newState)
+         if evicted:
+            newLabel = evicted.pop()
+         else:
+            newLabel = str(min(w for w in range(0, self.assoc) if not str(w) in labels))
+         stateTransitions[self.assoc] = [getStateID(freezeState(newState, newLabel)), int(newLabel)]
+
+         transitions.append(stateTransitions)
+      return transitions
+
+
+def getPolicyTable(policySimClass, assoc):
+   key = (policySimClass, assoc)
+   if not key in getPolicyTable.tables:
+      getPolicyTable.tables[key] = PolicyTable(policySimClass, assoc)
+   return getPolicyTable.tables[key]
+getPolicyTable.tables = dict()
+
+
+# Simulates a deterministic policy using its transition table (see PolicyTable); blocks[w] is the block in the physical way w
+class CompiledPolicySim(ReplPolicySim):
+   def __init__(self, assoc, transitions):
+      super(CompiledPolicySim, self).__init__(assoc)
+      self.transitions = transitions
+      self.state = 0
+      self.wayOfBlock = dict()
+
+   def acc(self, block):
+      way = self.wayOfBlock.get(block)
+      if way is not None:
+         self.state = self.transitions[self.state][way][0]
+         return True
+      self.state, way = self.transitions[self.state][self.assoc]
+      evicted = self.blocks[way]
+      if evicted is not None:
+         del self.wayOfBlock[evicted]
+      self.blocks[way] = block
+      self.wayOfBlock[block] = way
+      return False
+
+   def flush(self, block):
+      way = self.wayOfBlock.pop(block, None)
+      if way is not None:
+         self.state = self.transitions[self.state][self.assoc + 1 + way][0]
+         self.blocks[way] = None
+
+   def snapshot(self):
+      return (self.state, list(self.blocks))
+
+   def restore(self, state):
+      self.state = state[0]
+      self.blocks = list(state[1])
+      self.wayOfBlock = {b: w for w, b in enumerate(self.blocks) if b is not None}
+
+
+# Returns a function that creates a simulator for the given associativity; for deterministic policies with a transition table (see PolicyTable), the
+# simulator uses this table
+def getSimFactory(policySimClass):
+   if not policySimClass in AllDetPolicies.values():
+      return policySimClass
+   def simFactory(assoc):
+      transitions = getPolicyTable(policySimClass, assoc).transitions
+      if transitions is None:
+         return policySimClass(assoc)
+      return CompiledPolicySim(assoc, transitions)
+   return simFactory
+
 def parseCacheSetsStrSim(cacheSetsStr):
    if cacheSetsStr is None:
       raise ValueError('no cache sets specified')
@@ -319,55 +524,465 @@ def parseCacheSetsStrSim(cacheSetsStr):
    return cacheSetList
 
 
+# seq can be a string or a compiled sequence (see compileSeq())
 def getHits(seq, policySimClass, assoc, cacheSetStr):
+   seq = compileSeq(seq)
    cacheSetList = parseCacheSetsStrSim(cacheSetStr)
-   allUsedSets = getAllUsedCacheSets(cacheSetList, seq)
-   policySims = {s: policySimClass(assoc) for s in allUsedSets}
+   simFactory = getSimFactory(policySimClass)
+   policySims = {s: simFactory(assoc) for s in getAllUsedCacheSets(cacheSetList, seq)}
+   return simulateSeq(seq, policySims, simFactory, assoc, cacheSetList)
+
 
+# Simulates the compiled sequence seq, starting from the state of the simulators in policySims (a dict from cache sets to simulators), which are
+# updated; returns the number of hits of the accesses that are marked with '?'. simFactory is used for creating new simulators after wbinvd.
+def simulateSeq(seq, policySims, simFactory, assoc, cacheSetList):
    hits = 0
-   for blockStr in seq.split():
-      blockName = getBlockName(blockStr)
-      if blockName == '<wbinvd>':
-         policySims = {s: policySimClass(assoc) for s in allUsedSets}
+   for el in seq:
+      if el.wbinvd:
+         for s in policySims:
+            policySims[s] = simFactory(assoc)
          continue
 
-      overrideSet = getBlockSet(blockStr)
-      sets = [overrideSet] if overrideSet is not None else cacheSetList
+      sets = [el.overrideSet] if el.overrideSet is not None else cacheSetList
 
       for s in sets:
-         if '!' in blockStr:
-            policySims[s].flush(blockName)
+         if el.flush:
+            policySims[s].flush(el.name)
          else:
-            hit = policySims[s].acc(blockName)
-            if '?' in blockStr:
+            hit = policySims[s].acc(el.name)
+            if el.measure:
                hits += int(hit)
    return hits
 
 
+# Returns a list of (sets, accesses) pairs, where accesses is a list of SeqElements (see compileSeq()), such that each pair contains the sets whose
+# accesses are identical. As the simulation of a deterministic policy yields the same result for all sets of such a group, it is sufficient to
+# simulate one set per group.
+def getSetsWithIdenticalAccesses(seq, cacheSetStr):
+   seq = compileSeq(seq)
+   cacheSetList = parseCacheSetsStrSim(cacheSetStr)
+   allUsedSets = getAllUsedCacheSets(cacheSetList, seq)
+   accessesForSet = {s: [] for s in allUsedSets}
+
+   for el in seq:
+      if el.wbinvd:
+         for s in allUsedSets:
+            accessesForSet[s].append(el)
+         continue
+
+      for s in ([el.overrideSet] if el.overrideSet is not None else cacheSetList):
+         accessesForSet[s].append(el)
+
+   setsForAccesses = OrderedDict()
+   for s in allUsedSets:
+      setsForAccesses.setdefault(tuple(accessesForSet[s]), []).append(s)
+   return [(sets, list(accesses)) for accesses, sets in setsForAccesses.items()]
+
+
+# Simulates the deterministic QLRU variants in policySimClasses (which must have a qlruParams attribute) for all sequences in seqList in lock-step.
+# The state of all (variant, sequence, set) triples is stored in 2-dimensional NumPy arrays with one column per triple (sets with identical accesses
+# are simulated only once). Returns a list that contains for each variant a list with the number of hits for each sequence; the result is
+# the same as for getHits().
+def getQLRUHits(seqList, policySimClasses, assoc, cacheSetStr):
+   import numpy as np # imported here to avoid the import time if it is not needed
+
+   # a trace is the list of accesses to one group of sets with identical accesses
+   ACC, ACC_COUNT, FLUSH, WBINVD = range(1, 5)
+   traceBlocks = []
+   traceKinds = []
+   traceSeq = []
+   traceWeight = []
+   for seqI, seq in enumerate(seqList):
+      for sets, accesses in getSetsWithIdenticalAccesses(seq, cacheSetStr):
+         blockIDs = dict()
+         traceBlocks.append([(blockIDs.setdefault(el.id, len(blockIDs)) if not el.wbinvd else -1) for el in accesses])
+         traceKinds.append([(WBINVD if el.wbinvd else FLUSH if el.flush else ACC_COUNT if el.measure else ACC) for el in accesses])
+         traceSeq.append(seqI)
+         traceWeight.append(len(sets))
+
+   nPolicies = len(policySimClasses)
+   nTraces = len(traceBlocks)
+   nCols = nPolicies * nTraces
+   nSteps = max([0] + [len(t) for t in traceBlocks])
+   nBlocks = max([0] + [max(t) + 1 for t in traceBlocks if t])
+
+   # one row per step, one column per trace
+   blockType = (np.int16 if nBlocks < 2**15 else np.int32)
+   stepBlocks = np.full((nSteps, nTraces), -1, dtype=blockType)
+   stepKinds = np.zeros((nSteps, nTraces), dtype=np.int8)
+   for t, (blocks, kinds) in enumerate(zip(traceBlocks, traceKinds)):
+      stepBlocks[:len(blocks), t] = blocks
+      stepKinds[:len(kinds), t] = kinds
+   stepAllAcc = ((stepKinds == ACC) | (stepKinds == ACC_COUNT)).all(axis=1)
+   stepHasFlush = (stepKinds == FLUSH).any(axis=1)
+   stepHasWbinvd = (stepKinds == WBINVD).any(axis=1)
+   anyFlush = stepHasFlush.any()
+   # one column per column of the state arrays
+   stepBlocks = np.tile(stepBlocks, (1, nPolicies))
+   stepKinds = np.tile(stepKinds, (1, nPolicies))
+
+   # the variants are ordered such that the columns of the variants with the same update function and the same updOnMissOnly value form a contiguous
+   # range; the updates can then be performed on slices of the state arrays
+   order = sorted(range(0, nPolicies), key=lambda p: (policySimClasses[p].qlruParams[4], policySimClasses[p].qlruParams[3]))
+   params = [policySimClasses[p].qlruParams for p in order]
+   updGroups = []
+   for (umo, upd), group in groupby(enumerate(params), key=lambda x: (x[1][4], x[1][3])):
+      group = list(group)
+      updGroups.append((slice(group[0][0] * nTraces, (group[-1][0] + 1) * nTraces), int(upd[1:]), umo))
+
+   policyOfCol = np.repeat(np.arange(nPolicies), nTraces)
+   hitTable = np.array([[QLRUHitFuncs[p[0]](b) for b in range(0, 4)] for p in params], dtype=np.int8)[policyOfCol].ravel()
+   missBits = np.array([QLRUMissFuncs[p[1]]() for p in params], dtype=np.int8)[policyOfCol]
+   replFromRight = np.array([p[2] == 'R2' for p in params], dtype=bool)[policyOfCol]
+   replNeeds3 = np.array([p[2] != 'R1' for p in params], dtype=bool)[policyOfCol]
+   colIdx = np.arange(nCols)
+
+   # index of the first (or, if fromRight is True, of the last) True value in each column (0 if there is no such value); this is faster than argmax
+   leftWeights = np.arange(assoc, 0, -1, dtype=np.int16)[:, None]
+   rightWeights = np.arange(1, assoc+1, dtype=np.int16)[:, None]
+   def firstTrue(a, fromRight=None):
+      first = (assoc - (a * leftWeights).max(axis=0)) % assoc
+      if fromRight is None:
+         return first
+      return np.where(fromRight, (a * rightWeights).max(axis=0) - 1, first)
+
+   # updates the bits in the columns of the slice sl for which mask is True (all columns if mask is None); flatIndex contains the flat index (see below)
+   # of the way of the current access in each column (None for updates on misses, before the replacement)
+   def update(sl, updType, flatIndex, mask):
+      sliceBits = bits[:, sl]
+      if flatIndex is not None and updType in [1, 3]:
+         sliceIndex = flatIndex[sl]
+         indexBits = flatBits.take(sliceIndex)
+      if updType == 1 and flatIndex is not None:
+         flatBits[sliceIndex] = -1
+         inc = 3 - sliceBits.max(axis=0)
+      elif updType in [0, 1]:
+         inc = 3 - sliceBits.max(axis=0)
+      else:
+         inc = (sliceBits.max(axis=0) < 3).astype(np.int8)
+      if mask is not None:
+         inc *= mask[sl]
+      sliceBits += inc
+      if flatIndex is not None and updType in [1, 3]:
+         flatBits[sliceIndex] = indexBits
+
+   # the state arrays have one row per way and one column per (variant, trace) pair, which makes the reductions over the ways faster; blockPos contains
+   # the way of each block (-1 if the block is not in the cache), its last row is used for the block -1 (i.e., for steps without a block)
+   posType = (np.int8 if assoc < 2**7 else np.int16)
+   blocks = np.full((assoc, nCols), -1, dtype=blockType)
+   bits = np.full((assoc, nCols), 3, dtype=np.int8)
+   blockPos = np.full((nBlocks + 1, nCols), -1, dtype=posType)
+   nOccupied = np.zeros(nCols, dtype=posType) # without flushes, the occupied ways form a contiguous range at the left (or, for R2, at the right)
+   hits = np.zeros(nCols, dtype=int)
+   # views of the state arrays for indexing with flat indexes (way * nCols + col), which is faster than indexing with (way, col) pairs
+   flatBits = bits.ravel()
+   flatBlocks = blocks.ravel()
+   flatBlockPos = blockPos.ravel()
+
+   for step in range(0, nSteps):
+      block = stepBlocks[step]
+      kind = stepKinds[step]
+
+      if stepHasWbinvd[step]:
+         isWbinvd = (kind == WBINVD)
+         blocks[:, isWbinvd] = -1
+         bits[:, isWbinvd] = 3
+         blockPos[:, isWbinvd] = -1
+         nOccupied[isWbinvd] = 0
+
+      index = flatBlockPos.take(block.astype(np.intp) * nCols + colIdx)
+
+      if stepHasFlush[step]:
+         flushCols = np.flatnonzero((kind == FLUSH) & (index >= 0))
+         blocks[index[flushCols], flushCols] = -1
+         blockPos[block[flushCols], flushCols] = -1
+
+      if stepAllAcc[step]:
+         isAcc = None
+         hit = (index >= 0)
+         miss = ~hit
+      else:
+         isAcc = (kind == ACC) | (kind == ACC_COUNT)
+         hit = (index >= 0) & isAcc
+         miss = isAcc & ~hit
+
+      hitCols = np.flatnonzero(hit)
+      hitFlatIdx = index[hitCols].astype(np.intp) * nCols + hitCols
+      flatBits[hitFlatIdx] = hitTable.take(hitCols * 4 + flatBits.take(hitFlatIdx))
+
+      missCols = np.flatnonzero(miss)
+      if len(missCols):
+         for sl, updType, umo in updGroups:
+            if umo:
+               update(sl, updType, None, miss)
+
+         is3 = (bits.take(missCols, axis=1) == 3)
+         has3 = is3.any(axis=0)
+         if anyFlush:
+            empty = (blocks.take(missCols, axis=1) == -1)
+            hasEmpty = empty.any(axis=0)
+            emptyIdx = firstTrue(empty, replFromRight[missCols])
+         else:
+            occupied = nOccupied[missCols]
+            hasEmpty = (occupied < assoc)
+            emptyIdx = np.where(replFromRight[missCols], assoc - 1 - occupied, occupied)
+         if (~hasEmpty & ~has3 & replNeeds3[missCols]).any():
+            raise ValueError('no block with bits 3')
+         replIdx = np.where(hasEmpty, emptyIdx, np.where(has3, firstTrue(is3), 0))
+
+         missBlocks = block[missCols].astype(np.intp)
+         replFlatIdx = replIdx.astype(np.intp) * nCols + missCols
+         flatBlockPos[flatBlocks.take(replFlatIdx).astype(np.intp) * nCols + missCols] = -1 # evicted blocks (or the last row for empty ways)
+         flatBlocks[replFlatIdx] = missBlocks
+         flatBlockPos[missBlocks * nCols + missCols] = replIdx
+         flatBits[replFlatIdx] = missBits[missCols]
+         nOccupied[missCols] += hasEmpty
+         index[missCols] = replIdx
+
+      flatIndex = index.astype(np.intp) * nCols + colIdx
+      for sl, updType, umo in updGroups:
+         if not umo:
+            update(sl, updType, flatIndex, isAcc)
+
+      hits += (hit & (kind == ACC_COUNT))
+
+   hits = hits.reshape(nPolicies, nTraces) * np.array(traceWeight)
+   result = np.zeros((nPolicies, len(seqList)), dtype=int)
+   for t in range(0, nTraces):
+      result[:, traceSeq[t]] += hits[:, t]
+   resultForPolicy = dict(zip(order, result.tolist()))
+   return [resultForPolicy[p] for p in range(0, nPolicies)]
+
+
+# Returns a list that contains for each policy in policySimClasses a list with the number of hits for each sequence in seqList. Deterministic QLRU
+# variants are simulated using getQLRUHits(), all other policies using getHits().
+def getHitsForPolicies(seqList, policySimClasses, assoc, cacheSetStr):
+   hits = [None] * len(policySimClasses)
+   qlruIndexes = [i for i, c in enumerate(policySimClasses) if hasattr(c, 'qlruParams')]
+   if qlruIndexes:
+      for i, h in zip(qlruIndexes, getQLRUHits(seqList, [policySimClasses[i] for i in qlruIndexes], assoc, cacheSetStr)):
+         hits[i] = h
+   for i, c in enumerate(policySimClasses):
+      if hits[i] is None:
+         hits[i] = [getHits(seq, c, assoc, cacheSetStr) for seq in seqList]
+   return hits
+
+
+# Explicit state machine of a deterministic QLRU variant for sequences without flushes. A state is a pair (occupied, bits), where occupied[w] is True
+# if way w contains a block. getTransition(state, way) returns a pair (newState, way), where way is None for misses; for misses, the returned way is
+# the way that receives the new block.
+class QLRUStateMachine(object):
+   def __init__(self, policySimClass, assoc):
+      hf, mf, rf, uf, umo = policySimClass.qlruParams
+      self.hitFunc = QLRUHitFuncs[hf]
+      self.missBits = QLRUMissFuncs[mf]()
+      self.replIdxFunc = QLRUReplIdxFuncs[rf]
+      self.updFunc = QLRUUpdFuncs[uf]
+      self.updOnMissOnly = umo
+      self.initialState = ((False,) * assoc, (3,) * assoc)
+      self.transitions = dict()
+
+   def getTransition(self, state, way):
+      transition = self.transitions.get((state, way))
+      if transition is None:
+         occupied = list(state[0])
+         bits = list(state[1])
+         if way is not None:
+            bits[way] = self.hitFunc(bits[way])
+            index = way
+         else:
+            if self.updOnMissOnly:
+               bits = self.updFunc(bits, -1)
+            index = self.replIdxFunc(bits, [(True if o else None) for o in occupied])
+            occupied[index] = True
+            bits[index] = self.missBits
+         if not self.updOnMissOnly:
+            bits = self.updFunc(bits, index)
+         transition = ((tuple(occupied), tuple(bits)), index)
+         self.transitions[(state, way)] = transition
+      return transition
+
+
+# Returns a canonical form of the minimized state machine (see QLRUStateMachine) of the QLRU variant, or None if the machine has more than maxStates
+# reachable states, or if the simulator fails in a reachable state. Variants with the same canonical form yield the same hits (and put the blocks in
+# the same ways) for all access sequences without flushes. The machine is minimized by partition refinement: the states are first partitioned by the
+# occupied ways (which determine the possible hits) and by the way that receives a new block; then, the partitions are split until the states in each
+# partition have their successors in the same partitions. The canonical form numbers the partitions in breadth-first order.
+def getMinimizedQLRUStateMachine(policySimClass, assoc, maxStates):
+   machine = QLRUStateMachine(policySimClass, assoc)
+   states = [machine.initialState]
+   stateIDs = {machine.initialState: 0}
+   successors = [] # successors[s] contains the successors for hits in the ways 0, ..., assoc-1 (-1 if the way is empty), and for a miss
+   missWays = []
+   try:
+      while len(successors) < len(states):
+         if len(states) > maxStates:
+            return None
+         state = states[len(successors)]
+         stateSuccessors = []
+         for way in range(0, assoc) + [None]:
+            if way is not None and not state[0][way]:
+               stateSuccessors.append(-1)
+               continue
+            newState, newWay = machine.getTransition(state, way)
+            newStateID = stateIDs.get(newState)
+            if newStateID is None:
+               newStateID = stateIDs[newState] = len(states)
+               states.append(newState)
+            stateSuccessors.append(newStateID)
+         successors.append(stateSuccessors)
+         missWays.append(newWay)
+   except ValueError:
+      return None
+
+   signatures = [(missWays[s], tuple(t < 0 for t in successors[s])) for s in range(0, len(states))]
+   nPartitions = 0
+   while True:
+      partitionIDs = dict()
+      partition = [partitionIDs.setdefault(signature, len(partitionIDs)) for signature in signatures]
+      if len(partitionIDs) == nPartitions:
+         break
+      nPartitions = len(partitionIDs)
+      signatures = [(partition[s],) + tuple((partition[t] if t >= 0 else -1) for t in successors[s]) for s in range(0, len(states))]
+
+   representatives = dict()
+   for s in range(0, len(states)):
+      representatives.setdefault(partition[s], s)
+   canonicalIDs = {partition[0]: 0}
+   order = [partition[0]]
+   canonical = []
+   for p in order:
+      s = representatives[p]
+      row = [missWays[s]]
+      for t in successors[s]:
+         if t < 0:
+            row.append(-1)
+            continue
+         if not partition[t] in canonicalIDs:
+            canonicalIDs[partition[t]] = len(order)
+            order.append(partition[t])
+         row.append(canonicalIDs[partition[t]])
+      canonical.append(tuple(row))
+   return tuple(canonical)
+
+
+QLRU_CLASSES_VERSION = 3
+QLRU_CLASSES_MAX_STATES = 5000
+QLRU_CLASSES_TIME_BUDGET = 30 # seconds
+
+# Returns a dict from the names of the variants in AllDetQLRUVariants to the hash of their minimized state machines for the given associativity (None if
+# the machine has more than maxStates states, see getMinimizedQLRUStateMachine()). Variants that cannot be processed before the deadline (a time.time()
+# value) are not in the dict. The results are stored on disk, so that subsequent calls continue where the previous call stopped.
+# The number of states does not decrease with the associativity (this holds for all variants for up to 6 ways), so variants that have too many states
+# for a smaller associativity are not explored again. If this assumption were wrong for some variant, the variant would only not be grouped with others.
+def getQLRUMachineHashes(assoc, maxStates, deadline):
+   fileName = os.path.join(getCacheDir('qlru'), 'machines_' + str(assoc) + '_' + str(maxStates) + '.json')
+   hashes = dict()
+   if os.path.exists(fileName):
+      with open(fileName) as f:
+         stored = json.load(f)
+      if stored['version'] == QLRU_CLASSES_VERSION:
+         hashes = {str(n): h for n, h in stored['machines'].items() if n in AllDetQLRUVariants}
+
+   names = [n for n in sorted(AllDetQLRUVariants.keys()) if n not in hashes]
+   if not names:
+      return hashes
+   smallerHashes = (getQLRUMachineHashes(assoc-1, maxStates, deadline) if assoc > 2 else dict())
+   for name in names:
+      if name in smallerHashes and smallerHashes[name] is None:
+         hashes[name] = None
+         continue
+      if time.time() > deadline:
+         break
+      canonical = getMinimizedQLRUStateMachine(AllDetQLRUVariants[name], assoc, maxStates)
+      hashes[name] = (hashlib.sha1(repr(canonical).encode('utf-8')).hexdigest() if canonical is not None else None)
+
+   tmpFile = fileName + '.' + str(os.getpid())
+   with open(tmpFile, 'w') as f:
+      json.dump({'version': QLRU_CLASSES_VERSION, 'machines': hashes}, f)
+   os.rename(tmpFile, fileName)
+   return hashes
+
+# Returns a list of the equivalence classes (as lists of names, the first name is the representative) of the variants in AllDetQLRUVariants for the
+# given associativity; variants are in the same class if their minimized state machines (see getMinimizedQLRUStateMachine()) are identical. Variants
+# whose state machines have more than maxStates states are in separate classes. If not all variants can be processed within timeBudget seconds, the
+# remaining variants are in separate classes; the next call continues with these variants (see getQLRUMachineHashes()).
+def getQLRUEquivalenceClasses(assoc, maxStates=QLRU_CLASSES_MAX_STATES, timeBudget=QLRU_CLASSES_TIME_BUDGET):
+   names = sorted(AllDetQLRUVariants.keys())
+   hashes = getQLRUMachineHashes(assoc, maxStates, time.time() + timeBudget)
+   if len(hashes) < len(names):
+      log.info(str(len(names) - len(hashes)) + ' QLRU variants not processed, time budget exceeded')
+
+   classes = OrderedDict()
+   for name in names:
+      h = hashes.get(name)
+      classes.setdefault((h if h is not None else name), []).append(name)
+   classes = list(classes.values())
+   log.info(str(len(classes)) + ' equivalence classes for ' + str(len(names)) + ' QLRU variants')
+   return classes
+
+
+def getSnapshot(policySims):
+   return {s: (sim, sim.snapshot()) for s, sim in policySims.items()}
+
+
+def restoreSnapshot(policySims, snapshot):
+   for s, (sim, state) in snapshot.items():
+      sim.restore(state)
+      policySims[s] = sim
+
+
+# Generator that yields tuples (i, prefixHits, policySims, snapshot) for i = 0, 1, ... (up to maxAge-1 if maxAge is not None), where policySims
+# contains the simulators in the state after the accesses seq N0 ... N(i-1), snapshot is a snapshot of this state (see getSnapshot()), and prefixHits
+# is the number of hits of the accesses in seq that are marked with '?'. The prefix is only simulated once; the caller has to restore the snapshot
+# after simulating additional accesses. queryBlocks is a list of the blocks that the caller accesses.
+def simulateFreshBlocks(seq, policySimClass, assoc, cacheSetList, queryBlocks, maxAge=None):
+   seq = compileSeq(seq)
+   simFactory = getSimFactory(policySimClass)
+   policySims = {s: simFactory(assoc) for s in getAllUsedCacheSets(cacheSetList, seq + compileSeq(' '.join(queryBlocks)))}
+   prefixHits = simulateSeq(seq, policySims, simFactory, assoc, cacheSetList)
+   for i in (count(0) if maxAge is None else range(0, maxAge)):
+      yield (i, prefixHits, policySims, getSnapshot(policySims))
+      simulateSeq((compileSeqElement('N' + str(i)),), policySims, simFactory, assoc, cacheSetList)
+
+
 def getAges(blocks, seq, policySimClass, assoc):
+   simFactory = getSimFactory(policySimClass)
    ages = {}
-   for block in blocks:
-      for i in count(0):
-         curSeq = seq + ' ' + ' '.join('N' + str(n) for n in range(0,i)) + ' ' + block + '?'
-         if getHits(curSeq, policySimClass, assoc, '0') == 0:
-            ages[block] = i
-            break
+   for i, prefixHits, policySims, snapshot in simulateFreshBlocks(seq, policySimClass, assoc, [0], blocks):
+      for block in blocks:
+         if not block in ages:
+            if prefixHits + simulateSeq((compileSeqElement(block + '?'),), policySims, simFactory, assoc, [0]) == 0:
+               ages[block] = i
+            restoreSnapshot(policySims, snapshot)
+      if len(ages) == len(blocks):
+         break
    return ages
 
 
 def getGraph(blocks, seq, policySimClass, assoc, maxAge, nSets=1, nRep=1, agg="med"):
+   cacheSetList = range(0, nSets)
+   simFactory = getSimFactory(policySimClass)
+   hits = {block: [[] for _ in range(0, maxAge)] for block in blocks}
+
+   # for randomized policies, the prefix is simulated separately for each repetition
+   for _ in range(0, nRep):
+      for i, prefixHits, policySims, snapshot in simulateFreshBlocks(seq, policySimClass, assoc, cacheSetList, blocks, maxAge):
+         for block in blocks:
+            hits[block][i].append(prefixHits + simulateSeq((compileSeqElement(block + '?'),), policySims, simFactory, assoc, cacheSetList))
+            restoreSnapshot(policySims, snapshot)
+
    traces = []
    for block in blocks:
       trace = []
       for i in range(0, maxAge):
-         curSeq = seq + ' ' + ' '.join('N' + str(n) for n in range(0,i)) + ' ' + block + '?'
-         hits = [getHits(curSeq, policySimClass, assoc, '0-'+str(nSets-1)) for _ in range(0, nRep)]
          if agg == "med":
-            aggValue = median(hits)
+            from numpy import median # imported here to avoid the import time if it is not needed
+            aggValue = median(hits[block][i])
          elif agg == "min":
-            aggValue = min(hits)
+            aggValue = min(hits[block][i])
          else:
-            aggValue = float(sum(hits))/nRep
+            aggValue = float(sum(hits[block][i]))/nRep
          trace.append(aggValue)
       traces.append((block, trace))
    return traces
@@ -9,9 +9,6 @@ import re
 import subprocess
 import sys
 
-from plotly.offline import plot
-import plotly.graph_objects as go
-
 from cacheLib import *
 from cacheGraph import *
 import cacheSim
@@ -20,7 +17,9 @@ import logging
 log = logging.getLogger(__name__)
 
 
-def getPermutations(level, html, cacheSets=None, getInitialAges=True, maxAge=None, cBox=1, cSlice=0):
+# If noGraphs is True, no age graphs are generated; in this case, the ages are determined using a binary search (see getAgesOfBlocks()), which requires
+# significantly fewer experiments.
+def getPermutations(level, html, cacheSets=None, getInitialAges=True, maxAge=None, cBox=1, cSlice=0, noGraphs=False):
    assoc = getCacheInfo(level).assoc
    if not maxAge:
       maxAge=2*assoc
@@ -28,47 +27,48 @@ def getPermutations(level, html, cacheSets=None, getInitialAges=True, maxAge=Non
    hitEvent = 'L' + str(level) + '_HIT'
    missEvent = 'L' + str(level) + '_MISS'
 
+   def getAges(blocks, seq):
+      if noGraphs:
+         return getAgesOfBlocks(blocks, level, seq, cacheSets=cacheSets, clearHL=True, wbinvd=True, maxAge=maxAge, cBox=cBox, cSlice=cSlice,
+                                binarySearch=True), None
+      return getAgesOfBlocks(blocks, level, seq, cacheSets=cacheSets, clearHL=True, wbinvd=True, returnNbResults=True, maxAge=maxAge, cBox=cBox,
+                             cSlice=cSlice)
+
+   def appendGraph(accSeqStr, blocks, nbDict):
+      if nbDict is None: return
+      event = (hitEvent if hitEvent in next(iter(nbDict.items()))[1][0] else missEvent)
+      traces = [(b, [nb[event] for nb in nbDict[b]]) for b in blocks]
+      html.append(getPlotlyGraphDiv(accSeqStr + ' <n fresh blocks> <block>?', '# of fresh blocks', hitEvent, traces))
+
    if getInitialAges:
       initBlocks = ['I' + str(i) for i in range(0, assoc)]
       seq = ' '.join(initBlocks)
 
-      initAges, nbDict = getAgesOfBlocks(initBlocks, level, seq, cacheSets=cacheSets, clearHL=True, wbinvd=True, returnNbResults=True, maxAge=maxAge,
-                                         cBox=cBox, cSlice=cSlice)
+      initAges, nbDict = getAges(initBlocks, seq)
 
       accSeqStr = 'Access sequence: <wbinvd> ' + seq
       print accSeqStr
       print 'Ages: {' + ', '.join(b + ': ' + str(initAges[b]) for b in initBlocks) + '}'
-
-      event = (hitEvent if hitEvent in next(iter(nbDict.items()))[1][0] else missEvent)
-      traces = [(b, [nb[event] for nb in nbDict[b]]) for b in initBlocks]
-      html.append(getPlotlyGraphDiv(accSeqStr + ' <n fresh blocks> <block>?', '# of fresh blocks', hitEvent, traces))
+      appendGraph(accSeqStr, initBlocks, nbDict)
    else:
       initBlocks = []
 
    blocks = ['B' + str(i) for i in range(0, assoc)]
    baseSeq = ' '.join(initBlocks + blocks)
 
-   ages, nbDict = getAgesOfBlocks(blocks, level, baseSeq, cacheSets=cacheSets, clearHL=True, wbinvd=True, returnNbResults=True, maxAge=maxAge,
-                                  cBox=cBox, cSlice=cSlice)
+   ages, nbDict = getAges(blocks, baseSeq)
 
    accSeqStr = 'Access sequence: <wbinvd> ' + baseSeq
    print accSeqStr
    print 'Ages: {' + ', '.join(b + ': ' + str(ages[b]) for b in blocks) + '}'
-
-   event = (hitEvent if hitEvent in next(iter(nbDict.items()))[1][0] else missEvent)
-   traces = [(b, [nb[event] for nb in nbDict[b]]) for b in blocks]
-   html.append(getPlotlyGraphDiv(accSeqStr + ' <n fresh blocks> <block>?', '# of fresh blocks', hitEvent, traces))
+   appendGraph(accSeqStr, blocks, nbDict)
 
    blocksSortedByAge = [a[0] for a in sorted(ages.items(), key=lambda x: -x[1])] # most recent block first
 
    for permI, permBlock in enumerate(blocksSortedByAge):
       seq = baseSeq + ' ' + permBlock
-      permAges, nbDict = getAgesOfBlocks(blocks, level, seq, cacheSets=cacheSets, clearHL=True, wbinvd=True, returnNbResults=True, maxAge=maxAge,
-                                         cBox=cBox, cSlice=cSlice)
-
-      accSeqStr = 'Access sequence: <wbinvd> ' + seq
-      traces = [(b, [nb[event] for nb in nbDict[b]]) for b in blocks]
-      html.append(getPlotlyGraphDiv(accSeqStr + ' <n fresh blocks> <block>?', '# of fresh blocks', hitEvent, traces))
+      permAges, nbDict = getAges(blocks, seq)
+      appendGraph('Access sequence: <wbinvd> ' + seq, blocks, nbDict)
 
       perm = [-1] * assoc
       for bi, b in enumerate(blocksSortedByAge):
@@ -88,6 +88,7 @@ def main():
    parser.add_argument("-maxAge", help="Maximum age", type=int)
    parser.add_argument("-cBox", help="cBox (default: 1)", type=int, default=1)
    parser.add_argument("-slice", help="Slice (within the cBox) (default: 0)", type=int, default=0)
+   parser.add_argument("-noGraphs", help="Do not generate age graphs; the ages are then determined using a binary search", action='store_true')
    parser.add_argument("-sim", help="Simulate the given policy instead of running the experiment on the hardware")
    parser.add_argument("-simAssoc", help="Associativity of the simulated cache (default: 8)", type=int, default=8)
    parser.add_argument("-logLevel", help="Log level (DEBUG, INFO, WARNING, ERROR, CRITICAL)", default='WARNING')
@@ -101,7 +102,8 @@ def main():
 
       html = ['<html>', '<head>',  '<title>' + title + '</title>', '<script src="https://cdn.plot.ly/plotly-latest.min.js"></script>', '</head>', '<body>']
       html += ['<h3>' + title + '</h3>']
-      getPermutations(args.level, html, cacheSets=args.sets, getInitialAges=(not args.noInit), maxAge=args.maxAge, cBox=args.cBox, cSlice=args.slice)
+      getPermutations(args.level, html, cacheSets=args.sets, getInitialAges=(not args.noInit), maxAge=args.maxAge, cBox=args.cBox, cSlice=args.slice,
+                      noGraphs=args.noGraphs)
       html += ['</body>', '</html>']
 
       with open(args.output ,'w') as f:
@@ -3,8 +3,6 @@ import argparse
 import random
 import sys
 
-from numpy import median
-
 from cacheLib import *
 import cacheSim
 
@@ -68,6 +66,8 @@ def main():
    parser.add_argument("-best", help="Find the best matching policy (Default: abort if no policy agrees with all results)", action='store_true')
    parser.add_argument("-randPolicies", help="Test randomized policies", action='store_true')
    parser.add_argument("-allQLRUVariants", help="Test all QLRU variants", action='store_true')
+   parser.add_argument("-qlruClasses", help="With -allQLRUVariants, simulate only one variant of each class of equivalent variants (the classes are "
+                                            "computed incrementally, for at most 30 seconds per run, and cached on disk)", action='store_true')
    parser.add_argument("-assoc", help="Override the associativity", type=int)
    parser.add_argument("-initSeq", help="Adds an initialization sequence to each sequence")
    parser.add_argument("-nRandSeq", help="Number of random sequences (default: 100)", type=int, default=100)
@@ -76,6 +76,8 @@ def main():
    parser.add_argument("-output", help="Output file name", default='replPolicy.html')
    args = parser.parse_args()
 
+   from numpy import median # not imported at the top to keep the startup time (e.g., for -h) low
+
    logging.basicConfig(stream=sys.stdout, format='%(message)s', level=logging.getLevelName(args.logLevel))
 
    policies = sorted(cacheSim.CommonPolicies.keys())
@@ -112,9 +114,22 @@ def main():
 
    seqList = []
    seqList.extend(getRandomSeq(args.lRandSeq) for _ in range(0,args.nRandSeq))
-
-   for seq in seqList:
-      fullSeq = ((args.initSeq + ' ') if args.initSeq else '') + seq
+   fullSeqList = [((args.initSeq + ' ') if args.initSeq else '') + seq for seq in seqList]
+
+   if not args.randPolicies:
+      # the deterministic policies are simulated for all sequences at once; with -qlruClasses, only one representative of each class of equivalent
+      # QLRU variants is simulated (if the sequences contain no flushes)
+      representative = {p: p for p in policies}
+      if args.allQLRUVariants and args.qlruClasses and not any(el.flush for seq in fullSeqList for el in compileSeq(seq)):
+         for qlruClass in cacheSim.getQLRUEquivalenceClasses(assoc):
+            for p in qlruClass:
+               if p in representative:
+                  representative[p] = qlruClass[0]
+      simPolicies = sorted(set(representative.values()))
+      simHits = dict(zip(simPolicies, cacheSim.getHitsForPolicies(fullSeqList, [cacheSim.AllPolicies[p] for p in simPolicies], assoc, args.sets)))
+      simHits = {p: simHits[representative[p]] for p in policies}
+
+   for seqI, (seq, fullSeq) in enumerate(zip(seqList, fullSeqList)):
       print fullSeq
 
       html += ['<tr><td>' + fullSeq + '</td>']
@@ -124,7 +139,7 @@ def main():
       outp = ''
       for p in policies:
          if not args.randPolicies:
-            sim = cacheSim.getHits(fullSeq, cacheSim.AllPolicies[p], assoc, args.sets)
+            sim = simHits[p][seqI]
 
             if sim not in actualHits:
                possiblePolicies.discard(p)
@@ -2,9 +2,6 @@
 import argparse
 import random
 
-from plotly.offline import plot
-import plotly.graph_objects as go
-
 from cacheLib import *
 
 import logging
@@ -22,6 +19,10 @@ def main():
    parser.add_argument("-logLevel", help="Log level (DEBUG, INFO, WARNING, ERROR, CRITICAL)", default='INFO')
    args = parser.parse_args()
 
+   # plotly is imported here (and not at the top), as importing it takes a significant amount of time
+   from plotly.offline import plot
+   import plotly.graph_objects as go
+
    logging.basicConfig(stream=sys.stdout, format='%(message)s', level=logging.getLevelName(args.logLevel))
 
    assoc = getCacheInfo(3).assoc
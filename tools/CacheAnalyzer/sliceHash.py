@@ -0,0 +1,88 @@
+#!/usr/bin/python
+import argparse
+import random
+
+from cacheLib import *
+
+import logging
+log = logging.getLogger(__name__)
+
+
+# Solves a system of linear equations over GF(2). Each equation is a pair (row, value), where row is a bitmask of the coefficients; the function returns
+# a bitmask x such that the parity of (row & x) is value for all equations, or None if there is no solution. Free variables are set to 0.
+def solveGF2(equations):
+   pivots = dict() # highest bit -> (row, value)
+   for row, value in equations:
+      while row:
+         h = row.bit_length() - 1
+         if not h in pivots:
+            pivots[h] = (row, value)
+            break
+         pRow, pValue = pivots[h]
+         row ^= pRow
+         value ^= pValue
+      else:
+         if value:
+            return None
+
+   x = 0
+   for h in sorted(pivots):
+      row, value = pivots[h]
+      if (bin(row & x).count('1') & 1) != value:
+         x |= (1 << h)
+   return x
+
+
+# samples is a list of (physical address, CBox) pairs; returns the masks for getCBoxFromSliceHash(), or None if the CBoxes cannot be described by a
+# linear function of the address bits (e.g., if the number of CBoxes is not a power of 2)
+def learnSliceHash(samples, nCBoxes):
+   nBits = max(1, (nCBoxes-1).bit_length())
+   lineMask = ~(getCacheInfo(1).lineSize-1)
+   masks = []
+   for i in range(0, nBits):
+      mask = solveGF2([((addr & lineMask) | 1, (cBox >> i) & 1) for addr, cBox in samples])
+      if mask is None:
+         return None
+      masks.append(mask)
+   return masks
+
+
+def main():
+   parser = argparse.ArgumentParser(description='Learns the function that maps physical addresses to L3 slices (CBoxes)')
+   parser.add_argument("-nSamples", help="Number of addresses used for learning the function (Default: 300)", type=int, default=300)
+   parser.add_argument("-nVerify", help="Number of additional addresses used for verifying the function (Default: 100)", type=int, default=100)
+   parser.add_argument("-logLevel", help="Log level (DEBUG, INFO, WARNING, ERROR, CRITICAL)", default='INFO')
+   args = parser.parse_args()
+
+   logging.basicConfig(stream=sys.stdout, format='%(message)s', level=logging.getLevelName(args.logLevel))
+
+   if getR14LayoutID() is None:
+      print 'The physical address of the R14 area is not known (the kernel module might be too old)'
+      exit(1)
+
+   lineSize = getCacheInfo(1).lineSize
+   addresses = random.sample(xrange(0, getR14Size() // lineSize), args.nSamples + args.nVerify)
+   addresses = [a * lineSize for a in addresses]
+   cBoxes = getCBoxesOfAddresses(addresses)
+   samples = [(getR14PhysicalAddress() + addr, cBox) for addr, cBox in zip(addresses, cBoxes)]
+
+   masks = learnSliceHash(samples[:args.nSamples], getNCBoxUnits())
+   if masks is None:
+      print 'The CBoxes cannot be described by a linear function of the address bits'
+      exit(1)
+
+   for i, mask in enumerate(masks):
+      bits = [b for b in range(1, mask.bit_length()) if mask & (1 << b)]
+      print 'Bit ' + str(i) + ': ' + ' XOR '.join('a' + str(b) for b in bits) + (' XOR 1' if mask & 1 else '')
+
+   nErrors = sum(1 for addr, cBox in samples[args.nSamples:] if getCBoxFromSliceHash(masks, addr) != cBox)
+   if nErrors > 0:
+      print 'Verification failed for ' + str(nErrors) + ' of ' + str(args.nVerify) + ' addresses'
+      exit(1)
+
+   storeSliceHash(masks)
+   print 'Verified with ' + str(args.nVerify) + ' addresses; the function is now used by cacheLib'
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,6 @@
 import argparse
 import math
 
-from plotly.offline import plot
-import plotly.graph_objects as go
-
 from cacheLib import *
 
 def main():
@@ -13,9 +10,14 @@ def main():
    parser.add_argument("-startSize", help="Start size of the memory area (in kB) (Default: 4)", type=int, default=4)
    parser.add_argument("-endSize", help="End size of the memory area (in kB) (Default: 32768)", type=int, default=32768)
    parser.add_argument("-loop", help="Loop count (Default: 100)", type=int, default=100)
+   parser.add_argument("-calibrate", help="Use the smallest loop count (up to the value of -loop) for which the results converge", action='store_true')
    parser.add_argument("-output", help="Output file name", default='strideGraph.html')
    args = parser.parse_args()
 
+   # plotly is imported here (and not at the top), as importing it takes a significant amount of time
+   from plotly.offline import plot
+   import plotly.graph_objects as go
+
    resetNanoBench()
    setNanoBenchParameters(config=getDefaultCacheConfig(), nMeasurements=1, warmUpCount=0, unrollCount=1, loopCount=args.loop, basicMode=False, noMem=True)
 
@@ -32,9 +34,15 @@ def main():
          xValues.append(str(x))
          addresses = range(0, x, args.stride)
          nAddresses.append(len(addresses))
-         ec = getCodeForAddressLists([AddressList(addresses, False, False, False)], wbinvd=True)
+         ec = getCodeForAddressLists([AddressList(addresses, False, False, False)], wbinvd=True, useR14Image=True)
+         if ec.r14Image is not None:
+            setR14Image(ec.r14Image)
+         if args.calibrate:
+            calibrateRepetitions(code=ec.code, init=ec.init, oneTimeInit=ec.oneTimeInit, useLoop=True, maxCount=args.loop)
          nbDicts.append(runNanoBench(code=ec.code, init=ec.init, oneTimeInit=ec.oneTimeInit))
       pt *= 2
+   if supportsR14Image():
+      setR14Image(None)
 
    title = cpuid.cpu_name(cpuid.CPUID())
    html = ['<html>', '<head>', '<title>' + title + '</title>', '<script src="https://cdn.plot.ly/plotly-latest.min.js">', '</script>', '</head>', '<body>']
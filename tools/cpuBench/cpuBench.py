@@ -32,6 +32,7 @@ iacaCMDLine = ''
 iacaVersion = ''
 arch = ''
 debugOutput = False
+calibrateRepCounts = False # if True, the unroll and loop counts for the throughput experiments are determined with calibrateRepetitions()
 supportsAVX = False
 instrNodeList = [] # list of all XML instruction nodes that are not filtered out
 instrNodeDict = {} # dict from instrNode.attrib['string'] to instrNode
@@ -133,21 +134,9 @@ def getRegMemInit(instrNode, opRegDict, memOffset):
 
    return init
 
-nExperiments = 0
-def runExperiment(instrNode, instrCode, init=None, unrollCount=500, loopCount=0, warmUpCount=10, basicMode=False, htmlReports=None, maxRepeat=1):
-   # we use a default warmUpCount of 10, as ICL requires at least about that much before memory operations run at full speed
-
-   if init is None: init = []
-   localHtmlReports = []
-
-   global nExperiments
-   nExperiments += 1
-
+# returns the normalized code and the init code that runExperiment() uses for the given instruction
+def getExperimentCode(instrNode, instrCode, init):
    instrCode = re.sub(';+', '; ', instrCode.strip('; '))
-   if debugOutput: print 'instr: ' + instrCode
-   codeObjFile = '/tmp/ramdisk/code.o'
-   assemble(instrCode, codeObjFile, asmFile='/tmp/ramdisk/code.s')
-   localHtmlReports.append('<li>Code: <pre>' + getMachineCode(codeObjFile) + '</pre></li>\n')
 
    init = list(OrderedDict.fromkeys(init)) # remove duplicates while maintaining the order
    initCode = '; '.join(init)
@@ -159,9 +148,28 @@ def runExperiment(instrNode, instrCode, init=None, unrollCount=500, loopCount=0,
       # the instruction needs to be used at least twice in the body of the loop
       # putting it to one_time_init is not sufficient, independently of the loop count, example:
       # "VPTEST YMM0, YMM1;CMOVZ R13, R15; VPBROADCASTQ ZMM0, R13" on CNL
-      avxInitCode = 'MOV R15, 10000; L: VADDPS {0}, {1}, {1}; VADDPS {0}, {1}, {1}; DEC R15; JNZ L; '.format(reg + '0', reg + '1')
+      # we use a local label so that the code can be assembled together with other snippets by assembleMany()
+      avxInitCode = 'MOV R15, 10000; 2: VADDPS {0}, {1}, {1}; VADDPS {0}, {1}, {1}; DEC R15; JNZ 2b; '.format(reg + '0', reg + '1')
       initCode = avxInitCode + initCode
 
+   return (instrCode, initCode)
+
+nExperiments = 0
+def runExperiment(instrNode, instrCode, init=None, unrollCount=500, loopCount=0, warmUpCount=10, basicMode=False, htmlReports=None, maxRepeat=1):
+   # we use a default warmUpCount of 10, as ICL requires at least about that much before memory operations run at full speed
+
+   if init is None: init = []
+   localHtmlReports = []
+
+   global nExperiments
+   nExperiments += 1
+
+   with timed('code generation'):
+      instrCode, initCode = getExperimentCode(instrNode, instrCode, init)
+      if debugOutput: print 'instr: ' + instrCode
+      codeBinFile = getBinFileForCode(instrCode)
+   localHtmlReports.append('<li>Code: <pre>' + getMachineCode(codeBinFile) + '</pre></li>\n')
+
    nanoBenchCmd = 'sudo ./kernel-nanoBench.sh'
    nanoBenchCmd += ' -unroll ' + str(unrollCount)
    if loopCount > 0: nanoBenchCmd += ' -loop ' + str(loopCount)
@@ -169,11 +177,10 @@ def runExperiment(instrNode, instrCode, init=None, unrollCount=500, loopCount=0,
    nanoBenchCmd += ' -warm_up_count ' + str(warmUpCount)
    nanoBenchCmd += ' -asm &quot;' + instrCode + '&quot;'
 
-   initObjFile = None
+   initBinFile = None
    if initCode:
       if debugOutput: print 'init: ' + initCode
-      initObjFile = '/tmp/ramdisk/init.o'
-      assemble(initCode, initObjFile, asmFile='/tmp/ramdisk/init.s')
+      initBinFile = getBinFileForCode(initCode)
       localHtmlReports.append('<li>Init: <pre>' + re.sub(';[ \t]*(.)', r';\n\1', initCode) + '</pre></li>\n')
       nanoBenchCmd += ' -asm_init &quot;' + initCode + '&quot;'
 
@@ -181,18 +188,19 @@ def runExperiment(instrNode, instrCode, init=None, unrollCount=500, loopCount=0,
 
    setNanoBenchParameters(unrollCount=unrollCount, loopCount=loopCount, warmUpCount=warmUpCount, basicMode=basicMode)
 
-   ret = runNanoBench(codeObjFile=codeObjFile, initObjFile=initObjFile)
+   ret = runNanoBench(codeBinFile=codeBinFile, initBinFile=initBinFile)
 
-   localHtmlReports.append('<li>Results:\n<ul>\n')
-   for evt, value in ret.items():
-      if 'RDTSC' in evt: continue
-      if evt == 'UOPS':
-         if arch in ['CON', 'WOL']: evt = 'RS_UOPS_DISPATCHED'
-         elif arch in ['NHM', 'WSM']: evt = 'UOPS_RETIRED.ANY'
-         elif arch in ['SNB', 'IVB', 'HSW', 'BDW']: evt = 'UOPS_RETIRED.ALL'
-         elif arch in ['SKL', 'SKX', 'KBL', 'CFL', 'CNL', 'ICL']: evt = 'UOPS_EXECUTED.THREAD'
-      localHtmlReports.append('<li>' + evt + ': ' + str(value) + '</li>\n')
-   localHtmlReports.append('</ul>\n</li>')
+   with timed('html report'):
+      localHtmlReports.append('<li>Results:\n<ul>\n')
+      for evt, value in ret.items():
+         if 'RDTSC' in evt: continue
+         if evt == 'UOPS':
+            if arch in ['CON', 'WOL']: evt = 'RS_UOPS_DISPATCHED'
+            elif arch in ['NHM', 'WSM']: evt = 'UOPS_RETIRED.ANY'
+            elif arch in ['SNB', 'IVB', 'HSW', 'BDW']: evt = 'UOPS_RETIRED.ALL'
+            elif arch in ['SKL', 'SKX', 'KBL', 'CFL', 'CNL', 'ICL']: evt = 'UOPS_EXECUTED.THREAD'
+         localHtmlReports.append('<li>' + evt + ': ' + str(value) + '</li>\n')
+      localHtmlReports.append('</ul>\n</li>')
 
    if arch in ['NHM', 'WSM'] and 'UOPS_PORT3' in ret:
       # Workaround for broken port4 and port5 counters
@@ -229,10 +237,17 @@ def writeFile(fileName, content):
       f.write(content+"\n");
 
 
-def getMachineCode(objFile):
+# binFile is expected to be a file from the (content-addressed) cache of assembled code; thus, the result can be reused for identical file names.
+def getMachineCode(binFile):
+   if not hasattr(getMachineCode, 'machineCodeDict'):
+      getMachineCode.machineCodeDict = dict()
+   if binFile in getMachineCode.machineCodeDict:
+      return getMachineCode.machineCodeDict[binFile]
    try:
-      machineCode = subprocess.check_output(['objdump', '-M', 'intel', '-d', objFile])
-      return machineCode.partition('<.text>:\n')[2]
+      with timed('objdump'):
+         machineCode = subprocess.check_output(['objdump', '-M', 'intel', '-D', '-b', 'binary', '-m', 'i386:x86-64', binFile])
+      getMachineCode.machineCodeDict[binFile] = machineCode.partition('<.data>:\n')[2]
+      return getMachineCode.machineCodeDict[binFile]
    except subprocess.CalledProcessError as e:
       print "Error (getMachineCode): " + str(e)
 
@@ -903,6 +918,21 @@ def fancyRound(cycles):
 
 TPResult = namedtuple('TPResult', ['TP', 'TP_noDepBreaking_noLoop', 'TP_single', 'uops', 'fused_uops', 'divCycles', 'ILD_stalls', 'dec0', 'config', 'unblocked_ports'])
 
+# returns the numbers of independent instructions that getThroughputAndUops() uses for the given config
+def getTPInstrCounts(config):
+   n = len(config.independentInstrs)
+   return sorted(set([1, min(4, n), min(8, n), n]))
+
+# returns the code and the init list that getThroughputAndUops() uses for the first ic independent instructions of the given config
+def getTPCode(config, ic, useDepBreakingInstrs):
+   instrIList = config.independentInstrs
+   if useDepBreakingInstrs:
+      instrStr = ';'.join([config.depBreakingInstrs+';'+config.preInstrCode+';'+i.asm for i in instrIList[0:ic]])
+   else:
+      instrStr = ';'.join([config.preInstrCode+';'+i.asm for i in instrIList[0:ic]])
+   init = list(chain.from_iterable(i.regMemInit for i in instrIList[0:ic])) + config.init
+   return (instrStr, init)
+
 # returns TPResult
 # port usages are averages (when no ports are blocked by other instructions)
 def getThroughputAndUops(instrNode, useDistinctRegs, htmlReports):
@@ -986,22 +1016,27 @@ def getThroughputAndUops(instrNode, useDistinctRegs, htmlReports):
       ILD_stalls = 0
       dec0 = False
       ports_dict = {}
+
+      # assemble the code for all experiments at once
+      codeList = []
+      for config in configs:
+         for ic in getTPInstrCounts(config):
+            for useDepBreakingInstrs in ([False, True] if config.depBreakingInstrs else [False]):
+               codeList.extend(getExperimentCode(instrNode, *getTPCode(config, ic, useDepBreakingInstrs)))
+      assembleMany(codeList)
+
       for config in configs:
          if config.note: htmlReports.append('<h2>' + config.note + '</h2>\n')
 
          instrIList = config.independentInstrs
-         for ic in sorted(set([1, min(4, len(instrIList)), min(8, len(instrIList)), len(instrIList)])):
+         for ic in getTPInstrCounts(config):
             if len(instrIList) > 1: htmlReports.append('<h3 style="margin-left: 25px">With ' + str(ic) + ' independent instruction' + ('s' if ic>1 else '') + '</h3>\n')
             htmlReports.append('<div style="margin-left: 50px">')
 
             for useDepBreakingInstrs in ([False, True] if config.depBreakingInstrs else [False]):
                if useDepBreakingInstrs:
-                  instrStr = ';'.join([config.depBreakingInstrs+';'+config.preInstrCode+';'+i.asm for i in instrIList[0:ic]])
                   htmlReports.append('<h4>With additional dependency-breaking instructions</h4>\n')
-               else:
-                  instrStr = ';'.join([config.preInstrCode+';'+i.asm for i in instrIList[0:ic]])
-
-               init = list(chain.from_iterable(i.regMemInit for i in instrIList[0:ic])) + config.init
+               instrStr, init = getTPCode(config, ic, useDepBreakingInstrs)
 
                for repType in ['unrollOnly', 'loopSmall', 'loopBig']:
                   if minTP < sys.maxint and minTP > 100: continue
@@ -1018,6 +1053,13 @@ def getThroughputAndUops(instrNode, useDistinctRegs, htmlReports):
                      if repType == 'loopBig':
                         unrollCount *= 10
 
+                  if calibrateRepCounts:
+                     # the counts from above are used as upper bounds
+                     calInstrCode, calInitCode = getExperimentCode(instrNode, instrStr, init)
+                     setNanoBenchParameters(warmUpCount=10, basicMode=(loopCount>0))
+                     unrollCount, loopCount = calibrateRepetitions(code=calInstrCode, init=calInitCode, useLoop=(loopCount>0), unrollCount=unrollCount,
+                                                                   maxCount=(loopCount if loopCount>0 else unrollCount))
+
                   if loopCount > 0:
                      htmlReports.append('<h4>With loop_count=' + str(loopCount) + ' and unroll_count=' + str(unrollCount) + '</h4>\n')
                   else:
@@ -2534,6 +2576,9 @@ def main():
    parser.add_argument("-tpInput", help=".pickle file with TP data")
    parser.add_argument("-latInput", help=".pickle file with latency data")
    parser.add_argument("-debug", help="Debug output", action='store_true')
+   parser.add_argument("-calibrate", help="Determine the unroll and loop counts for the throughput experiments automatically", action='store_true')
+   parser.add_argument("-timing", help="Print the time spent in the different phases at exit; if a file name is specified, a trace in the Chrome trace format"
+                                       " is written to it", nargs='?', const='')
 
    args = parser.parse_args()
 
@@ -2550,6 +2595,12 @@ def main():
    global debugOutput
    debugOutput = args.debug
 
+   global calibrateRepCounts
+   calibrateRepCounts = args.calibrate
+
+   if args.timing is not None:
+      enableTiming(args.timing)
+
    global useIACA
    if args.iaca:
       useIACA = True
@@ -1,6 +1,5 @@
 import re
 import sys
-from scipy.optimize import linprog
 
 def addHTMLCodeForOperands(instrNode, html):
    if instrNode.find('operand') is not None:
@@ -94,6 +93,7 @@ def getTP_LP(PU):
 
    c = [0]*(len(PU)*len(ports)) + [1]
 
+   from scipy.optimize import linprog # imported here, as importing scipy is slow
    res = linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=b_eq)
    return round(res.fun, 2)
 
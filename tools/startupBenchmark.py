@@ -0,0 +1,55 @@
+#!/usr/bin/python
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+toolsDir = os.path.dirname(os.path.abspath(__file__))
+
+# (directory, command line); the commands must not require the kernel module or the performance counters
+commands = [
+   ('CacheAnalyzer', ['cacheSeq.py', '-h']),
+   ('CacheAnalyzer', ['cacheGraph.py', '-h']),
+   ('CacheAnalyzer', ['hitMiss.py', '-h']),
+   ('CacheAnalyzer', ['permPolicy.py', '-h']),
+   ('CacheAnalyzer', ['replPolicy.py', '-h']),
+   ('CacheAnalyzer', ['setDueling.py', '-h']),
+   ('CacheAnalyzer', ['strideGraph.py', '-h']),
+   ('CacheAnalyzer', ['cacheInfo.py', '-h']),
+   ('CacheAnalyzer', ['cacheSeq.py', '-seq', 'A B C D E A?', '-sim', 'LRU', '-simAssoc', '4', '-sets', '0']),
+   ('CacheAnalyzer', ['hitMiss.py', '-seq', 'A B C D E A?', '-sim', 'LRU', '-simAssoc', '4', '-sets', '0']),
+   ('cpuBench', ['cpuBench.py', '-h']),
+]
+
+# Returns the minimum wall-clock time (in seconds) of nRuns runs of the command.
+def getStartupTime(directory, cmd, nRuns):
+   minTime = None
+   for _ in range(0, nRuns):
+      start = time.time()
+      with open(os.devnull, 'w') as devnull:
+         subprocess.check_call([sys.executable] + cmd, cwd=os.path.join(toolsDir, directory), stdout=devnull)
+      duration = time.time() - start
+      minTime = duration if minTime is None else min(minTime, duration)
+   return minTime
+
+def main():
+   parser = argparse.ArgumentParser(description='Checks that the startup time of the tools (for -h and for simulations) is within a budget')
+   parser.add_argument("-budget", help="Maximum time (in seconds) per command (Default: 0.5)", type=float, default=0.5)
+   parser.add_argument("-nRuns", help="Number of runs per command; the minimum time is used (Default: 3)", type=int, default=3)
+   args = parser.parse_args()
+
+   overBudget = False
+   for directory, cmd in commands:
+      t = getStartupTime(directory, cmd, args.nRuns)
+      status = 'OK'
+      if t > args.budget:
+         status = 'OVER BUDGET'
+         overBudget = True
+      print '{:>7.3f}s  {:<12} {}  {}'.format(t, status, os.path.join(directory, cmd[0]), ' '.join(cmd[1:]))
+
+   if overBudget:
+      exit(1)
+
+if __name__ == "__main__":
+    main()
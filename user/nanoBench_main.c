@@ -44,6 +44,40 @@ void print_usage() {
     printf("  -usr <n>:                       If 1, counts events at a privilege level greater than 0.\n");
     printf("  -os <n>:                        If 1, counts events at a privilege level 0.\n");
     printf("  -debug:                         Generate a breakpoint trap after running the code to be benchmarked.\n");
+    printf("  -raw:                           Outputs the results of all measurements instead of the aggregated results.\n");
+}
+
+int raw = 0;
+
+// Prints the result with the given index in the measurement_results arrays. If raw is set, the results of all measurements are printed in the format
+// "desc: n_rep; results of the main run; results of the base run".
+void print_single_result(char* desc, int counter) {
+    if (raw) {
+        printf("%s: %lld;", desc, (long long)get_n_rep());
+        for (int i=0; i<n_measurements; i++) {
+            printf(" %lld", (long long)measurement_results[counter][i]);
+        }
+        printf(";");
+        for (int i=0; i<n_measurements; i++) {
+            printf(" %lld", (long long)measurement_results_base[counter][i]);
+        }
+        printf("\n");
+    } else {
+        char buf[100];
+        printf("%s", compute_result_str(buf, sizeof(buf), desc, counter));
+    }
+}
+
+// Prints the result for the counter, followed by the results for the regions of the code (with the description "desc (region i)").
+void print_result(char* desc, int counter) {
+    print_single_result(desc, counter);
+
+    size_t n_regions = get_n_regions();
+    for (size_t r=0; r<n_regions; r++) {
+        char region_desc[100];
+        snprintf(region_desc, sizeof(region_desc), "%s (region %zu)", desc, r);
+        print_single_result(region_desc, REGION_RESULT_INDEX(counter, r));
+    }
 }
 
 size_t mmap_file(char* filename, char** content) {
@@ -88,6 +122,7 @@ int main(int argc, char **argv) {
         {"usr", required_argument, 0, 'r'},
         {"os", required_argument, 0, 's'},
         {"debug", no_argument, &debug, 1},
+        {"raw", no_argument, &raw, 1},
         {"help", no_argument, 0, 'h'},
         {0, 0, 0, 0}
     };
@@ -153,6 +188,11 @@ int main(int argc, char **argv) {
         return 1;
     }
 
+    if (count_region_markers() > MAX_REGIONS) {
+        fprintf(stderr, "Error: the code contains more than %d region markers\n", MAX_REGIONS);
+        return 1;
+    }
+
     if (config_file_name) {
         char* config_mmap;
         size_t len = mmap_file(config_file_name, &config_mmap);
@@ -217,7 +257,7 @@ int main(int argc, char **argv) {
     runtime_rsi += RUNTIME_R_SIZE/2;
     runtime_rsp += RUNTIME_R_SIZE/2;
 
-    for (int i=0; i<MAX_PROGRAMMABLE_COUNTERS; i++) {
+    for (int i=0; i<N_RESULT_ARRAYS; i++) {
         measurement_results[i] = malloc(n_measurements*sizeof(int64_t));
         measurement_results_base[i] = malloc(n_measurements*sizeof(int64_t));
         if (!measurement_results[i] || !measurement_results_base[i]) {
@@ -234,7 +274,6 @@ int main(int argc, char **argv) {
     long base_loop_count = (basic_mode?0:loop_count);
     long main_loop_count = loop_count;
 
-    char buf[100];
     char* measurement_template;
 
     if (is_AMD_CPU) {
@@ -252,7 +291,7 @@ int main(int argc, char **argv) {
     }
 
     create_and_run_one_time_init_code();
-    run_warmup_experiment(measurement_template);
+    run_warmup_experiment(measurement_template, is_AMD_CPU?1:4);
 
     if (is_AMD_CPU) {
         run_experiment(measurement_template, measurement_results_base, 1, base_unroll_count, base_loop_count);
@@ -265,7 +304,7 @@ int main(int argc, char **argv) {
             print_all_measurement_results(measurement_results, 1);
         }
 
-        printf("%s", compute_result_str(buf, sizeof(buf), "RDTSC", 0));
+        print_result("RDTSC", 0);
     } else {
         configure_perf_ctrs_FF(usr, os);
 
@@ -279,10 +318,10 @@ int main(int argc, char **argv) {
             print_all_measurement_results(measurement_results, 4);
         }
 
-        printf("%s", compute_result_str(buf, sizeof(buf), "RDTSC", 0));
-        printf("%s", compute_result_str(buf, sizeof(buf), "Instructions retired", 1));
-        printf("%s", compute_result_str(buf, sizeof(buf), "Core cycles", 2));
-        printf("%s", compute_result_str(buf, sizeof(buf), "Reference cycles", 3));
+        print_result("RDTSC", 0);
+        print_result("Instructions retired", 1);
+        print_result("Core cycles", 2);
+        print_result("Reference cycles", 3);
     }
 
     /*************************************
@@ -329,7 +368,7 @@ int main(int argc, char **argv) {
         }
 
         for (int c=0; c < n_programmable_counters && i + c < n_pfc_configs; c++) {
-            if (!pfc_configs[i+c].invalid) printf("%s", compute_result_str(buf, sizeof(buf), pfc_configs[i+c].description, c));
+            if (!pfc_configs[i+c].invalid) print_result(pfc_configs[i+c].description, c);
         }
     }
 
@@ -344,7 +383,7 @@ int main(int argc, char **argv) {
     free(runtime_rsi - RUNTIME_R_SIZE/2);
     free(runtime_rsp - RUNTIME_R_SIZE/2);
 
-    for (int i=0; i<MAX_PROGRAMMABLE_COUNTERS; i++) {
+    for (int i=0; i<N_RESULT_ARRAYS; i++) {
         free(measurement_results[i]);
         free(measurement_results_base[i]);
     }